@@ -0,0 +1,153 @@
+import gzip
+import hashlib
+import json
+from datetime import datetime
+
+from flask import Blueprint, Response, abort, current_app, jsonify, request
+
+from cache import catalog_cache
+from database_manager import *
+from views import catalog_filter_arguments, catalog_filters
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+api = Blueprint('api', __name__)
+
+API_MAX_PAGE_SIZE = 100
+# Responses smaller than this are sent uncompressed, the saving doesn't pay for the work
+MIN_COMPRESSED_SIZE = 512
+PRODUCT_LIST_FIELDS = tuple(column.key for column in CATALOG_COLUMNS)
+PRODUCT_FIELDS = tuple(column.key for column in PRODUCT_COLUMNS)
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def encode(payload):
+    return json.dumps(payload, separators=(',', ':'), ensure_ascii=False, default=json_default).encode()
+
+
+def preferred_encoding():
+    """
+    Content coding of the response: brotli when the client accepts it, else gzip, else none
+    """
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and brotli is None:
+            continue
+        if request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+def requested_fields(available):
+    """
+    Fields of the ?fields=name,price sparse fieldset, every field when the parameter is missing
+    """
+    fields = tuple(field.strip() for field in request.args.get('fields', '').split(',') if field.strip())
+    if not fields:
+        return available
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        abort(400, f"Unknown fields {', '.join(unknown)}, available fields are {', '.join(available)}")
+    return fields
+
+
+def cached_json(key, build):
+    """
+    JSON response of build(), whose body, strong ETag and compressed variants are kept in the catalog cache.
+    The ETag is the hash of the uncompressed body, suffixed with the content coding, since every coding is
+    a different representation. Browsers holding the current version get 304 Not Modified.
+    """
+    encoding = preferred_encoding()
+
+    def load():
+        body = encode(build())
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        if encoding is None or len(body) < MIN_COMPRESSED_SIZE:
+            return body, etag, None
+        return compress(body, encoding), f"{etag}-{encoding}", encoding
+
+    body, etag, content_encoding = catalog_cache.get_or_load(("api", key, encoding), load)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+        if content_encoding:
+            response.headers['Content-Encoding'] = content_encoding
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@api.errorhandler(400)
+@api.errorhandler(404)
+def json_error(error):
+    return jsonify(
+        {
+            "success": False,
+            "message": error.description
+        }
+    ), error.code
+
+
+@api.route('/products')
+def products():
+    """
+    One page of the catalog, ?after=<next of the previous page>&limit=<page size>&fields=<field,...>,
+    filtered like the /products page
+    """
+    fields, filters, after, page_size = catalog_page_arguments()
+    return catalog_page_response(
+        fields, filters, after, page_size,
+        lambda: db_get_all_products(after=after, page_size=page_size, **catalog_filter_arguments(filters))
+    )
+
+
+def catalog_page_arguments():
+    """
+    (fields, filters, after, page size) of a /products request, shared with the async route of asgi.py
+    """
+    fields = requested_fields(PRODUCT_LIST_FIELDS)
+    page_size = max(1, min(request.args.get('limit', current_app.config['PRODUCTS_PAGE_SIZE'], type=int),
+                           API_MAX_PAGE_SIZE))
+    return fields, catalog_filters(), request.args.get('after'), page_size
+
+
+def catalog_page_response(fields, filters, after, page_size, load_page):
+    """
+    load_page: returns the (rows, next cursor) of the page, only called when the response is not cached
+    """
+
+    def build():
+        rows, next_cursor = load_page()
+        return {
+            "products": [{field: getattr(row, field) for field in fields} for row in rows],
+            "next": next_cursor,
+        }
+
+    return cached_json(("products", fields, tuple(sorted(filters.items())), after, page_size), build)
+
+
+@api.route('/products/<int:product_id>')
+@api.route('/products/<slug>')
+def product(product_id=None, slug=None):
+    fields = requested_fields(PRODUCT_FIELDS)
+    row = db_get_product(product_id=product_id, slug=slug)
+    if row is None:
+        abort(404, "Product not found")
+    # Checkouts change the stock without invalidating the catalog, the cached response follows the row
+    return cached_json(("product", fields, row.id, row.quantity),
+                       lambda: {field: getattr(row, field) for field in fields})
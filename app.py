@@ -1,183 +1,180 @@
+import time
+
+IMPORT_STARTED = time.perf_counter()
+
+import logging
+import os
 from datetime import timedelta
 
-from flask import Flask, render_template, request, flash, redirect, jsonify, url_for
-from flask_login import LoginManager, current_user, login_required
+from flask import Flask, current_app
+from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
-from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
 from decouple import config
-import click
-from flask.cli import with_appcontext
 
-from database_manager import *
-from helpers import *
+from cache import catalog_cache
+from database_manager import PRODUCTS_PAGE_SIZE, db, db_load_user
+from database_routing import REPLICA_BIND, engine_options
+from passwords import DEFAULT_HASH_METHOD, password_hasher
+from ratelimit import rate_limiter
+import commands
+import database_routing
+import instrumentation
+import metrics
+import static_assets
+import views
+from api import api as api_blueprint
 from authentication import auth as authentication_blueprint
+from reports import reports as reports_blueprint
 
-app = Flask(__name__)
+IMPORTS_FINISHED = time.perf_counter()
 
-app.config['SQLALCHEMY_DATABASE_URI'] = config("SQLALCHEMY_DATABASE_URI")
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=300)
-app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 300
-app.config['SECRET_KEY'] = config("SECRET_KEY")
-Migrate(app, db, compare_type=True, render_as_batch=True)
-db.init_app(app)
-
-app.register_blueprint(authentication_blueprint, url_prefix='/auth')
+logger = logging.getLogger(__name__)
 
 login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
-login_manager.init_app(app)
-
-IMAGE_UPLOAD_FOLDER = 'static/images'
+csrf = CSRFProtect()
 
 
 @login_manager.user_loader
 def load_user(user_id):
     # since the user_id is just the primary key of our user table, use it in the query for the user
-    return User.query.get(int(user_id))
-
-
-
-csrf = CSRFProtect(app)
-
-
-@click.command('create_db')
-@with_appcontext
-def create_db():
-    with app.app_context():
-        result = db_create_database()
-        click.echo(result)
-
-
-app.cli.add_command(create_db)
-
-app.jinja_env.filters['commify'] = commify
-
-@app.route('/')
-def index():  # put application's code here
-
-    collected_products = db_get_all_products()
-    return render_template('index.html', products=collected_products)
-
-
-@app.route('/products')
-def products():
-    lower_limit = request.args.get('lower_limit')
-    upper_limit = request.args.get('upper_limit')
-    collected_products = db_get_all_products(upper_bound=upper_limit, lower_bound=lower_limit)
-    return render_template('products.html', products=collected_products, lower_limit=lower_limit,
-                           upper_limit=upper_limit)
-
-
-@app.route("/checkout")
-@login_required
-def checkout():
-    product_list = []
-    for product in current_user.basket_items:
-        product = [product.product.id, product.quantity]
-        product_list.append(product)
-
-    payment_method = request.args.get('payment')
-
-    added_sales = db_add_sale(product_list, current_user.id, payment_method)
-    if not added_sales:
-        flash("Something went wrong", "error")
-        return redirect(url_for("products"))
-
-    for product in current_user.basket_items:
-        db_remove_from_cart(current_user.id, product.inventory_id)
-
-    flash("Order confirmed!", "success")
-    return redirect(url_for("products"))
-
-
-@app.route("/orders")
-@login_required
-def orders():
-
-    return render_template('orders.html')
-
-
-@app.route("/basket")
-@login_required
-def cart():
-    total_without_promotion = 0
-    total_with_promotion = 0
-    for item in current_user.basket_items:
-        total_without_promotion += item.product.original_price * item.quantity
-        total_with_promotion += item.product.promotion_price * item.quantity
-    return render_template('cart.html', payment_method=PaymentMode, total_without_promotion=total_without_promotion,
-                           total_with_promotion=total_with_promotion)
-
-
-@app.route("/add-to-cart", methods=['POST'])
-@login_required
-def add_to_cart():
-    payload = request.get_json()
-    product_id = payload.get('productId')
-    quantity = payload.get('quantity')
-
-    if not product_id or not quantity:
-        return jsonify(
-            {
-                "success": False,
-                "message": "Missing required parameters"
-            }
-        ), 400
-
-    cart_item = db_add_to_cart(user_id=current_user.id, product_id=product_id, quantity=quantity)
-    if not cart_item:
-        return jsonify(
-            {
-                "success": False,
-                "message": "Failed to add to cart"
-            }
-        ), 500
-
-    flash("Product added to cart", category='success')
-    return jsonify(
-        {
-            "success": True
-        }
-    )
-
-
-@app.route("/add-product", methods=['GET', 'POST'])
-@login_required
-def add_product():
-    if request.method == 'POST':
-        name = request.form.get('name', type=str)
-        image_url = request.form.get('image_url', type=str)
-        image_file = request.files.get('image_file')
-        weight = request.form.get('weight', type=float)
-        quantity = request.form.get('quantity', type=int, default=1)
-        original_price = request.form.get('price', type=float)
-        promotion_price = request.form.get('promotional_price', type=float)
-        description = request.form.get('description', type=str)
-
-        if not image_url:
-            if not image_file:
-                flash("Missing some required parameters", category='error')
-                return redirect(request.referrer)
-            file_upload_path = save_image(IMAGE_UPLOAD_FOLDER, image_file)
-            image_url = url_for('static', filename=file_upload_path.replace('\\', '/').replace("static/", ""))
-
-        if not name or not image_url or not weight or not quantity or not original_price or not promotion_price:
-            flash("Missing some required parameters", category='error')
-            return redirect(request.referrer)
-
-        if promotion_price > original_price:
-            flash("Promotion price must be less than original price", category='error')
-            return redirect(request.referrer)
-
-        new_product = db_add_products(name, image_url, weight, quantity, original_price, promotion_price, description)
-        if new_product == Errors.MISSING_PARAMS:
-            flash("Missing some required parameters", category='error')
-            return redirect(request.referrer)
-        flash("Product created successfully", category='success')
-        return redirect(url_for('index'))
-    return render_template("admin/add_products.html")
+    return db_load_user(int(user_id), ttl=current_app.config['USER_CACHE_TTL'])
+
+
+def load_config(overrides=None):
+    """
+    Settings read from the environment (or .env), overrides replace them, e.g. the database of the tests.
+    Only the settings that are not overridden are read, so SQLALCHEMY_DATABASE_URI and SECRET_KEY
+    are not required when the caller provides them.
+    """
+    overrides = overrides or {}
+
+    def setting(name, **kwargs):
+        return overrides[name] if name in overrides else config(name, **kwargs)
+
+    settings = {
+        'SQLALCHEMY_DATABASE_URI': setting("SQLALCHEMY_DATABASE_URI"),
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SQLALCHEMY_REPLICA_URI': setting("SQLALCHEMY_REPLICA_URI", default=""),
+        'DB_POOL_SIZE': setting("DB_POOL_SIZE", default=5, cast=int),
+        'DB_MAX_OVERFLOW': setting("DB_MAX_OVERFLOW", default=10, cast=int),
+        'DB_POOL_TIMEOUT': setting("DB_POOL_TIMEOUT", default=30, cast=float),
+        'DB_POOL_RECYCLE': setting("DB_POOL_RECYCLE", default=1800, cast=int),
+        'DB_POOL_PRE_PING': setting("DB_POOL_PRE_PING", default=True, cast=bool),
+        'DB_REPLICA_LAG_SECONDS': setting("DB_REPLICA_LAG_SECONDS", default=5, cast=float),
+        'PERMANENT_SESSION_LIFETIME': timedelta(minutes=300),
+        'SEND_FILE_MAX_AGE_DEFAULT': 300,
+        'SECRET_KEY': setting("SECRET_KEY"),
+        'PRODUCTS_PAGE_SIZE': setting("PRODUCTS_PAGE_SIZE", default=PRODUCTS_PAGE_SIZE, cast=int),
+        'CATALOG_CACHE_BACKEND': setting("CATALOG_CACHE_BACKEND", default="memory"),
+        'CATALOG_CACHE_TTL': setting("CATALOG_CACHE_TTL", default=60, cast=int),
+        'CATALOG_CACHE_MAX_ENTRIES': setting("CATALOG_CACHE_MAX_ENTRIES", default=256, cast=int),
+        'CATALOG_CACHE_PATH': setting("CATALOG_CACHE_PATH", default="catalog_cache.sqlite"),
+        'CATALOG_REVALIDATE_SECONDS': setting("CATALOG_REVALIDATE_SECONDS", default=1800, cast=int),
+        'PASSWORD_HASH_METHOD': setting("PASSWORD_HASH_METHOD", default=DEFAULT_HASH_METHOD),
+        'PASSWORD_HASH_WORKERS': setting("PASSWORD_HASH_WORKERS", default=2, cast=int),
+        'PASSWORD_HASH_TIMEOUT': setting("PASSWORD_HASH_TIMEOUT", default=30, cast=int),
+        'USER_CACHE_TTL': setting("USER_CACHE_TTL", default=0, cast=int),
+        'SLOW_QUERY_MS': setting("SLOW_QUERY_MS", default=100, cast=float),
+        'QUERY_BUDGET': setting("QUERY_BUDGET", default=0, cast=int),
+        'QUERY_BUDGET_ENFORCE': setting("QUERY_BUDGET_ENFORCE", default=False, cast=bool),
+        'METRICS_TOKEN': setting("METRICS_TOKEN", default=""),
+        'METRICS_MULTIPROCESS_DIR': setting("METRICS_MULTIPROCESS_DIR", default=""),
+        'METRICS_FLUSH_SECONDS': setting("METRICS_FLUSH_SECONDS", default=1.0, cast=float),
+        'IMAGE_PIPELINE_WORKERS': setting("IMAGE_PIPELINE_WORKERS", default=2, cast=int),
+        'JOB_BATCH_SIZE': setting("JOB_BATCH_SIZE", default=10, cast=int),
+        'JOB_POLL_SECONDS': setting("JOB_POLL_SECONDS", default=1.0, cast=float),
+        'JOB_VISIBILITY_TIMEOUT': setting("JOB_VISIBILITY_TIMEOUT", default=300, cast=int),
+        'JOB_RETRY_BACKOFF': setting("JOB_RETRY_BACKOFF", default=10, cast=float),
+        'RATE_LIMIT_BACKEND': setting("RATE_LIMIT_BACKEND", default="memory"),
+        'RATE_LIMIT_PATH': setting("RATE_LIMIT_PATH", default="rate_limits.sqlite"),
+        'PROXY_FIX_X_FOR': setting("PROXY_FIX_X_FOR", default=0, cast=int),
+    }
+    settings.update(overrides)
+
+    pool_options = dict(pool_size=settings['DB_POOL_SIZE'], max_overflow=settings['DB_MAX_OVERFLOW'],
+                        pool_timeout=settings['DB_POOL_TIMEOUT'], pool_recycle=settings['DB_POOL_RECYCLE'],
+                        pool_pre_ping=settings['DB_POOL_PRE_PING'])
+    settings.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                        engine_options(settings['SQLALCHEMY_DATABASE_URI'], **pool_options))
+    # Read only catalog queries go to the replica when one is configured, see database_routing
+    replica_uri = settings['SQLALCHEMY_REPLICA_URI']
+    if replica_uri:
+        settings.setdefault('SQLALCHEMY_BINDS',
+                            {REPLICA_BIND: {"url": replica_uri, **engine_options(replica_uri, **pool_options)}})
+    return settings
+
+
+def dispose_engines_after_fork(app):
+    """
+    Workers forked from a preloaded app (gunicorn --preload) open their own database connections,
+    pooled connections of the parent must not be shared between processes
+    """
+
+    def dispose():
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=dispose)
+
+
+def report_startup(app, create_started):
+    """
+    Logs how long the imports and create_app took, then the time from the first import to the first request.
+    The timings are kept in app.extensions['startup'].
+    """
+    startup = app.extensions['startup'] = {
+        "imports": IMPORTS_FINISHED - IMPORT_STARTED,
+        "create_app": time.perf_counter() - create_started,
+        "first_request": None,
+    }
+    logger.info("App created in %.0f ms (imports %.0f ms, create_app %.0f ms)",
+                (startup["imports"] + startup["create_app"]) * 1000, startup["imports"] * 1000,
+                startup["create_app"] * 1000)
+
+    @app.before_request
+    def record_first_request():
+        if startup["first_request"] is None:
+            startup["first_request"] = time.perf_counter() - IMPORT_STARTED
+            logger.info("First request %.0f ms after startup", startup["first_request"] * 1000)
+
+
+def create_app(config_overrides=None):
+    """
+    Builds the shop. config_overrides: settings replacing those of the environment, see load_config.
+    Creating the app opens no database connection, so it can be preloaded before forking workers.
+    """
+    create_started = time.perf_counter()
+    app = Flask(__name__)
+    app.config.update(load_config(config_overrides))
+    if app.config['PROXY_FIX_X_FOR']:
+        # The client address is the one forwarded by the trusted proxies in front, the rate limits count it
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+
+    db.init_app(app)
+    catalog_cache.init_app(app)
+    static_assets.init_app(app)
+    password_hasher.init_app(app)
+    rate_limiter.init_app(app)
+    database_routing.init_app(app, db)
+    instrumentation.init_app(app)
+    metrics.init_app(app, db=db, catalog_cache=catalog_cache)
+    login_manager.init_app(app)
+    csrf.init_app(app)
+    views.init_app(app)
+    commands.init_app(app)
+
+    app.register_blueprint(authentication_blueprint, url_prefix='/auth')
+    app.register_blueprint(reports_blueprint, url_prefix='/admin/reports')
+    app.register_blueprint(api_blueprint, url_prefix='/api/v1')
+
+    dispose_engines_after_fork(app)
+    report_startup(app, create_started)
+    return app
 
 
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
@@ -0,0 +1,236 @@
+import asyncio
+import io
+import sys
+from functools import wraps
+
+from flask import current_app, request, request_started
+from flask_login import current_user
+from werkzeug.exceptions import HTTPException
+
+import async_database_manager
+import tasks
+from api import catalog_page_arguments, catalog_page_response
+from app import create_app
+from async_database_manager import async_db
+from database_models import db
+from database_routing import pin_to_primary, pinned_to_primary
+from ratelimit import rate_limiter
+from views import (add_to_cart_response, cart_item_argument, cart_items_argument, cart_items_response,
+                   catalog_filter_arguments, checkout_response, missing_parameters_response)
+
+
+def _load_user():
+    try:
+        return current_user._get_current_object()
+    finally:
+        # The session was opened in this thread, its connection goes back to the pool from here
+        db.session.remove()
+
+
+def login_required(view):
+    """
+    flask_login.login_required for coroutine views. The user is loaded in a thread since that may query the database.
+    """
+
+    @wraps(view)
+    async def wrapper(*args, **kwargs):
+        user = await asyncio.to_thread(_load_user)
+        if not user.is_authenticated:
+            return current_app.login_manager.unauthorized()
+        return await view(*args, **kwargs)
+
+    return wrapper
+
+
+async def products():
+    fields, filters, after, page_size = catalog_page_arguments()
+    page = await async_database_manager.db_get_all_products(after=after, page_size=page_size,
+                                                            from_replica=not pinned_to_primary(),
+                                                            **catalog_filter_arguments(filters))
+    return catalog_page_response(fields, filters, after, page_size, lambda: page)
+
+
+@login_required
+@rate_limiter.limit("cart")
+async def add_to_cart():
+    product_id, quantity = cart_item_argument()
+    if not product_id or not quantity:
+        return missing_parameters_response()
+
+    cart_item = await async_database_manager.db_add_to_cart(current_user.id, product_id, quantity)
+    pin_to_primary(current_app)
+    return add_to_cart_response(cart_item)
+
+
+@login_required
+@rate_limiter.limit("cart")
+async def add_cart_items():
+    items = cart_items_argument()
+    if not items:
+        return missing_parameters_response()
+
+    cart_items = await async_database_manager.db_add_to_cart_items(current_user.id, items)
+    pin_to_primary(current_app)
+    return cart_items_response(cart_items)
+
+
+@login_required
+@rate_limiter.limit("checkout")
+async def checkout():
+    product_list = await async_database_manager.db_get_cart_quantities(current_user.id)
+    added_sale = await async_database_manager.db_add_sale(product_list, current_user.id, request.args.get('payment'),
+                                                          clear_cart=True, follow_up_jobs=[tasks.ORDER_CONFIRMATION])
+    pin_to_primary(current_app)
+    return checkout_response(added_sale)
+
+
+# Endpoints served by coroutines, they answer exactly like the Flask views of the same endpoint
+ASYNC_VIEWS = {
+    "api.products": products,
+    "add_to_cart": add_to_cart,
+    "add_cart_items": add_cart_items,
+    "checkout": checkout,
+}
+
+
+def wsgi_environ(scope, body):
+    """
+    WSGI environ of an ASGI HTTP request
+    """
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"], environ["REMOTE_PORT"] = scope["client"][0], str(scope["client"][1])
+    for name, value in scope["headers"]:
+        name = name.decode("latin1").upper().replace("-", "_")
+        value = value.decode("latin1")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = f"HTTP_{name}"
+        # Repeated headers are joined, as a WSGI server does
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    # The body was read whole, chunked requests included
+    environ["CONTENT_LENGTH"] = str(len(body))
+    return environ
+
+
+def call_wsgi(application, environ):
+    """
+    Runs a WSGI application, returns the status code, headers and body of its response
+    """
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [int(status.split(" ", 1)[0]), headers]
+
+    response = application(environ, start_response)
+    try:
+        body = b"".join(response)
+    finally:
+        if hasattr(response, "close"):
+            response.close()
+    return started[0], started[1], body
+
+
+class ShopASGI:
+    """
+    Serves the endpoints of ASYNC_VIEWS on the event loop and every other endpoint with the Flask app,
+    in a thread of the loop's executor. Responses are sent in one piece.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] != "http":
+            raise ValueError(f"{scope['type']} connections are not supported")
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        environ = wsgi_environ(scope, body)
+
+        view = self.async_view(environ)
+        if view is None:
+            status, headers, body = await asyncio.get_running_loop().run_in_executor(None, call_wsgi, self.app,
+                                                                                     environ)
+        else:
+            status, headers, body = call_wsgi(await self.dispatch(view, environ), environ)
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    def async_view(self, environ):
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ, server_name=self.app.config["SERVER_NAME"]).match()
+        except HTTPException:
+            return None
+        return ASYNC_VIEWS.get(endpoint)
+
+    async def dispatch(self, view, environ):
+        """
+        Flask.wsgi_app for a coroutine view: before and after request functions, error handlers and the session
+        work as for the other endpoints
+        """
+        app = self.app
+        context = app.request_context(environ)
+        error = None
+        try:
+            try:
+                context.push()
+                try:
+                    request_started.send(app, _async_wrapper=app.ensure_sync)
+                    response = app.preprocess_request()
+                    if response is None:
+                        response = await view(**request.view_args)
+                except Exception as e:
+                    response = app.handle_user_exception(e)
+                return app.finalize_request(response)
+            except Exception as e:
+                error = e
+                return app.handle_exception(e)
+        finally:
+            context.pop(error)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await async_db.for_app(self.app).dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def create_asgi_app(config_overrides=None):
+    """
+    The shop as an ASGI application, e.g. uvicorn --factory asgi:create_asgi_app
+    The catalog API, cart and checkout run as coroutines on the asyncio engines of async_database_manager,
+    so a worker keeps serving them while their queries wait on the database.
+    """
+    app = create_app(config_overrides)
+    async_db.init_app(app)
+    return ShopASGI(app)
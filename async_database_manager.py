@@ -0,0 +1,131 @@
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from cache import catalog_cache
+from database_manager import (PRODUCTS_PAGE_SIZE, _add_sale, _add_to_cart_items, _added_cart_item,
+                              _facet_conditions, _query_products)
+from database_models import CartItems, Sale
+from database_routing import REPLICA_BIND
+from errors_messages import Errors
+from extensions import PerAppExtension
+
+# asyncio drivers of the supported databases
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+# aiosqlite opens a connection per checkout, it has no pool to size
+UNPOOLED_BACKENDS = ("sqlite",)
+POOL_SIZE_OPTIONS = ("pool_size", "max_overflow", "pool_timeout")
+
+
+def async_url(uri):
+    """
+    URL of a database for its asyncio driver, sqlite:///shop.db becomes sqlite+aiosqlite:///shop.db
+    """
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"There is no asyncio driver for {backend}")
+    if backend == "sqlite" and url.database in (None, "", ":memory:"):
+        raise ValueError("An in-memory SQLite database can't be shared with the asyncio engine, use a file")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+class AsyncDatabase(PerAppExtension):
+    """
+    asyncio engines of the databases of the app, used by the async routes of asgi.py.
+    They take the engine options of Flask-SQLAlchemy, the catalog is read from the replica when one is configured.
+    init_app sets up the engines of an application, the module level async_db serves those of the current app.
+    """
+    extension_name = "async_db"
+
+    def __init__(self):
+        self.primary = None
+        self.replica = None
+        self.engines = []
+
+    def from_config(self, app):
+        database = AsyncDatabase()
+        database.primary = database._sessions(app.config["SQLALCHEMY_DATABASE_URI"],
+                                              app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+        replica = dict(app.config.get("SQLALCHEMY_BINDS", {}).get(REPLICA_BIND) or {})
+        database.replica = database._sessions(replica.pop("url"), replica) if replica else None
+        return database
+
+    def _sessions(self, uri, options):
+        url = async_url(uri)
+        if url.get_backend_name() in UNPOOLED_BACKENDS:
+            options = {name: value for name, value in options.items() if name not in POOL_SIZE_OPTIONS}
+        engine = create_async_engine(url, **options)
+        self.engines.append(engine)
+        # Results are used after the session closed, they can't be reloaded then
+        return async_sessionmaker(engine, expire_on_commit=False)
+
+    def session(self, from_replica=False):
+        database = self._current()
+        if from_replica and database.replica is not None:
+            return database.replica()
+        return database.primary()
+
+    async def dispose(self):
+        for engine in self._current().engines:
+            await engine.dispose()
+
+
+async_db = AsyncDatabase()
+
+
+# The functions below are the async versions of those of database_manager. They run the same code through
+# AsyncSession.run_sync, whose queries wait on the asyncio driver, so the event loop serves other requests
+# in the meantime.
+
+async def db_get_all_products(lower_bound=None, upper_bound=None, after=None, page_size=PRODUCTS_PAGE_SIZE,
+                              min_price=None, max_price=None, min_rating=None, min_discount=None, from_replica=True):
+    """
+    See database_manager.db_get_all_products, the pages share its catalog cache entries.
+    from_replica: False reads the primary, for browser sessions that just wrote
+    """
+    filters = (lower_bound, upper_bound, min_price, max_price, min_rating, min_discount)
+
+    async def load():
+        async with async_db.session(from_replica) as session:
+            return await session.run_sync(_query_products, _facet_conditions(*filters), after, page_size)
+
+    return await catalog_cache.get_or_load_async(("products", filters, after, page_size), load)
+
+
+async def db_get_cart_quantities(user_id):
+    """
+    Returns the (inventory_id, quantity) rows of the cart of a user
+    """
+    async with async_db.session() as session:
+        result = await session.execute(
+            select(CartItems.inventory_id, CartItems.quantity).where(CartItems.user_id == user_id)
+        )
+        return result.all()
+
+
+async def db_add_to_cart(user_id, product_id, quantity):
+    if not user_id or not product_id or not quantity:
+        return Errors.MISSING_PARAMS
+    return _added_cart_item(product_id, await db_add_to_cart_items(user_id, [(product_id, quantity)]))
+
+
+async def db_add_to_cart_items(user_id, items):
+    """
+    See database_manager.db_add_to_cart_items
+    """
+    async with async_db.session() as session:
+        return await session.run_sync(_add_to_cart_items, user_id, items)
+
+
+async def db_add_sale(product_id_list, user_id, payment_method, clear_cart=False, follow_up_jobs=()):
+    """
+    See database_manager.db_add_sale
+    """
+    async with async_db.session() as session:
+        sale = await session.run_sync(_add_sale, product_id_list, user_id, payment_method, clear_cart,
+                                      follow_up_jobs)
+        if isinstance(sale, Sale):
+            # The total was computed by the database
+            await session.refresh(sale)
+        return sale
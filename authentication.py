@@ -2,9 +2,9 @@ from flask import Blueprint, render_template, redirect, url_for, request, flash
 
 from flask_login import login_user, login_required, logout_user, current_user, LoginManager
 from flask import session as Session
-from werkzeug.security import check_password_hash
-
 from database_manager import *
+from passwords import password_hasher
+from ratelimit import rate_limiter
 
 auth = Blueprint('auth', __name__)
 
@@ -20,7 +20,13 @@ def redirect_dest(fallback):
     return redirect(fallback)
 
 
+def login_attempt():
+    # The phone number tried from this address, so nobody can lock a phone number out from another address
+    return f"{request.remote_addr}|{request.form.get('phone')}"
+
+
 @auth.route('/login', methods=['GET', 'POST'])
+@rate_limiter.limit("login", user=login_attempt, phone=lambda: request.form.get('phone'), methods=('POST',))
 def login():
     dest = request.args.get('next')
     Session['next'] = dest
@@ -33,9 +39,11 @@ def login():
         if not user:
             flash("Check your phone or password and try again", category='error')
             return redirect(request.referrer)
-        if not check_password_hash(user.password, password):
+        if not password_hasher.verify(user.password, password):
             flash("Check your phone or password and try again", category='error')
             return redirect(request.referrer)
+        if password_hasher.needs_rehash(user.password):
+            db_update_password(user, password)
         login_user(user, remember=True)
         flash(f"Welcome {current_user.lastname}!", category='success')
         return redirect_dest('/')
@@ -44,6 +52,7 @@ def login():
 
 
 @auth.route('/register', methods=['GET', 'POST'])
+@rate_limiter.limit("register", methods=('POST',))
 def register():
     if request.method == 'POST':
         first_name = request.form.get('firstName')
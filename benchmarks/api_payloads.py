@@ -0,0 +1,91 @@
+"""
+Compares a catalog page served as HTML with the same page from the JSON API: payload sizes, raw and compressed,
+the time spent serializing the rows and the time of the whole request.
+
+    python benchmarks/api_payloads.py
+    python benchmarks/api_payloads.py --products 5000 --runs 200
+"""
+import argparse
+import gzip
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("SQLALCHEMY_DATABASE_URI", "sqlite:///:memory:")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+# Every run queries and serializes, instead of measuring the catalog cache
+os.environ["CATALOG_CACHE_BACKEND"] = "none"
+
+import brotli
+from flask import render_template
+
+from api import PRODUCT_LIST_FIELDS, encode
+from app import create_app
+from database_manager import *
+
+SPARSE_FIELDS = ("id", "name", "promotion_price", "image_url")
+
+
+def median_ms(function, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=100)
+    arguments = parser.parse_args()
+
+    app = create_app({"TESTING": True})
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(Inventory), [
+            {"name": f"Benchmark product {index}", "slug": f"benchmark-product-{index}",
+             "image_url": "/static/images/product.jpeg", "original_price": 1000 + index,
+             "promotion_price": 900 + index, "quantity": 10, "rating": 4, "weight": 1,
+             "description": "benchmark", "added_on": datetime(2023, 1, 1) + timedelta(minutes=index)}
+            for index in range(arguments.products)])
+        db.session.commit()
+
+    page_size = app.config['PRODUCTS_PAGE_SIZE']
+    with app.test_request_context('/products'):
+        rows, next_cursor = db_get_all_products(page_size=page_size)
+
+        def render_html():
+            return render_template('product_listing.html', products=rows, next_cursor=next_cursor, page_args={})
+
+        def encode_json(fields):
+            return lambda: encode({"products": [{field: getattr(row, field) for field in fields} for row in rows],
+                                   "next": next_cursor})
+
+        serializers = {
+            "html": render_html,
+            "json": encode_json(PRODUCT_LIST_FIELDS),
+            "json sparse": encode_json(SPARSE_FIELDS),
+        }
+        serialize_ms = {name: median_ms(serializer, arguments.runs) for name, serializer in serializers.items()}
+
+    urls = {
+        "html": "/products",
+        "json": "/api/v1/products",
+        "json sparse": f"/api/v1/products?fields={','.join(SPARSE_FIELDS)}",
+    }
+    print(f"{page_size} products per page")
+    print(f"{'format':<12} {'bytes':>8} {'gzip':>8} {'br':>8} {'serialize ms':>13} {'request ms':>11}")
+    for name, url in urls.items():
+        body = client.get(url).data
+        request_ms = median_ms(lambda: client.get(url), arguments.runs)
+        print(f"{name:<12} {len(body):>8} {len(gzip.compress(body, compresslevel=6)):>8} "
+              f"{len(brotli.compress(body, quality=5)):>8} {serialize_ms[name]:>13.3f} {request_ms:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
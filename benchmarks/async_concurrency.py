@@ -0,0 +1,231 @@
+"""
+Compares the sync server (gunicorn sync workers, app.py) with the async one (uvicorn, asgi.py) at equal worker
+counts, as more and more clients read catalog pages from the JSON API and add products to their cart.
+
+    python benchmarks/async_concurrency.py
+    python benchmarks/async_concurrency.py --workers 2 --latency-ms 5 --clients 1 16 64 --seconds 5
+
+Both servers use the same SQLite file under benchmarks/.data, with the catalog cache disabled so that every
+request queries. Every statement first waits --latency-ms on its database connection, standing in for the network
+round trip to a remote database: a sync worker is blocked meanwhile while an async worker serves other requests.
+--latency-ms 0 measures the local SQLite file as it is.
+"""
+import argparse
+import http.client
+import json
+import os
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlencode
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DATA_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.data')
+PRODUCTS = 2_000
+BENCH_PHONE = "0700000002"
+BENCH_PASSWORD = "benchmark"
+
+
+def simulate_latency(latency_ms):
+    """
+    Makes every statement wait latency_ms inside the database driver before it runs
+    """
+    if not latency_ms:
+        return
+
+    @event.listens_for(Engine, "connect")
+    def register_wait(dbapi_connection, connection_record):
+        dbapi_connection.create_function("bench_wait", 1, lambda ms: time.sleep(ms / 1000))
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def wait(connection, cursor, statement, parameters, context, executemany):
+        cursor.execute("SELECT bench_wait(?)", (latency_ms,))
+
+
+# Application factories of the servers, they run in the server processes
+def sync_app():
+    from app import create_app
+    simulate_latency(float(os.environ.get("BENCH_LATENCY_MS", 0)))
+    return create_app()
+
+
+def async_app():
+    from asgi import create_asgi_app
+    simulate_latency(float(os.environ.get("BENCH_LATENCY_MS", 0)))
+    return create_asgi_app()
+
+
+SERVERS = {
+    "sync": lambda port, workers: ["gunicorn", "--workers", str(workers), "--bind", f"127.0.0.1:{port}",
+                                   "--pythonpath", os.path.dirname(os.path.abspath(__file__)),
+                                   "async_concurrency:sync_app()"],
+    "async": lambda port, workers: ["uvicorn", "--factory", "async_concurrency:async_app", "--workers",
+                                    str(workers), "--port", str(port), "--log-level", "warning",
+                                    "--app-dir", os.path.dirname(os.path.abspath(__file__))],
+}
+
+
+def environment(database_uri, latency_ms):
+    return dict(os.environ, SQLALCHEMY_DATABASE_URI=database_uri, SECRET_KEY="benchmark",
+                CATALOG_CACHE_BACKEND="none", RATE_LIMIT_BACKEND="none", BENCH_LATENCY_MS=str(latency_ms), PYTHONPATH=ROOT)
+
+
+def seed(database_uri):
+    from app import create_app
+    from database_manager import Inventory, db, db_add_user, insert
+
+    app = create_app({"SQLALCHEMY_DATABASE_URI": database_uri, "SECRET_KEY": "benchmark"})
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(Inventory), [
+            {"name": f"Concurrency product {index}", "slug": f"concurrency-product-{index}", "image_url": "url",
+             "original_price": 1000 + index, "promotion_price": 900 + index, "quantity": 1_000_000, "rating": 3,
+             "weight": 1, "description": "benchmark"}
+            for index in range(PRODUCTS)])
+        db.session.commit()
+        db_add_user("Bench", "Client", BENCH_PHONE, BENCH_PASSWORD)
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def wait_until_ready(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/api/v1/products?limit=1")
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"The server on port {port} did not start")
+
+
+def log_in(port):
+    """
+    Returns the headers of a signed in client: its cookies and CSRF token
+    """
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    cookies = {}
+
+    def send(method, url, body=None, headers=None):
+        cookie = "; ".join(f"{name}={value}" for name, value in cookies.items())
+        connection.request(method, url, body, dict(headers or {}, Cookie=cookie))
+        response = connection.getresponse()
+        for header in response.headers.get_all("Set-Cookie") or []:
+            name, value = header.split(";", 1)[0].split("=", 1)
+            cookies[name] = value
+        return response.read().decode()
+
+    token = re.search(r'name="csrf_token" value="([^"]+)"', send("GET", "/auth/login")).group(1)
+    send("POST", "/auth/login", urlencode({"phone": BENCH_PHONE, "password": BENCH_PASSWORD, "csrf_token": token}),
+         {"Content-Type": "application/x-www-form-urlencoded"})
+    return {"Cookie": "; ".join(f"{name}={value}" for name, value in cookies.items()), "X-CSRF-Token": token}
+
+
+def catalog_request(client):
+    return "GET", f"/api/v1/products?limit=24&min_price={900 + client * 7 % PRODUCTS}", None, {}
+
+
+def cart_request(client, session_headers):
+    body = json.dumps({"items": [{"productId": client % PRODUCTS + 1, "quantity": 1}]})
+    return "POST", "/cart/items", body, dict(session_headers, **{"Content-Type": "application/json"})
+
+
+def load(port, clients, seconds, build_request):
+    """
+    Runs clients threads sending build_request(client) requests for seconds, returns (latencies, errors)
+    """
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client(index):
+        nonlocal errors
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        method, url, body, headers = build_request(index)
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                connection.request(method, url, body, headers)
+                response = connection.getresponse()
+                response.read()
+                failed = response.status != 200
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                failed = True
+            with lock:
+                if failed:
+                    errors += 1
+                else:
+                    latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--latency-ms", type=float, default=2)
+    arguments = parser.parse_args()
+
+    for command in ("gunicorn", "uvicorn"):
+        if shutil.which(command) is None:
+            sys.exit(f"{command} is not installed")
+    shutil.rmtree(DATA_FOLDER, ignore_errors=True)
+    os.makedirs(DATA_FOLDER)
+    database_uri = f"sqlite:///{os.path.join(DATA_FOLDER, 'concurrency.sqlite')}"
+    seed(database_uri)
+
+    print(f"{arguments.workers} worker(s), {arguments.latency_ms} ms per statement")
+    print(f"{'server':<7} {'endpoint':<8} {'clients':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+    for server, command in SERVERS.items():
+        port = free_port()
+        process = subprocess.Popen(command(port, arguments.workers), cwd=ROOT, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL, env=environment(database_uri, arguments.latency_ms))
+        try:
+            wait_until_ready(port)
+            session_headers = log_in(port)
+            endpoints = {
+                "catalog": catalog_request,
+                "cart": lambda client: cart_request(client, session_headers),
+            }
+            for endpoint, build_request in endpoints.items():
+                for clients in arguments.clients:
+                    latencies, errors = load(port, clients, arguments.seconds, build_request)
+                    print(f"{server:<7} {endpoint:<8} {clients:>7} {len(latencies) / arguments.seconds:>9.1f} "
+                          f"{statistics.median(latencies) * 1000 if latencies else float('nan'):>8.2f} "
+                          f"{percentile(latencies, 0.95) * 1000:>8.2f} {errors:>7}")
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
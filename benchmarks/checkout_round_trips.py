@@ -0,0 +1,57 @@
+"""
+Counts the database round trips and the time taken by a checkout for growing basket sizes.
+
+    python benchmarks/checkout_round_trips.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("SQLALCHEMY_DATABASE_URI", "sqlite:///:memory:")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+from sqlalchemy import event
+
+from app import create_app
+from database_manager import *
+
+app = create_app()
+
+BASKET_SIZES = (1, 5, 20, 50, 100)
+
+
+def checkout(user_id, basket):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    for product_id, quantity in basket:
+        db_add_to_cart(user_id, product_id, quantity)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    started = time.perf_counter()
+    try:
+        db_add_sale(basket, user_id, PaymentMode.MPESA, clear_cart=True)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+    return len(statements), time.perf_counter() - started
+
+
+def main():
+    with app.app_context():
+        db.create_all()
+        user = db_add_user("Bench", "Mark", "0700000000", "password")
+        products = [db_add_products(f"Benchmark {index}", "url", 1, 10_000, 100.0, 80.0, "benchmark")
+                    for index in range(max(BASKET_SIZES))]
+
+        print(f"{'basket size':>12} {'round trips':>12} {'checkout ms':>12}")
+        for size in BASKET_SIZES:
+            basket = [(product.id, 1) for product in products[:size]]
+            round_trips, elapsed = checkout(user.id, basket)
+            print(f"{size:>12} {round_trips:>12} {elapsed * 1000:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
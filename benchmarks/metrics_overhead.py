@@ -0,0 +1,64 @@
+"""
+Measures what the metrics cost: the raw price of recording one request and the added latency
+of a request served through a Flask app with metrics enabled, with and without the multiprocess files.
+
+    python benchmarks/metrics_overhead.py [--requests 5000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+
+import metrics
+
+
+def per_request_time(app, requests):
+    client = app.test_client()
+    for _ in range(100):
+        client.get('/ping')
+    started = time.perf_counter()
+    for _ in range(requests):
+        client.get('/ping')
+    return (time.perf_counter() - started) / requests
+
+
+def make_app(**config):
+    app = Flask(__name__)
+    app.config.update(config)
+    app.add_url_rule('/ping', 'ping', lambda: 'pong')
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    arguments = parser.parse_args()
+
+    operations = 200_000
+    started = time.perf_counter()
+    for _ in range(operations):
+        metrics.REQUESTS.inc(endpoint="index", method="GET", status=200)
+        metrics.REQUEST_LATENCY.observe(0.012, endpoint="index")
+    print(f"counter + histogram update: {(time.perf_counter() - started) / operations * 1e6:.2f} us")
+
+    baseline = per_request_time(make_app(), arguments.requests)
+    instrumented_app = make_app()
+    metrics.init_app(instrumented_app)
+    instrumented = per_request_time(instrumented_app, arguments.requests)
+    with tempfile.TemporaryDirectory() as folder:
+        multiprocess_app = make_app(METRICS_MULTIPROCESS_DIR=folder)
+        metrics.init_app(multiprocess_app)
+        multiprocess = per_request_time(multiprocess_app, arguments.requests)
+
+    print(f"request without metrics:    {baseline * 1e6:.1f} us")
+    print(f"request with metrics:       {instrumented * 1e6:.1f} us (+{(instrumented - baseline) * 1e6:.1f} us)")
+    print(f"request, multiprocess mode: {multiprocess * 1e6:.1f} us (+{(multiprocess - baseline) * 1e6:.1f} us)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Reports hashes per second and login latency for several password hashing costs.
+
+    python benchmarks/password_hashing.py [--workers 2] [--logins 20]
+
+Hashes per second are measured with the configured process pool under as many concurrent callers as workers;
+login latency is measured through the Flask test client while other threads keep logging in, which is what
+a threaded web worker sees under load.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("SQLALCHEMY_DATABASE_URI", "sqlite:///:memory:")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+METHODS = ("pbkdf2:sha256:260000", "pbkdf2:sha256:600000", "scrypt:16384:8:1", "scrypt:32768:8:1")
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def measure(app, method, workers, logins):
+    from database_manager import db, db_add_user
+    from passwords import password_hasher
+
+    hasher = password_hasher.for_app(app)
+    hasher.shutdown()
+    hasher.method = method
+    hasher.workers = workers
+    # Start the pool processes before timing anything
+    for _ in range(max(workers, 1)):
+        hasher.hash("warm up")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        list(executor.map(lambda _: hasher.hash("correct horse battery staple"), range(logins)))
+    hashes_per_second = logins / (time.perf_counter() - started)
+
+    phone = f"07{abs(hash(method)) % 10 ** 8:08d}"
+    with app.app_context():
+        db_add_user("Bench", "Mark", phone, "password")
+        db.session.remove()
+
+    def login(_):
+        client = app.test_client()
+        started = time.perf_counter()
+        client.post('/auth/login', data={"phone": phone, "password": "password"})
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1) * 2) as executor:
+        latencies = list(executor.map(login, range(logins)))
+    return hashes_per_second, statistics.median(latencies), percentile(latencies, 0.99)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=2, help="process pool size, 0 hashes in the request thread")
+    parser.add_argument("--logins", type=int, default=20)
+    arguments = parser.parse_args()
+
+    from app import create_app
+    from database_manager import db
+    app = create_app({"TESTING": True, "WTF_CSRF_ENABLED": False, "RATE_LIMIT_BACKEND": "none"})
+    with app.app_context():
+        db.create_all()
+
+    print(f"{'method':<24} {'hashes/s':>10} {'login p50 ms':>14} {'login p99 ms':>14}")
+    for method in METHODS:
+        hashes_per_second, p50, p99 = measure(app, method, arguments.workers, arguments.logins)
+        print(f"{method:<24} {hashes_per_second:>10.1f} {p50 * 1000:>14.1f} {p99 * 1000:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Measures how the connection pool settings hold up when more request threads than connections run catalog queries.
+
+    python benchmarks/pool_saturation.py
+    python benchmarks/pool_saturation.py --hold-ms 20 --pool-timeout 0.5
+
+Every request checks out a connection, reads a page of products and keeps the connection for --hold-ms more,
+standing in for the network round trips of a remote database. The database is a SQLite file under
+benchmarks/.data unless BENCH_DATABASE_URI points somewhere else. For each pool size and thread count the
+benchmark reports the throughput, the p95 time spent waiting for a connection, the p95 request latency and
+the requests that gave up after DB_POOL_TIMEOUT.
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from database_models import Inventory
+from database_routing import engine_options
+
+DATA_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.data')
+POOL_SIZES = (2, 5, 10)
+THREAD_COUNTS = (4, 16, 32)
+PRODUCTS = 5_000
+PAGE_SIZE = 20
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def prepare(uri):
+    engine = create_engine(uri)
+    Inventory.__table__.create(engine, checkfirst=True)
+    with engine.begin() as connection:
+        if connection.scalar(select(Inventory.id).limit(1)) is None:
+            connection.execute(insert(Inventory), [
+                {"name": f"Pool product {index}", "slug": f"pool-product-{index}", "image_url": "url",
+                 "original_price": 1000 + index, "promotion_price": 900 + index, "quantity": 10, "rating": 3,
+                 "weight": 1, "description": "benchmark"}
+                for index in range(PRODUCTS)])
+    engine.dispose()
+
+
+def saturate(uri, pool_size, threads, requests_per_thread, hold, pool_timeout):
+    engine = create_engine(uri, **engine_options(uri, pool_size=pool_size, max_overflow=0,
+                                                 pool_timeout=pool_timeout))
+    waits, latencies = [], []
+    timeouts = 0
+    lock = threading.Lock()
+
+    def request(index):
+        nonlocal timeouts
+        started = time.perf_counter()
+        try:
+            with engine.connect() as connection:
+                checked_out = time.perf_counter()
+                offset = index * PAGE_SIZE % PRODUCTS
+                connection.execute(select(Inventory.id, Inventory.name, Inventory.promotion_price)
+                                   .order_by(Inventory.id).offset(offset).limit(PAGE_SIZE)).all()
+                time.sleep(hold)
+        except PoolTimeoutError:
+            with lock:
+                timeouts += 1
+            return
+        finished = time.perf_counter()
+        with lock:
+            waits.append(checked_out - started)
+            latencies.append(finished - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(request, range(threads * requests_per_thread)))
+    elapsed = time.perf_counter() - started
+    engine.dispose()
+    return {
+        "throughput": len(latencies) / elapsed,
+        "wait_p95": percentile(waits, 0.95) if waits else 0,
+        "latency_p50": statistics.median(latencies) if latencies else 0,
+        "latency_p95": percentile(latencies, 0.95) if latencies else 0,
+        "timeouts": timeouts,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=25, help="requests per thread")
+    parser.add_argument("--hold-ms", type=float, default=5.0, help="time a request keeps its connection")
+    parser.add_argument("--pool-timeout", type=float, default=2.0, help="seconds to wait for a connection")
+    arguments = parser.parse_args()
+
+    os.makedirs(DATA_FOLDER, exist_ok=True)
+    uri = os.environ.get("BENCH_DATABASE_URI", f"sqlite:///{os.path.join(DATA_FOLDER, 'pool-saturation.sqlite')}")
+    prepare(uri)
+
+    print(f"{'pool size':>9} {'threads':>8} {'req/s':>9} {'wait p95 ms':>12} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'timeouts':>9}")
+    for pool_size in POOL_SIZES:
+        for threads in THREAD_COUNTS:
+            result = saturate(uri, pool_size, threads, arguments.requests, arguments.hold_ms / 1000,
+                              arguments.pool_timeout)
+            print(f"{pool_size:>9} {threads:>8} {result['throughput']:>9.0f} {result['wait_p95'] * 1000:>12.2f} "
+                  f"{result['latency_p50'] * 1000:>8.2f} {result['latency_p95'] * 1000:>8.2f} "
+                  f"{result['timeouts']:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Measures what the rate limits cost: the price of one bucket check per backend, of the checks of a limited endpoint
+(its "ip" and "user" buckets) and the added latency of a request to a decorated route.
+
+    python benchmarks/rate_limit_overhead.py [--checks 200000] [--requests 5000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+
+from ratelimit import MemoryRateLimitBackend, RateLimiter, SQLiteRateLimitBackend
+
+
+def per_call_time(function, calls):
+    for index in range(min(calls, 1000)):
+        function(index)
+    started = time.perf_counter()
+    for index in range(calls):
+        function(index)
+    return (time.perf_counter() - started) / calls
+
+
+def per_request_time(app, requests):
+    client = app.test_client()
+    for _ in range(100):
+        client.get('/ping')
+    started = time.perf_counter()
+    for _ in range(requests):
+        client.get('/ping')
+    return (time.perf_counter() - started) / requests
+
+
+def make_app(limiter=None):
+    app = Flask(__name__)
+    view = lambda: 'pong'
+    if limiter is not None:
+        view = limiter.limit("cart", user=lambda: "1")(view)
+    app.add_url_rule('/ping', 'ping', view)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--checks", type=int, default=200_000)
+    parser.add_argument("--requests", type=int, default=5000)
+    arguments = parser.parse_args()
+
+    # Buckets that never run out, every check takes the allowed path as most requests do
+    unlimited = {"cart": {"ip": f"{10 ** 9}/second", "user": f"{10 ** 9}/second"}}
+    memory = MemoryRateLimitBackend()
+    capacity, refill_rate = 10 ** 9, 10 ** 9
+    take = per_call_time(lambda index: memory.take("cart:ip:127.0.0.1", capacity, refill_rate), arguments.checks)
+    # One client address per check, the buckets are created and evicted as during a scan of many addresses
+    spread = MemoryRateLimitBackend(max_entries=10_000)
+    spread_take = per_call_time(lambda index: spread.take(f"cart:ip:{index}", capacity, refill_rate), arguments.checks)
+    limiter = RateLimiter(MemoryRateLimitBackend(), unlimited)
+    check = per_call_time(lambda index: limiter.check("cart", "127.0.0.1", "1"), arguments.checks)
+    with tempfile.TemporaryDirectory() as folder:
+        shared = SQLiteRateLimitBackend(os.path.join(folder, "rate_limits.sqlite"))
+        sqlite_take = per_call_time(lambda index: shared.take("cart:ip:127.0.0.1", capacity, refill_rate),
+                                    arguments.checks // 20)
+
+        baseline = per_request_time(make_app(), arguments.requests)
+        limited = per_request_time(make_app(RateLimiter(MemoryRateLimitBackend(), unlimited)), arguments.requests)
+        shared_limited = per_request_time(make_app(RateLimiter(shared, unlimited)), arguments.requests)
+
+    print(f"memory bucket take:            {take * 1e9:.0f} ns")
+    print(f"memory bucket take, new keys:  {spread_take * 1e9:.0f} ns")
+    print(f"endpoint check, 2 buckets:     {check * 1e9:.0f} ns")
+    print(f"sqlite bucket take:            {sqlite_take * 1e6:.1f} us")
+    print(f"request without limits:        {baseline * 1e6:.1f} us")
+    print(f"request, memory limits:        {limited * 1e6:.1f} us (+{(limited - baseline) * 1e6:.1f} us)")
+    print(f"request, sqlite limits:        {shared_limited * 1e6:.1f} us (+{(shared_limited - baseline) * 1e6:.1f} us)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Reports the cold start of the app: import time of every module app.py imports, create_app and the first request.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 10 --modules 20
+
+Every run is a fresh interpreter, as a gunicorn worker or a deploy would be. The first request renders the home
+page of an empty in-memory database, so it includes compiling the templates.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+COLD_START = """
+import json, sys, time
+from app import create_app
+from database_manager import db
+app = create_app({"TESTING": True})
+with app.app_context():
+    db.create_all()
+started = time.perf_counter()
+app.test_client().get('/')
+startup = app.extensions['startup']
+print(json.dumps({"imports": startup["imports"], "create_app": startup["create_app"],
+                  "first_request": time.perf_counter() - started, "total": startup["first_request"],
+                  "modules": len(sys.modules)}))
+"""
+
+
+def environment():
+    return dict(os.environ, SQLALCHEMY_DATABASE_URI="sqlite://", SECRET_KEY="startup",
+                CATALOG_CACHE_BACKEND="none", PASSWORD_HASH_WORKERS="0")
+
+
+def cold_start():
+    output = subprocess.run([sys.executable, "-c", COLD_START], cwd=ROOT, env=environment(), check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def import_times():
+    """
+    Returns (module, cumulative ms) of the modules imported by app.py, slowest first, from python -X importtime
+    """
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT, env=environment(),
+                            check=True, capture_output=True, text=True).stderr
+    times = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        depth = len(name) - len(name.lstrip())
+        # Imports are listed after the modules they import, app's own imports are one level deeper than app
+        if depth == 1 and name.strip() == "app":
+            break
+        if depth == 1:
+            times = []
+        elif depth == 3:
+            times.append((name.strip(), int(cumulative) / 1000))
+    return sorted(times, key=lambda item: item[1], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="cold starts measured")
+    parser.add_argument("--modules", type=int, default=15, help="slowest imports listed")
+    arguments = parser.parse_args()
+
+    print(f"{'module':<32} {'import ms':>10}")
+    for module, elapsed in import_times()[:arguments.modules]:
+        print(f"{module:<32} {elapsed:>10.1f}")
+
+    runs = [cold_start() for _ in range(arguments.runs)]
+    print()
+    print(f"{'phase':<32} {'median ms':>10} {'max ms':>10}")
+    for phase in ("imports", "create_app", "first_request", "total"):
+        values = [run[phase] * 1000 for run in runs]
+        print(f"{phase:<32} {statistics.median(values):>10.1f} {max(values):>10.1f}")
+    print(f"{'modules loaded':<32} {runs[-1]['modules']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from extensions import PerAppExtension, SQLiteFileBackend, database_namespace
+
+
+class MemoryCacheBackend:
+    """
+    Keeps entries in the memory of the current process.
+    Entries expire after their ttl and the least recently used entry is evicted once max_entries is reached.
+    Every worker process has its own copy, so an invalidation only reaches the process that performed it.
+    """
+    # The version only counts the invalidations of this process
+    shared = False
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = (0, time.time())
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._version = (self._version[0] + 1, time.time())
+
+    def version(self):
+        return self._version
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheBackend(SQLiteFileBackend):
+    """
+    Keeps pickled entries in a local SQLite file shared by all the worker processes of a host,
+    so an invalidation done by one worker is seen by all of them.
+    Uses the same ttl and least recently used eviction rules as MemoryCacheBackend.
+    """
+    # Every worker of the host reads the same version
+    shared = True
+
+    def __init__(self, path, max_entries=256):
+        super().__init__(path)
+        self.max_entries = max_entries
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            "key TEXT PRIMARY KEY, value BLOB, expires_at REAL, last_used REAL)"
+        )
+        self._connection().execute("CREATE TABLE IF NOT EXISTS cache_version (number INTEGER, modified_at REAL)")
+        self._connection().execute(
+            "INSERT INTO cache_version SELECT 0, ? WHERE NOT EXISTS (SELECT 1 FROM cache_version)", (time.time(),)
+        )
+
+    def get(self, key):
+        connection = self._connection()
+        now = time.time()
+        row = connection.execute("SELECT value, expires_at FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return False, None
+        if row[1] < now:
+            connection.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+            return False, None
+        connection.execute("UPDATE cache_entries SET last_used = ? WHERE key = ?", (now, key))
+        return True, pickle.loads(row[0])
+
+    def set(self, key, value, ttl):
+        connection = self._connection()
+        now = time.time()
+        connection.execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), now + ttl, now),
+        )
+        connection.execute(
+            "DELETE FROM cache_entries WHERE key IN ("
+            "SELECT key FROM cache_entries ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def delete(self, key):
+        self._connection().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+
+    def clear(self):
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM cache_entries")
+            connection.execute("UPDATE cache_version SET number = number + 1, modified_at = ?", (time.time(),))
+
+    def version(self):
+        return tuple(self._connection().execute("SELECT number, modified_at FROM cache_version").fetchone())
+
+    def __len__(self):
+        return self._connection().execute("SELECT count(*) FROM cache_entries").fetchone()[0]
+
+
+class CatalogCache(PerAppExtension):
+    """
+    Read-through cache for catalog queries.
+    init_app sets up a cache per application from its config, the module level catalog_cache serves the one
+    of the current app:
+    CATALOG_CACHE_BACKEND: "memory" (default), "sqlite" to share the entries between workers or "none"
+    CATALOG_CACHE_TTL: seconds an entry stays valid
+    CATALOG_CACHE_MAX_ENTRIES: number of entries kept before the least recently used one is evicted
+    CATALOG_CACHE_PATH: file used by the sqlite backend
+    """
+    extension_name = "catalog_cache"
+
+    def __init__(self, backend=None, ttl=60, namespace=""):
+        self.backend = backend or MemoryCacheBackend()
+        self.ttl = ttl
+        # Prefix of the keys, apps of other databases sharing a sqlite file don't read each other's pages
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def from_config(self, app):
+        backend = app.config.get("CATALOG_CACHE_BACKEND", "memory")
+        max_entries = app.config.get("CATALOG_CACHE_MAX_ENTRIES", 256)
+        cache = CatalogCache(ttl=app.config.get("CATALOG_CACHE_TTL", 60), namespace=database_namespace(app))
+        if backend == "sqlite":
+            cache.backend = SQLiteCacheBackend(app.config.get("CATALOG_CACHE_PATH", "catalog_cache.sqlite"),
+                                               max_entries)
+        elif backend == "none":
+            cache.backend = None
+        else:
+            cache.backend = MemoryCacheBackend(max_entries)
+        return cache
+
+    def _lookup(self, key):
+        # Counted under the lock, request threads looking up at once would lose increments
+        found, value = self.backend.get(key)
+        with self._lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return found, value
+
+    def get_or_load(self, key, loader):
+        """
+        Returns the cached value of key, calling loader and caching its result on a miss
+        """
+        cache = self._current()
+        if cache.backend is None:
+            return loader()
+        key = f"{cache.namespace}{key!r}"
+        found, value = cache._lookup(key)
+        if found:
+            return value
+        value = loader()
+        cache.backend.set(key, value, cache.ttl)
+        return value
+
+    async def get_or_load_async(self, key, loader):
+        """
+        get_or_load for coroutine loaders, see async_database_manager
+        """
+        cache = self._current()
+        if cache.backend is None:
+            return await loader()
+        key = f"{cache.namespace}{key!r}"
+        found, value = cache._lookup(key)
+        if found:
+            return value
+        value = await loader()
+        cache.backend.set(key, value, cache.ttl)
+        return value
+
+    def invalidate(self):
+        cache = self._current()
+        if cache.backend is not None:
+            cache.backend.clear()
+
+    def delete(self, *keys):
+        """
+        Drops the entries of keys only, the catalog version doesn't change
+        """
+        cache = self._current()
+        if cache.backend is not None:
+            for key in keys:
+                cache.backend.delete(f"{cache.namespace}{key!r}")
+
+    def version(self):
+        """
+        Returns (number, modified_at) of the catalog, both change on every invalidation.
+        None when caching is disabled since changes are not tracked then, or when the backend is per process:
+        its version doesn't change when another worker changes the catalog.
+        """
+        cache = self._current()
+        if cache.backend is None or not cache.backend.shared:
+            return None
+        return cache.backend.version()
+
+    def stats(self):
+        cache = self._current()
+        with cache._lock:
+            hits, misses = cache.hits, cache.misses
+        return {
+            "backend": type(cache.backend).__name__ if cache.backend is not None else None,
+            "entries": len(cache.backend) if cache.backend is not None else 0,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / (hits + misses) if hits + misses else 0,
+        }
+
+
+catalog_cache = CatalogCache()
@@ -0,0 +1,128 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app
+from flask.cli import ScriptInfo, with_appcontext
+
+from database_manager import (db, db_create_database, db_normalize_slugs, db_rebuild_sales_analytics,
+                              db_upsert_products)
+from image_pipeline import generate_variants
+from jobs import run_worker
+from product_import import import_products, read_rows
+from search_index import ensure_search_index
+from views import IMAGE_UPLOAD_FOLDER
+import static_assets
+
+
+class MigrateCommands(click.Group):
+    """
+    The flask db commands of Flask-Migrate. Flask-Migrate imports alembic, which is only worth its startup time
+    when a migration command runs, so both are imported the first time one of the commands is looked up.
+    """
+
+    def _migrate_group(self, ctx):
+        from flask_migrate import Migrate
+        from flask_migrate.cli import db as migrate_group
+
+        app = ctx.ensure_object(ScriptInfo).load_app()
+        if 'migrate' not in app.extensions:
+            Migrate(app, db, compare_type=True, render_as_batch=True)
+        return migrate_group
+
+    def list_commands(self, ctx):
+        return self._migrate_group(ctx).list_commands(ctx)
+
+    def get_command(self, ctx, cmd_name):
+        return self._migrate_group(ctx).get_command(ctx, cmd_name)
+
+
+@click.command('create_db')
+@with_appcontext
+def create_db():
+    result = db_create_database()
+    click.echo(result)
+
+
+@click.command('backfill-images')
+@click.option('--force', is_flag=True, help='Regenerate variants that already exist')
+@with_appcontext
+def backfill_images(force):
+    """Generates the resized and WebP variants of every uploaded image."""
+    if not os.path.isdir(IMAGE_UPLOAD_FOLDER):
+        click.echo(f"{IMAGE_UPLOAD_FOLDER} does not exist")
+        return
+    image_paths = [os.path.join(IMAGE_UPLOAD_FOLDER, filename) for filename in sorted(os.listdir(IMAGE_UPLOAD_FOLDER))
+                   if os.path.isfile(os.path.join(IMAGE_UPLOAD_FOLDER, filename))]
+    with ThreadPoolExecutor(max_workers=current_app.config['IMAGE_PIPELINE_WORKERS']) as executor:
+        results = executor.map(lambda image_path: generate_variants(image_path, force=force), image_paths)
+        for image_path, written in zip(image_paths, results):
+            click.echo(f"{image_path}: {len(written)} variants written")
+
+
+@click.command('build-static')
+@with_appcontext
+def build_static():
+    """Writes fingerprinted and precompressed copies of the static files to static/dist."""
+    manifest = static_assets.build_static(current_app.static_folder)
+    current_app.extensions['static_manifest'] = manifest
+    click.echo(f"{len(manifest)} static files fingerprinted")
+
+
+@click.command('import-products')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']),
+              help='Input format, guessed from the file extension by default')
+@click.option('--batch-size', default=1000, show_default=True, help='Products written per transaction')
+@click.option('--rejects', type=click.File('w', encoding='utf-8'), default='import_rejects.jsonl',
+              show_default=True, help='JSON lines file the invalid rows are written to')
+@with_appcontext
+def import_products_command(source, file_format, batch_size, rejects):
+    """Imports products from a CSV or JSON lines file, products with a known slug are updated."""
+    report = import_products(read_rows(source, file_format), db_upsert_products, batch_size=batch_size,
+                             rejects=rejects, progress=lambda report: click.echo(report))
+    click.echo(f"Done: {report}")
+    if report.rejected:
+        click.echo(f"Rejected rows written to {rejects.name}")
+
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index():
+    """Creates the full text index of the products if it is missing and refills it."""
+    ensure_search_index()
+    click.echo("Search index rebuilt")
+
+
+@click.command('normalize-slugs')
+@with_appcontext
+def normalize_slugs():
+    """Makes the slug of every product URL friendly and unique, then makes the slug index unique."""
+    changed = db_normalize_slugs()
+    click.echo(f"{changed} slugs changed")
+
+
+@click.command('rebuild-sales-analytics')
+@click.option('--chunk-days', default=31, show_default=True, help='Days of sales recomputed per transaction')
+@with_appcontext
+def rebuild_sales_analytics(chunk_days):
+    """Recomputes the daily, per product and per payment mode sales aggregates from the recorded sales."""
+    db_rebuild_sales_analytics(chunk_days, progress=lambda start, end: click.echo(f"Rebuilt {start} to {end}"))
+    click.echo("Sales analytics rebuilt")
+
+
+@click.command('worker')
+@click.option('--once', is_flag=True, help='Exit as soon as no job is due instead of polling')
+@click.option('--worker-id', help='Name recorded on the claimed jobs, host:pid by default')
+@with_appcontext
+def worker(once, worker_id):
+    """Runs the background jobs enqueued by the application."""
+    processed = run_worker(current_app._get_current_object(), worker_id=worker_id, once=once)
+    click.echo(f"{processed} jobs run")
+
+
+def init_app(app):
+    app.cli.add_command(MigrateCommands('db', help='Database migrations (Flask-Migrate).'))
+    for command in (create_db, backfill_images, build_static, import_products_command, normalize_slugs,
+                    rebuild_search_index, rebuild_sales_analytics, worker):
+        app.cli.add_command(command)
@@ -1,7 +1,48 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, case, delete, func, insert, literal, select, tuple_, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import joinedload, make_transient_to_detached, selectinload
+from sqlalchemy.schema import CreateIndex, DropIndex
+
 from database_models import *
-from werkzeug.security import generate_password_hash
 
+from cache import MemoryCacheBackend, catalog_cache
+from database_routing import reads_from_replica
 from errors_messages import Errors
+from helpers import encode_cursor, decode_cursor, slugify
+from passwords import password_hasher
+from search_index import search_ranking, search_terms
+
+PRODUCTS_PAGE_SIZE = 24
+ORDERS_PAGE_SIZE = 20
+# Tries of db_add_products to find a slug no concurrent request took
+SLUG_ATTEMPTS = 5
+# Most products a single add to cart request may change
+CART_BATCH_LIMIT = 100
+# Cart row returned by db_add_to_cart when the delta took the product out of the cart, its quantity is 0
+RemovedCartItem = namedtuple("RemovedCartItem", ("inventory_id", "quantity"))
+
+# Lower edges of the buckets counted for every catalog filter, the last bucket of each is open ended
+FACET_BUCKETS = {
+    "price": (0, 500, 1000, 2500, 5000, 10000, 25000),
+    "weight": (0, 1, 5, 10, 50, 100, 500),
+    "rating": (1, 2, 3, 4, 5),
+    "discount": (0, 10, 25, 50),
+}
+# Facets filtered by a minimum only, their buckets count everything from the edge up ("4 stars & up")
+OPEN_ENDED_FACETS = ("rating", "discount")
+
+# Columns needed to render a product card, listing pages are cached as plain rows of these
+CATALOG_COLUMNS = (Inventory.id, Inventory.name, Inventory.original_price, Inventory.promotion_price,
+                   Inventory.rating, Inventory.image_url, Inventory.weight, Inventory.slug, Inventory.added_on,
+                   Inventory.discount_percent.label("discount_percent"), Inventory.savings.label("savings"))
+# Columns of a product page, see db_get_product
+PRODUCT_COLUMNS = CATALOG_COLUMNS + (Inventory.description, Inventory.quantity)
+
+# Columns of recently loaded users, see db_load_user
+user_cache = MemoryCacheBackend(max_entries=4096)
 
 
 def db_create_database():
@@ -14,22 +55,97 @@ def db_add_products(name, image_url, weight, quantity, original_price, promotion
     if not name or not image_url or not weight or not quantity or not original_price or not promotion_price:
         return Errors.MISSING_PARAMS
 
-    if not slug:
-        slug = name.replace(" ", "-")
+    base_slug = slugify(slug or name)
+    for _ in range(SLUG_ATTEMPTS):
+        inventory = Inventory(name=name, image_url=image_url, weight=weight, quantity=quantity,
+                              original_price=original_price, promotion_price=promotion_price,
+                              description=description, slug=_free_slug(base_slug))
+        db.session.add(inventory)
+        try:
+            db.session.commit()
+            break
+        except IntegrityError:
+            # Another request took the same slug between _free_slug and the commit
+            db.session.rollback()
+    else:
+        raise RuntimeError(f"No free slug for {base_slug}")
+    catalog_cache.invalidate()
+    return inventory
+
+
+def _free_slug(base_slug):
+    """
+    base_slug, or base_slug-<n> with the smallest n not used by another product
+    """
+    taken = set(db.session.scalars(select(Inventory.slug).where(
+        (Inventory.slug == base_slug) | Inventory.slug.like(f"{base_slug}-%"))))
+    if base_slug not in taken:
+        return base_slug
+    suffix = 2
+    while f"{base_slug}-{suffix}" in taken:
+        suffix += 1
+    return f"{base_slug}-{suffix}"
+
+
+def db_normalize_slugs(batch_size=1000):
+    """
+    Rewrites the slug of every product with slugify, adding -<n> suffixes to slugs used by several products,
+    and makes ix_inventory_slug unique. Needed once by databases created before slugs were unique.
+    Returns the number of products whose slug changed.
+    """
+    slug_index = next(index for index in Inventory.__table__.indexes if index.name == 'ix_inventory_slug')
+    db.session.execute(DropIndex(slug_index, if_exists=True))
+
+    taken = set()
+    changes = []
+    for product_id, name, slug in db.session.execute(
+            select(Inventory.id, Inventory.name, Inventory.slug).order_by(Inventory.id)):
+        base_slug = new_slug = slugify(slug or name)
+        suffix = 2
+        while new_slug in taken:
+            new_slug = f"{base_slug}-{suffix}"
+            suffix += 1
+        taken.add(new_slug)
+        if new_slug != slug:
+            changes.append({"id": product_id, "slug": new_slug})
 
-    inventory = Inventory(name=name, image_url=image_url, weight=weight, quantity=quantity,
-                          original_price=original_price, promotion_price=promotion_price, description=description,
-                          slug=slug)
-    db.session.add(inventory)
+    for start in range(0, len(changes), batch_size):
+        db.session.execute(update(Inventory), changes[start:start + batch_size])
+    db.session.execute(CreateIndex(slug_index))
     db.session.commit()
-    return inventory
+    catalog_cache.invalidate()
+    return len(changes)
+
+
+def db_upsert_products(products):
+    """
+    Inserts or updates a batch of products in one transaction, products already stored with the same slug are updated.
+    products: dicts of Inventory columns, each with a distinct slug, the last of those sharing one is kept.
+    Returns (inserted, updated).
+    """
+    by_slug = {product["slug"]: product for product in products}
+    existing = dict(db.session.execute(
+        select(Inventory.slug, Inventory.id).where(Inventory.slug.in_(list(by_slug)))).all())
+    updates = [dict(product, id=existing[slug]) for slug, product in by_slug.items() if slug in existing]
+    inserts = [product for slug, product in by_slug.items() if slug not in existing]
+    try:
+        if updates:
+            db.session.execute(update(Inventory), updates)
+        if inserts:
+            db.session.execute(insert(Inventory), inserts)
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        raise
+    catalog_cache.invalidate()
+    return len(inserts), len(updates)
 
 
 def db_add_user(first_name, last_name, phone, password):
     if not first_name or not last_name or not phone or not password:
         return Errors.MISSING_PARAMS
 
-    password = generate_password_hash(password)
+    password = password_hasher.hash(password)
 
     user = User(firstname=first_name, lastname=last_name, phone=phone, password=password)
     db.session.add(user)
@@ -37,18 +153,237 @@ def db_add_user(first_name, last_name, phone, password):
     return user
 
 
-def db_get_all_products(lower_bound=None, upper_bound=None):
-    if lower_bound and upper_bound:
-        products = Inventory.query.filter(Inventory.weight.between(lower_bound, upper_bound)).all()
-    elif lower_bound:
-        products = Inventory.query.filter(Inventory.weight >= lower_bound).all()
-    elif upper_bound:
-        products = Inventory.query.filter(Inventory.weight <= upper_bound).all()
-    else:
-        products = Inventory.query.all()
-    return products
+def db_update_password(user, password):
+    """
+    Stores a new hash of password for user, used to upgrade hashes made with outdated parameters
+    """
+    user.password = password_hasher.hash(password)
+    db.session.commit()
+    db_invalidate_user(user.id)
+    return user
+
+
+def db_load_user(user_id, ttl=0):
+    """
+    Loads the signed in user of a request.
+    ttl: seconds the user's columns are kept in memory, a cached user is attached to the session without a query.
+    Call db_invalidate_user whenever a user is modified so that other requests don't see stale columns.
+    """
+    if not ttl:
+        return db.session.get(User, user_id)
+
+    found, columns = user_cache.get(user_id)
+    if not found:
+        user = db.session.get(User, user_id)
+        if user:
+            user_cache.set(user_id, {column.key: getattr(user, column.key) for column in User.__table__.columns}, ttl)
+        return user
+
+    user = User(**columns)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def db_invalidate_user(user_id):
+    user_cache.delete(user_id)
+
+
+def db_get_basket(user_id):
+    """
+    Returns the cart items of a user with their products loaded by the same query, rows of products that no
+    longer exist are left out
+    """
+    return CartItems.query.options(joinedload(CartItems.product, innerjoin=True)).filter_by(user_id=user_id) \
+        .order_by(CartItems.added_on, CartItems.id).all()
+
+
+def db_count_basket_items(user_id):
+    return db.session.scalar(select(func.count(CartItems.id)).where(CartItems.user_id == user_id))
+
+
+def db_count_orders(user_id):
+    return db.session.scalar(select(func.count(Sale.id)).where(Sale.bought_by == user_id))
+
+
+def db_get_orders(user_id, after=None, page_size=ORDERS_PAGE_SIZE):
+    """
+    Returns one page of the orders of a user, newest first, together with the cursor of the next page.
+    Every order is a (sale, item count, total) row, the count and total are computed from the sold items by the
+    database and the sale items are loaded with their products, so a page takes two queries whatever its size.
+    """
+    item_count = select(func.coalesce(func.sum(SaleData.quantity), 0)).where(SaleData.sale_id == Sale.id) \
+        .scalar_subquery()
+    total = select(func.coalesce(func.sum(SaleData.sale_price * SaleData.quantity), 0)) \
+        .where(SaleData.sale_id == Sale.id).scalar_subquery()
+    query = select(Sale, item_count.label("item_count"), total.label("total")) \
+        .where(Sale.bought_by == user_id) \
+        .options(selectinload(Sale.products).joinedload(SaleData.inventory))
+
+    position = decode_cursor(after) if after else None
+    if position:
+        query = query.where(tuple_(Sale.added_on, Sale.id) < position)
+
+    orders = db.session.execute(query.order_by(Sale.added_on.desc(), Sale.id.desc()).limit(page_size + 1)).all()
+    next_cursor = None
+    if len(orders) > page_size:
+        orders = orders[:page_size]
+        next_cursor = encode_cursor(orders[-1].Sale.added_on, orders[-1].Sale.id)
+    return orders, next_cursor
+
+
+@reads_from_replica
+def db_get_all_products(lower_bound=None, upper_bound=None, after=None, page_size=PRODUCTS_PAGE_SIZE, min_price=None,
+                        max_price=None, min_rating=None, min_discount=None):
+    """
+    Returns one page of products ordered by (added_on, id) together with the cursor of the next page.
+    lower_bound, upper_bound: weight range, lower_bound <= weight < upper_bound
+    min_price, max_price: promotion price range, min_price <= price < max_price
+    min_rating, min_discount: lowest rating and discount percentage
+    after: opaque cursor returned by a previous call, the page starts right after it
+    The cursor is None when there are no more products.
+    Pages are served from the catalog cache, the products are rows holding CATALOG_COLUMNS.
+    """
+    filters = (lower_bound, upper_bound, min_price, max_price, min_rating, min_discount)
+    return catalog_cache.get_or_load(
+        ("products", filters, after, page_size),
+        lambda: _query_products(db.session, _facet_conditions(*filters), after, page_size)
+    )
+
+
+def _facet_conditions(lower_bound=None, upper_bound=None, min_price=None, max_price=None, min_rating=None,
+                      min_discount=None):
+    """
+    Returns the SQL conditions of the catalog filters grouped by facet.
+    Upper bounds are exclusive like the facet buckets, so a bucket link lists exactly the products it counted.
+    """
+    conditions = {facet: [] for facet in FACET_BUCKETS}
+    if lower_bound is not None:
+        conditions["weight"].append(Inventory.weight >= lower_bound)
+    if upper_bound is not None:
+        conditions["weight"].append(Inventory.weight < upper_bound)
+    if min_price is not None:
+        conditions["price"].append(Inventory.promotion_price >= min_price)
+    if max_price is not None:
+        conditions["price"].append(Inventory.promotion_price < max_price)
+    if min_rating is not None:
+        conditions["rating"].append(Inventory.rating >= min_rating)
+    if min_discount is not None:
+        conditions["discount"].append(Inventory.discount_percent >= min_discount)
+    return conditions
+
+
+def _query_products(session, conditions, after, page_size):
+    """
+    Page of db_get_all_products read with session, async_database_manager runs it through AsyncSession.run_sync
+    """
+    query = select(*CATALOG_COLUMNS)
+    for facet_conditions in conditions.values():
+        query = query.where(*facet_conditions)
+
+    position = decode_cursor(after) if after else None
+    if position:
+        query = query.where(tuple_(Inventory.added_on, Inventory.id) > position)
+
+    # Fetch one extra row to find out whether there is a next page without a count query
+    products = session.execute(query.order_by(Inventory.added_on, Inventory.id).limit(page_size + 1)).all()
+    next_cursor = None
+    if len(products) > page_size:
+        products = products[:page_size]
+        next_cursor = encode_cursor(products[-1].added_on, products[-1].id)
+    return products, next_cursor
+
+
+@reads_from_replica
+def db_get_product(product_id=None, slug=None):
+    """
+    Returns the product with product_id, or else with slug, as a row holding PRODUCT_COLUMNS, None when there is none.
+    Served from the catalog cache like the catalog pages.
+    """
+    condition = Inventory.id == product_id if product_id is not None else Inventory.slug == slug
+    return catalog_cache.get_or_load(
+        ("product", product_id, slug),
+        lambda: db.session.execute(select(*PRODUCT_COLUMNS).where(condition).order_by(Inventory.id).limit(1)).first()
+    )
+
+
+def _forget_products(products):
+    """
+    Drops the cached rows of db_get_product of products, (id, slug) pairs
+    """
+    catalog_cache.delete(*[key for product_id, slug in products
+                           for key in (("product", product_id, None), ("product", None, slug))])
+
+
+@reads_from_replica
+def db_search_products(query, after=None, page_size=PRODUCTS_PAGE_SIZE):
+    """
+    Returns one page of the products matching query through the full text index, best matches first,
+    together with the cursor of the next page (None on the last page).
+    Like db_get_all_products, pages are served from the catalog cache as rows holding CATALOG_COLUMNS.
+    """
+    if not search_terms(query or ""):
+        return [], None
+    return catalog_cache.get_or_load(
+        ("search", query, after, page_size),
+        lambda: _query_search(query, after, page_size)
+    )
+
+
+def _query_search(query, after, page_size):
+    # Ranked results have no stable ordering key to seek to, the cursor holds the offset of the next page
+    offset = int(after) if after and after.isdigit() else 0
+    hits = search_ranking(query, page_size + 1, offset)
+    products = db.session.execute(
+        select(*CATALOG_COLUMNS).join(hits, Inventory.id == hits.c.id).order_by(hits.c.rank, Inventory.id)
+    ).all()
+    next_cursor = None
+    if len(products) > page_size:
+        products = products[:page_size]
+        next_cursor = str(offset + page_size)
+    return products, next_cursor
+
+
+@reads_from_replica
+def db_get_facet_counts(lower_bound=None, upper_bound=None, min_price=None, max_price=None, min_rating=None,
+                        min_discount=None):
+    """
+    Counts the products of every FACET_BUCKETS bucket with one aggregate query, cached with the catalog.
+    The counts of a facet apply the filters of the other facets only, so they tell how many products
+    choosing that bucket instead of the current one would list.
+    Returns {facet: [{"low": ..., "high": ..., "count": ...}]}, high is None for the open ended buckets.
+    """
+    filters = (lower_bound, upper_bound, min_price, max_price, min_rating, min_discount)
+    return catalog_cache.get_or_load(("facets", filters), lambda: _query_facet_counts(_facet_conditions(*filters)))
 
 
+def _query_facet_counts(conditions):
+    columns = {
+        "weight": Inventory.weight,
+        "price": Inventory.promotion_price,
+        "rating": Inventory.rating,
+        "discount": Inventory.discount_percent,
+    }
+    counts = []
+    for facet in FACET_BUCKETS:
+        other_filters = [condition for other, facet_conditions in conditions.items() if other != facet
+                         for condition in facet_conditions]
+        for low, high in _bucket_edges(facet):
+            bucket = [columns[facet] >= low] + ([columns[facet] < high] if high is not None else [])
+            counts.append(func.sum(case((and_(*bucket, *other_filters), 1), else_=0)))
+
+    values = iter(db.session.execute(select(*counts)).one())
+    return {facet: [{"low": low, "high": high, "count": next(values) or 0} for low, high in _bucket_edges(facet)]
+            for facet in FACET_BUCKETS}
+
+
+def _bucket_edges(facet):
+    edges = FACET_BUCKETS[facet]
+    if facet in OPEN_ENDED_FACETS:
+        return [(low, None) for low in edges]
+    return list(zip(edges, edges[1:] + (None,)))
+
+
+@reads_from_replica
 def db_get_user_by_phone(phone):
     user = User.query.filter_by(phone=phone).first()
     return user
@@ -64,44 +399,394 @@ def db_remove_from_cart(user_id, product_id):
     return True
 
 
-def db_add_sale(product_id_list, user_id, payment_method):
+def db_add_sale(product_id_list, user_id, payment_method, clear_cart=False, follow_up_jobs=()):
+    """
+    Records a sale of the given (product id, quantity) pairs as a single transaction.
+    The inventory rows are fetched in one query, the stock is reserved with one conditional update,
+    the sale items are bulk inserted and the total is computed by the database, so the number of
+    round trips does not depend on the basket size.
+    Unknown products are skipped. When a product doesn't have enough stock nothing is recorded and
+    Errors.INSUFFICIENT_STOCK is returned with an "items" list describing every shortage.
+    clear_cart: also takes the quantities bought out of the buyer's cart inside the same transaction
+    follow_up_jobs: names of background tasks enqueued with the sale id inside the same transaction,
+    so they run exactly when the sale is recorded
+    """
+    return _add_sale(db.session, product_id_list, user_id, payment_method, clear_cart, follow_up_jobs)
+
+
+def _add_sale(session, product_id_list, user_id, payment_method, clear_cart=False, follow_up_jobs=()):
+    """
+    db_add_sale within session, async_database_manager runs it through AsyncSession.run_sync
+    """
     if not product_id_list or not user_id:
         return Errors.MISSING_PARAMS
 
-    products_total = 0
+    quantities = {}
+    for product_id, quantity in product_id_list:
+        try:
+            product_id, quantity = int(product_id), int(quantity)
+        except (TypeError, ValueError):
+            return Errors.INVALID_QUANTITY
+        # A negative quantity would put stock back through the UPDATE below
+        if quantity <= 0:
+            return Errors.INVALID_QUANTITY
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
 
-    new_sale = Sale(bought_by=user_id, payment_mode=payment_method)
-    db.session.add(new_sale)
-    db.session.commit()
+    try:
+        new_sale = Sale(bought_by=user_id, payment_mode=payment_method)
+        session.add(new_sale)
+        session.flush()
 
-    for product_id, quantity in product_id_list:
+        products = session.execute(select(Inventory.id, Inventory.promotion_price, Inventory.original_price,
+                                          Inventory.slug).where(Inventory.id.in_(quantities))).all()
+        prices = {product_id: (promotion_price, original_price)
+                  for product_id, promotion_price, original_price, _ in products}
 
-        product = db.session.get(Inventory, product_id)
-        if product:
-            products_total += product.promotion_price
-            new_sale_data = SaleData(inventory_id=product_id, sale_id=new_sale.id, quantity=quantity)
-            db.session.add(new_sale_data)
-            db.session.commit()
+        # Reserve the stock with one conditional UPDATE: a row is only decremented when it still holds
+        # enough units, so concurrent checkouts can never oversell and nobody has to lock the table.
+        reserved = {product_id: quantity for product_id, quantity in quantities.items() if product_id in prices}
+        if reserved:
+            requested = case(reserved, value=Inventory.id)
+            result = session.execute(
+                update(Inventory)
+                .where(Inventory.id.in_(reserved), Inventory.quantity >= requested)
+                .values(quantity=Inventory.quantity - requested),
+                execution_options={"synchronize_session": False})
+            if result.rowcount != len(reserved):
+                session.rollback()
+                return _insufficient_stock(session, reserved)
+        sale_items = [
+            {"sale_id": new_sale.id, "inventory_id": product_id, "quantity": quantity,
+             "sale_price": prices[product_id][0],
+             "discount": max((prices[product_id][1] or 0) - (prices[product_id][0] or 0), 0)}
+            for product_id, quantity in quantities.items() if product_id in prices
+        ]
+        if sale_items:
+            session.execute(insert(SaleData), sale_items)
 
-    new_sale.total = products_total
-    db.session.add(new_sale)
-    db.session.commit()
+        sale_total = select(func.coalesce(func.sum(SaleData.sale_price * SaleData.quantity), 0)) \
+            .where(SaleData.sale_id == new_sale.id).scalar_subquery()
+        session.execute(update(Sale).where(Sale.id == new_sale.id).values(total=sale_total),
+                        execution_options={"synchronize_session": False})
+
+        if clear_cart:
+            # Only the quantities bought leave the cart, items added since it was read stay for the next checkout
+            bought = case(quantities, value=CartItems.inventory_id)
+            session.execute(update(CartItems)
+                            .where(CartItems.user_id == user_id, CartItems.inventory_id.in_(quantities))
+                            .values(quantity=CartItems.quantity - bought),
+                            execution_options={"synchronize_session": False})
+            session.execute(delete(CartItems).where(CartItems.user_id == user_id, CartItems.quantity <= 0),
+                            execution_options={"synchronize_session": False})
+        for job_name in follow_up_jobs:
+            _insert_job(session, job_name, {"sale_id": new_sale.id}, idempotency_key=f"{job_name}:{new_sale.id}")
+        if sale_items:
+            # Every checkout of the day updates the same aggregate rows, their locks are only held through the commit
+            _record_sale_analytics(session, new_sale, sale_items)
+        session.commit()
+    except SQLAlchemyError:
+        session.rollback()
+        return Errors.SALE_NOT_CREATED
+
+    if reserved:
+        # Listings don't show the stock, only the cached rows of the products sold are stale
+        _forget_products((product_id, slug) for product_id, _, _, slug in products if product_id in reserved)
 
     return new_sale
 
 
+def _dialect_insert(session, table):
+    """
+    INSERT statement of the database of session, which supports ON CONFLICT clauses
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        raise NotImplementedError(f"Upserts are not available on {dialect}")
+    return dialect_insert(table)
+
+
+def _upsert(session, model, rows, increments):
+    """
+    Inserts rows, or adds the increments columns of the rows to the stored row with the same primary key
+    """
+    table = model.__table__
+    statement = _dialect_insert(session, table).values(rows)
+    return session.execute(statement.on_conflict_do_update(
+        index_elements=[column.name for column in table.primary_key.columns],
+        set_={column: table.c[column] + statement.excluded[column] for column in increments}
+    ))
+
+
+def _record_sale_analytics(session, sale, sale_items):
+    """
+    Adds a sale to the daily, per product and per payment mode aggregates, inside the transaction of the sale.
+    Run it last before the commit: the rows are locked in the same order by every checkout, the daily row shared by
+    all of them at the very end.
+    """
+    day = sale.added_on.date()
+    revenue = sum(item["sale_price"] * item["quantity"] for item in sale_items)
+    units = sum(item["quantity"] for item in sale_items)
+    discount = sum(item["discount"] * item["quantity"] for item in sale_items)
+    _upsert(session, ProductSales, [
+        {"day": day, "inventory_id": item["inventory_id"], "units": item["quantity"],
+         "revenue": item["sale_price"] * item["quantity"], "discount": item["discount"] * item["quantity"]}
+        for item in sorted(sale_items, key=lambda item: item["inventory_id"])
+    ], ("units", "revenue", "discount"))
+    _upsert(session, PaymentModeSales,
+            [{"day": day, "payment_mode": sale.payment_mode, "orders": 1, "revenue": revenue}], ("orders", "revenue"))
+    _upsert(session, DailySales, [{"day": day, "orders": 1, "units": units, "revenue": revenue, "discount": discount}],
+            ("orders", "units", "revenue", "discount"))
+
+
+def db_rebuild_sales_analytics(chunk_days=31, progress=None):
+    """
+    Recomputes the sales aggregates from sales and sale_data, one transaction per chunk_days days,
+    so sales recorded while it runs are never counted twice.
+    progress: called with the first and last day of every rebuilt chunk
+    """
+    first_sale, last_sale = db.session.execute(select(func.min(Sale.added_on), func.max(Sale.added_on))).one()
+    aggregates = (DailySales, ProductSales, PaymentModeSales)
+    if first_sale is None:
+        for model in aggregates:
+            db.session.execute(delete(model))
+        db.session.commit()
+        return
+    first_day, last_day = first_sale.date(), last_sale.date()
+    for model in aggregates:
+        db.session.execute(delete(model).where((model.day < first_day) | (model.day > last_day)))
+    db.session.commit()
+
+    day = func.date(Sale.added_on)
+    line_revenue = func.sum(SaleData.sale_price * SaleData.quantity)
+    line_discount = func.sum(func.coalesce(SaleData.discount, 0) * SaleData.quantity)
+    start = first_day
+    while start <= last_day:
+        end = min(start + timedelta(days=chunk_days - 1), last_day)
+        in_chunk = Sale.added_on.between(datetime.combine(start, datetime.min.time()),
+                                         datetime.combine(end, datetime.max.time()))
+        try:
+            for model in aggregates:
+                db.session.execute(delete(model).where(model.day.between(start, end)))
+            db.session.execute(insert(DailySales).from_select(
+                ["day", "orders", "units", "revenue", "discount"],
+                select(day, func.count(func.distinct(Sale.id)), func.sum(SaleData.quantity), line_revenue,
+                       line_discount).join(SaleData, SaleData.sale_id == Sale.id).where(in_chunk).group_by(day)))
+            db.session.execute(insert(ProductSales).from_select(
+                ["day", "inventory_id", "units", "revenue", "discount"],
+                select(day, SaleData.inventory_id, func.sum(SaleData.quantity), line_revenue, line_discount)
+                .join(SaleData, SaleData.sale_id == Sale.id).where(in_chunk).group_by(day, SaleData.inventory_id)))
+            db.session.execute(insert(PaymentModeSales).from_select(
+                ["day", "payment_mode", "orders", "revenue"],
+                select(day, Sale.payment_mode, func.count(func.distinct(Sale.id)), line_revenue)
+                .join(SaleData, SaleData.sale_id == Sale.id).where(in_chunk).group_by(day, Sale.payment_mode)))
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            raise
+        if progress is not None:
+            progress(start, end)
+        start = end + timedelta(days=1)
+
+
+@reads_from_replica
+def db_get_daily_sales(start=None, end=None):
+    query = select(DailySales).order_by(DailySales.day)
+    if start:
+        query = query.where(DailySales.day >= start)
+    if end:
+        query = query.where(DailySales.day <= end)
+    return db.session.execute(query).scalars().all()
+
+
+@reads_from_replica
+def db_get_product_sales(start=None, end=None, limit=50):
+    """
+    Returns the best selling products of the period by revenue as (id, name, units, revenue, discount) rows
+    """
+    revenue = func.sum(ProductSales.revenue).label("revenue")
+    query = select(Inventory.id, Inventory.name, func.sum(ProductSales.units).label("units"), revenue,
+                   func.sum(ProductSales.discount).label("discount")) \
+        .join(Inventory, Inventory.id == ProductSales.inventory_id) \
+        .group_by(Inventory.id, Inventory.name).order_by(revenue.desc(), Inventory.id).limit(limit)
+    if start:
+        query = query.where(ProductSales.day >= start)
+    if end:
+        query = query.where(ProductSales.day <= end)
+    return db.session.execute(query).all()
+
+
+@reads_from_replica
+def db_get_payment_mode_sales(start=None, end=None):
+    query = select(PaymentModeSales.payment_mode, func.sum(PaymentModeSales.orders).label("orders"),
+                   func.sum(PaymentModeSales.revenue).label("revenue")) \
+        .group_by(PaymentModeSales.payment_mode).order_by(PaymentModeSales.payment_mode)
+    if start:
+        query = query.where(PaymentModeSales.day >= start)
+    if end:
+        query = query.where(PaymentModeSales.day <= end)
+    return db.session.execute(query).all()
+
+
+def db_iter_sales(start=None, end=None, batch_size=1000):
+    """
+    Yields every sold item of the period with its sale and product, fetched batch_size rows at a time
+    through a server side cursor so that memory use doesn't depend on the length of the period
+    """
+    query = select(Sale.id, Sale.added_on, Sale.bought_by, Sale.payment_mode, Sale.status, SaleData.inventory_id,
+                   Inventory.name, SaleData.quantity, SaleData.sale_price, SaleData.discount) \
+        .join(SaleData, SaleData.sale_id == Sale.id).join(Inventory, Inventory.id == SaleData.inventory_id) \
+        .order_by(Sale.added_on, Sale.id, SaleData.id)
+    if start:
+        query = query.where(Sale.added_on >= datetime.combine(start, datetime.min.time()))
+    if end:
+        query = query.where(Sale.added_on <= datetime.combine(end, datetime.max.time()))
+    result = db.session.execute(query.execution_options(stream_results=True, yield_per=batch_size))
+    for partition in result.partitions():
+        yield from partition
+
+
+def _insufficient_stock(session, requested_quantities):
+    """
+    Builds the error returned by db_add_sale listing every product that can't cover the requested quantity
+    """
+    stock = session.execute(
+        select(Inventory.id, Inventory.name, Inventory.quantity).where(Inventory.id.in_(requested_quantities))
+    ).all()
+    items = [
+        {"product_id": product_id, "name": name, "requested": requested_quantities[product_id],
+         "available": available or 0}
+        for product_id, name, available in stock
+        if (available or 0) < requested_quantities[product_id]
+    ]
+    return dict(Errors.INSUFFICIENT_STOCK, items=items)
+
+
 def db_add_to_cart(user_id, product_id, quantity):
     if not user_id or not product_id or not quantity:
         return Errors.MISSING_PARAMS
+    return _added_cart_item(product_id, db_add_to_cart_items(user_id, [(product_id, quantity)]))
 
-    # Check if the product is already in cart
-    cart_item = CartItems.query.filter_by(user_id=user_id, inventory_id=product_id).first()
-    if cart_item:
-        cart_item.quantity += quantity
+
+def _added_cart_item(product_id, rows):
+    """
+    The cart row of product_id among the rows written by _add_to_cart_items, errors are returned as they are
+    """
+    if isinstance(rows, dict):
+        return rows
+    return rows[0] if rows else RemovedCartItem(product_id, 0)
+
+
+def db_add_to_cart_items(user_id, items):
+    """
+    Adds quantity deltas to the cart of a user in one statement: products not in the cart are inserted and the
+    quantity of the others is incremented by the database, so concurrent adds never create duplicate rows.
+    items: (product_id, quantity) pairs, a product may appear more than once and quantities may be negative.
+    Returns the (inventory_id, quantity) rows written, products whose quantity dropped to zero are removed.
+    Nothing is written when a product doesn't exist.
+    """
+    return _add_to_cart_items(db.session, user_id, items)
+
+
+def _add_to_cart_items(session, user_id, items):
+    """
+    db_add_to_cart_items within session, async_database_manager runs it through AsyncSession.run_sync
+    """
+    deltas = {}
+    for product_id, quantity in items:
+        deltas[product_id] = deltas.get(product_id, 0) + quantity
+    deltas = {product_id: quantity for product_id, quantity in deltas.items() if quantity}
+    if not user_id or not deltas:
+        return Errors.MISSING_PARAMS
+    if len(deltas) > CART_BATCH_LIMIT:
+        return Errors.TOO_MANY_ITEMS
+
+    # Rows are only written for products of the inventory, an unknown id would leave a cart row without a product
+    products = select(literal(user_id), Inventory.id, case(deltas, value=Inventory.id), literal(datetime.utcnow())) \
+        .where(Inventory.id.in_(list(deltas)))
+    statement = _dialect_insert(session, CartItems.__table__).from_select(
+        ["user_id", "inventory_id", "quantity", "added_on"], products)
+    statement = statement.on_conflict_do_update(
+        index_elements=["user_id", "inventory_id"],
+        set_={"quantity": CartItems.quantity + statement.excluded.quantity}
+    ).returning(CartItems.inventory_id, CartItems.quantity)
+    try:
+        rows = session.execute(statement).all()
+        if len(rows) < len(deltas):
+            session.rollback()
+            return Errors.UNKNOWN_PRODUCT
+        emptied = [row.inventory_id for row in rows if row.quantity <= 0]
+        if emptied:
+            session.execute(delete(CartItems).where(CartItems.user_id == user_id,
+                                                    CartItems.inventory_id.in_(emptied)))
+        session.commit()
+    except SQLAlchemyError:
+        session.rollback()
+        raise
+    return [row for row in rows if row.quantity > 0]
+
+
+def db_enqueue_job(name, payload=None, idempotency_key=None, delay=0, max_attempts=5, commit=True):
+    """
+    Adds a job for the background workers, returns its id, or None when a job with idempotency_key already exists.
+    commit: False leaves the job in the current transaction, so it is only enqueued if that transaction commits
+    """
+    job_id = _insert_job(db.session, name, payload, idempotency_key, delay, max_attempts)
+    if commit:
         db.session.commit()
-        return cart_item
+    return job_id
+
 
-    new_cart_item = CartItems(user_id=user_id, inventory_id=product_id, quantity=quantity)
-    db.session.add(new_cart_item)
+def _insert_job(session, name, payload=None, idempotency_key=None, delay=0, max_attempts=5):
+    statement = _dialect_insert(session, Job.__table__).values(
+        name=name, payload=payload or {}, idempotency_key=idempotency_key, status=JobStatus.QUEUED,
+        attempts=0, max_attempts=max_attempts, run_at=datetime.utcnow() + timedelta(seconds=delay),
+        added_on=datetime.utcnow()
+    ).on_conflict_do_nothing(index_elements=["idempotency_key"]).returning(Job.id)
+    return session.execute(statement).scalar()
+
+
+def db_claim_jobs(worker_id, limit=10, visibility_timeout=300):
+    """
+    Marks up to limit due jobs as running for worker_id and returns them.
+    Due jobs are queued jobs whose run_at has passed and running jobs whose visibility timeout expired,
+    i.e. whose worker died or hung. Claiming is one UPDATE, two workers never get the same job.
+    """
+    now = datetime.utcnow()
+    due = select(Job.id).where(
+        ((Job.status == JobStatus.QUEUED) & (Job.run_at <= now))
+        | ((Job.status == JobStatus.RUNNING) & (Job.locked_until < now))
+    ).order_by(Job.run_at, Job.id).limit(limit).with_for_update(skip_locked=True)
+    claimed = db.session.execute(
+        update(Job).where(Job.id.in_(due.scalar_subquery()))
+        .values(status=JobStatus.RUNNING, locked_by=worker_id,
+                locked_until=now + timedelta(seconds=visibility_timeout), attempts=Job.attempts + 1)
+        .returning(Job.id, Job.name, Job.payload, Job.attempts, Job.max_attempts),
+        execution_options={"synchronize_session": False}
+    ).all()
+    db.session.commit()
+    return claimed
+
+
+def db_finish_job(job_id, worker_id, error=None, retry_at=None):
+    """
+    Records the outcome of a job run by worker_id: done without error, queued again for retry_at after an error,
+    failed for good after an error without retry_at.
+    Returns False when the job was claimed again by another worker after its visibility timeout.
+    """
+    values = {"locked_by": None, "locked_until": None}
+    if error is None:
+        values.update(status=JobStatus.DONE, finished_on=datetime.utcnow())
+    elif retry_at is not None:
+        values.update(status=JobStatus.QUEUED, run_at=retry_at, last_error=error)
+    else:
+        values.update(status=JobStatus.FAILED, finished_on=datetime.utcnow(), last_error=error)
+    result = db.session.execute(
+        update(Job).where(Job.id == job_id, Job.locked_by == worker_id, Job.status == JobStatus.RUNNING)
+        .values(**values),
+        execution_options={"synchronize_session": False})
     db.session.commit()
-    return new_cart_item
+    return result.rowcount == 1
@@ -4,14 +4,17 @@ from enum import Enum
 from sqlalchemy import Enum as EnumDB, JSON
 
 from flask_login import UserMixin
-from sqlalchemy import Column
+from sqlalchemy import Column, literal_column
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm import declarative_base
 from flask_sqlalchemy import SQLAlchemy
 
+from database_routing import RoutingSession
+
 Base = declarative_base()
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
 class SaleStatus(Enum):
@@ -22,6 +25,13 @@ class SaleStatus(Enum):
     FULFILLED = "Fulfilled"
 
 
+class JobStatus(Enum):
+    QUEUED = "Queued"
+    RUNNING = "Running"
+    DONE = "Done"
+    FAILED = "Failed"
+
+
 class Roles(Enum):
     """
     The roles of a user
@@ -84,7 +94,7 @@ class Inventory(db.Model):
     description: product description
     image_url: product image url
     weight: product weight
-    slug: product slug for SEO purposes
+    slug: unique product slug for SEO purposes, names the product page /product/<slug>
     added_on: product added date
 
     """
@@ -102,6 +112,38 @@ class Inventory(db.Model):
     slug = db.Column(db.String(255))
     added_on = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Backs the keyset pagination of the catalog, the product pages and bulk import looking products up by slug,
+    # and the catalog filters
+    __table_args__ = (db.Index('ix_inventory_added_on_id', 'added_on', 'id'),
+                      db.Index('ix_inventory_slug', 'slug', unique=True),
+                      db.Index('ix_inventory_weight', 'weight'),
+                      db.Index('ix_inventory_promotion_price', 'promotion_price'),
+                      db.Index('ix_inventory_rating', 'rating'))
+
+    @hybrid_property
+    def discount_percent(self):
+        """
+        Percentage taken off the original price, the SQL expression is indexed, see ix_inventory_discount_percent
+        """
+        return (self.original_price - self.promotion_price) * 100 / self.original_price
+
+    @discount_percent.inplace.expression
+    @classmethod
+    def _discount_percent_expression(cls):
+        # 100 is written in the SQL: a bound parameter would render "* ?" in queries and "* 100" in the index,
+        # and SQLite only uses an expression index whose expression matches the query's exactly
+        return (cls.original_price - cls.promotion_price) * literal_column("100") / cls.original_price
+
+    @hybrid_property
+    def savings(self):
+        """
+        Amount taken off the original price
+        """
+        return self.original_price - self.promotion_price
+
+
+db.Index('ix_inventory_discount_percent', Inventory.discount_percent)
+
 
 class CartItems(db.Model):
     """
@@ -116,6 +158,8 @@ class CartItems(db.Model):
 
     """
     __tablename__ = 'cart_items'
+    # One row per product in a cart, adding a product again increments its quantity (see db_add_to_cart_items)
+    __table_args__ = (db.UniqueConstraint('user_id', 'inventory_id', name='uq_cart_items_user_inventory'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     inventory_id = db.Column(db.Integer, db.ForeignKey('inventory.id'))
@@ -150,6 +194,9 @@ class Sale(db.Model):
                                foreign_keys=[bought_by])
     added_on = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Backs the order history of a customer, newest first
+    __table_args__ = (db.Index('ix_sales_bought_by_added_on_id', 'bought_by', 'added_on', 'id'),)
+
 
 class SaleData(db.Model):
     """
@@ -173,3 +220,77 @@ class SaleData(db.Model):
     quantity = db.Column(db.Integer, default=1)
     added_on = db.Column(db.DateTime, default=datetime.utcnow)
     inventory = db.relationship("Inventory", backref=db.backref("sale_data", lazy=True))
+
+    __table_args__ = (db.Index('ix_sale_data_sale_id', 'sale_id'),)
+
+
+class DailySales(db.Model):
+    """
+    Sales totals of one day, kept up to date by db_add_sale
+    day: date of the sales
+    orders: number of sales
+    units: number of items sold
+    revenue: amount paid
+    discount: amount taken off the original prices
+    """
+    __tablename__ = 'daily_sales'
+    day = db.Column(db.Date, primary_key=True)
+    orders = db.Column(db.Integer, default=0, nullable=False)
+    units = db.Column(db.Integer, default=0, nullable=False)
+    revenue = db.Column(db.Float, default=0, nullable=False)
+    discount = db.Column(db.Float, default=0, nullable=False)
+
+
+class ProductSales(db.Model):
+    """
+    Sales totals of one product on one day, kept up to date by db_add_sale
+    """
+    __tablename__ = 'product_sales'
+    day = db.Column(db.Date, primary_key=True)
+    inventory_id = db.Column(db.Integer, db.ForeignKey('inventory.id'), primary_key=True)
+    units = db.Column(db.Integer, default=0, nullable=False)
+    revenue = db.Column(db.Float, default=0, nullable=False)
+    discount = db.Column(db.Float, default=0, nullable=False)
+
+
+class PaymentModeSales(db.Model):
+    """
+    Sales totals of one payment mode on one day, kept up to date by db_add_sale
+    """
+    __tablename__ = 'payment_mode_sales'
+    day = db.Column(db.Date, primary_key=True)
+    payment_mode = db.Column(db.Enum(PaymentMode), primary_key=True)
+    orders = db.Column(db.Integer, default=0, nullable=False)
+    revenue = db.Column(db.Float, default=0, nullable=False)
+
+
+class Job(db.Model):
+    """
+    A unit of background work, see jobs.py
+    name: name of the registered task to run
+    payload: keyword arguments of the task
+    idempotency_key: jobs enqueued again with the same key are dropped
+    status: queued, running, done or failed (out of attempts)
+    attempts: number of times the job was claimed by a worker
+    run_at: the job is not claimed before this time, used for delays and retry backoff
+    locked_by: worker running the job
+    locked_until: visibility timeout, a running job whose worker died is claimed again after it
+    last_error: error of the last failed attempt
+    """
+    __tablename__ = 'jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(JSON, nullable=False, default=dict)
+    idempotency_key = db.Column(db.String(255), unique=True)
+    status = db.Column(db.Enum(JobStatus), nullable=False, default=JobStatus.QUEUED)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100))
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    added_on = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_on = db.Column(db.DateTime)
+
+    # Backs the polling of the workers
+    __table_args__ = (db.Index('ix_jobs_status_run_at', 'status', 'run_at'),)
@@ -0,0 +1,98 @@
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from flask import has_request_context, session as flask_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+REPLICA_BIND = "replica"
+
+_reading_from_replica = ContextVar("reading_from_replica", default=False)
+
+
+def engine_options(uri, pool_size=5, max_overflow=10, pool_timeout=30, pool_recycle=1800, pool_pre_ping=True):
+    """
+    Engine options of a database URI. In-memory SQLite databases live in a single connection, they keep
+    the static pool Flask-SQLAlchemy gives them.
+    """
+    url = make_url(uri)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+    return {"pool_size": pool_size, "max_overflow": max_overflow, "pool_timeout": pool_timeout,
+            "pool_recycle": pool_recycle, "pool_pre_ping": pool_pre_ping}
+
+
+def reads_from_replica(function):
+    """
+    Runs the queries of a read only function on the replica bind, when one is configured
+    """
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        token = _reading_from_replica.set(True)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _reading_from_replica.reset(token)
+
+    return wrapper
+
+
+class RoutingSession(Session):
+    """
+    Sends the queries of functions decorated with reads_from_replica to the replica bind and everything else
+    to the primary. Reads stay on the primary once the session wrote, and for REPLICA_LAG_SECONDS after a request
+    of the same browser session wrote, so that users always see their own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._use_replica(clause):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _use_replica(self, clause):
+        if not _reading_from_replica.get() or REPLICA_BIND not in self._db.engines:
+            return False
+        if self._flushing or self.info.get("wrote") or getattr(clause, "is_dml", False):
+            return False
+        return not pinned_to_primary()
+
+
+def pinned_to_primary():
+    """
+    Whether the browser session of the current request wrote recently, its reads must see the primary
+    """
+    return has_request_context() and flask_session.get("db_primary_until", 0) > time.time()
+
+
+def pin_to_primary(app):
+    """
+    Sends the reads of the current browser session to the primary for DB_REPLICA_LAG_SECONDS
+    """
+    if REPLICA_BIND in app.config.get("SQLALCHEMY_BINDS", {}):
+        flask_session["db_primary_until"] = time.time() + app.config.get("DB_REPLICA_LAG_SECONDS", 5)
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _record_execute_writes(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _record_flush_writes(session, flush_context):
+    session.info["wrote"] = True
+
+
+def init_app(app, db):
+    """
+    Keeps the browser sessions of requests that wrote on the primary for DB_REPLICA_LAG_SECONDS
+    """
+
+    @app.after_request
+    def pin_writers_to_primary(response):
+        if db.session.info.get("wrote"):
+            pin_to_primary(app)
+        return response
@@ -11,3 +11,39 @@ class Errors:
         "code": 3,
         "message": "Invalid file type"
     }
+    SALE_NOT_CREATED = {
+        "code": 4,
+        "message": "The sale could not be recorded"
+    }
+    INSUFFICIENT_STOCK = {
+        "code": 5,
+        "message": "Not enough stock"
+    }
+    INVALID_PROMOTION_PRICE = {
+        "code": 6,
+        "message": "Promotion price must be less than original price"
+    }
+    INVALID_NUMBER = {
+        "code": 7,
+        "message": "Weight, quantity and prices must be numbers"
+    }
+    TOO_MANY_ITEMS = {
+        "code": 8,
+        "message": "Too many items in one request"
+    }
+    TOO_MANY_REQUESTS = {
+        "code": 9,
+        "message": "Too many requests, try again later"
+    }
+    INVALID_QUANTITY = {
+        "code": 10,
+        "message": "Quantities must be positive whole numbers"
+    }
+    DUPLICATE_SLUG = {
+        "code": 11,
+        "message": "Another row of the file has the same slug"
+    }
+    UNKNOWN_PRODUCT = {
+        "code": 12,
+        "message": "Product not found"
+    }
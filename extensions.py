@@ -0,0 +1,62 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+from flask import current_app, has_app_context
+
+
+def database_namespace(app):
+    """
+    Key prefix of an app's entries in a store shared with apps of other databases, e.g. a SQLite file
+    """
+    return hashlib.sha256(str(app.config.get("SQLALCHEMY_DATABASE_URI")).encode()).hexdigest()[:16] + ":"
+
+
+class PerAppExtension:
+    """
+    Base of the objects set up once per application from its config. init_app stores the instance of an app in
+    app.extensions under extension_name, the module level instance then serves the one of the current app and
+    instances built on their own serve themselves. Subclasses build the instance of an app in from_config.
+    """
+    extension_name = None
+    _per_app = False
+
+    def init_app(self, app):
+        app.extensions[self.extension_name] = self.from_config(app)
+        self._per_app = True
+
+    def from_config(self, app):
+        raise NotImplementedError
+
+    def for_app(self, app):
+        """
+        The instance init_app set up for app, this one when app has none
+        """
+        return app.extensions.get(self.extension_name, self)
+
+    def _current(self):
+        if self._per_app and has_app_context():
+            return self.for_app(current_app)
+        return self
+
+
+class SQLiteFileBackend:
+    """
+    Base of the backends keeping their data in a local SQLite file shared by all the worker processes of a host
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared across threads nor inherited across a fork
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
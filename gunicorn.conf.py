@@ -0,0 +1,13 @@
+"""
+gunicorn settings read from the working directory, command line options come on top of them
+"""
+import os
+
+import metrics
+
+
+def child_exit(server, worker):
+    # The counters of an exited worker are kept in the archive of the metrics folder, its own files are removed
+    folder = os.environ.get("METRICS_MULTIPROCESS_DIR")
+    if folder:
+        metrics.mark_process_dead(folder, worker.pid)
@@ -1,9 +1,16 @@
+import base64
+import binascii
+import hashlib
 import os
-import uuid
+import re
+import unicodedata
+from datetime import datetime
 
 from errors_messages import Errors
 
 ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'svg', 'webp'}
+# Leaves room in Inventory.slug for the -<n> suffix of colliding slugs
+SLUG_MAX_LENGTH = 200
 
 
 def create_folder_if_not_exists(folder_path):
@@ -25,16 +32,67 @@ def allowed_image_file(filename):
 
 
 def save_image(folder_path, file):
+    """
+    Saves an uploaded image under the sha256 of its content, so uploading the same image twice stores it once
+    """
     parent_folder = create_folder_if_not_exists(folder_path)
     if parent_folder == Errors.FOLDER_NOT_CREATED:
         return Errors.FOLDER_NOT_CREATED
 
     if not allowed_image_file(file.filename):
         return Errors.INVALID_FILE_TYPE
-    unique_filename = str(uuid.uuid4()) + os.path.splitext(file.filename)[1]
-    file.save(os.path.join(parent_folder, unique_filename))
-    return os.path.join(parent_folder, unique_filename)
+
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.stream.read(64 * 1024), b''):
+        digest.update(chunk)
+    file.stream.seek(0)
+
+    image_path = os.path.join(parent_folder, digest.hexdigest() + os.path.splitext(file.filename)[1].lower())
+    if not os.path.exists(image_path):
+        file.save(image_path)
+    return image_path
 
 
 def commify(value):
     return "{:,}".format(value)
+
+
+def slugify(text):
+    """
+    URL friendly version of text: "Café Table 2" becomes "cafe-table-2"
+    """
+    ascii_text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode()
+    slug = re.sub(r"[^a-z0-9]+", "-", ascii_text.lower()).strip("-")
+    return slug[:SLUG_MAX_LENGTH].rstrip("-") or "product"
+
+
+def encode_cursor(added_on, row_id):
+    """
+    Builds an opaque pagination cursor from the ordering key of the last row of a page
+    """
+    raw = f"{added_on.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Reverses encode_cursor, returns None for a cursor that was not produced by it
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        added_on, row_id = raw.split("|")
+        return datetime.fromisoformat(added_on), int(row_id)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        return None
+
+
+def validate_product(name, image_url, weight, quantity, original_price, promotion_price):
+    """
+    Rules every new product must pass, shared by the add product form and the bulk import.
+    Returns the error, None for a valid product.
+    """
+    if not name or not image_url or not weight or not quantity or not original_price or not promotion_price:
+        return Errors.MISSING_PARAMS
+    if promotion_price > original_price:
+        return Errors.INVALID_PROMOTION_PRICE
+    return None
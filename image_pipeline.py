@@ -0,0 +1,109 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+IMAGE_VARIANT_WIDTHS = (320, 640)
+VARIANTS_FOLDER = 'variants'
+# Vector and animated images are served as uploaded
+PROCESSABLE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(max_workers=2):
+    # Created on first use so that every forked worker process gets its own threads
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image-pipeline')
+    return _executor
+
+
+def variant_path(image_path, width, extension):
+    """
+    Path of the resized copy of image_path, e.g. static/images/variants/<name>-320.webp
+    """
+    folder, filename = os.path.split(image_path)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(folder, VARIANTS_FOLDER, f"{stem}-{width}.{extension}")
+
+
+def generate_variants(image_path, force=False):
+    """
+    Writes a resized copy of the image in its own format and in WebP for every IMAGE_VARIANT_WIDTHS.
+    Widths larger than the image are skipped. Returns the paths written.
+    """
+    from PIL import Image
+
+    extension = os.path.splitext(image_path)[1].lstrip('.').lower()
+    if extension not in PROCESSABLE_EXTENSIONS:
+        return []
+
+    os.makedirs(os.path.join(os.path.dirname(image_path), VARIANTS_FOLDER), exist_ok=True)
+    written = []
+    with Image.open(image_path) as image:
+        image.load()
+        for width in IMAGE_VARIANT_WIDTHS:
+            if width >= image.width:
+                continue
+            resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+            for variant_extension in dict.fromkeys((extension, 'webp')):
+                target = variant_path(image_path, width, variant_extension)
+                if os.path.exists(target) and not force:
+                    continue
+                variant = resized
+                if variant_extension in ('jpg', 'jpeg') and variant.mode not in ('RGB', 'L'):
+                    variant = variant.convert('RGB')
+                # Write next to the target then rename, a half written file is never served
+                temporary = f"{target}.tmp"
+                variant.save(temporary, format='JPEG' if variant_extension == 'jpg' else variant_extension.upper(),
+                             quality=80, optimize=True)
+                os.replace(temporary, target)
+                written.append(target)
+    return written
+
+
+def schedule_variants(image_path, max_workers=2, on_success=None):
+    """
+    Generates the variants of image_path on the pipeline threads, off the request path.
+    on_success: called with the written paths once the variants exist, failures are logged instead.
+    """
+
+    def done(future):
+        error = future.exception()
+        if error is not None:
+            logger.error("Image variants of %s failed", image_path, exc_info=error)
+        elif on_success is not None:
+            on_success(future.result())
+
+    future = _get_executor(max_workers).submit(generate_variants, image_path)
+    future.add_done_callback(done)
+    return future
+
+
+def image_srcset(image_url, extension=None):
+    """
+    Jinja filter building a srcset from the variants of an uploaded image that exist on disk.
+    extension: "webp" for the WebP variants, the format of the image itself when omitted.
+    Returns an empty string for external images and images without variants.
+    """
+    static_prefix = f"{current_app.static_url_path}/"
+    if not image_url or not image_url.startswith(static_prefix):
+        return ""
+    relative_path = image_url[len(static_prefix):]
+    image_path = os.path.join(current_app.static_folder, relative_path)
+    extension = extension or os.path.splitext(image_path)[1].lstrip('.').lower()
+
+    candidates = []
+    for width in IMAGE_VARIANT_WIDTHS:
+        path = variant_path(image_path, width, extension)
+        if os.path.exists(path):
+            url = f"{static_prefix}{os.path.relpath(path, current_app.static_folder)}".replace('\\', '/')
+            candidates.append(f"{url} {width}w")
+    return ", ".join(candidates)
@@ -0,0 +1,122 @@
+import logging
+import time
+
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+_engine_listeners_installed = False
+
+
+class QueryBudgetExceeded(Exception):
+    """
+    Raised when QUERY_BUDGET_ENFORCE is set and a request ran more queries than its budget
+    """
+
+
+def parameters_shape(parameters, executemany=False):
+    """
+    Describes bound parameters by type only, so that logs never contain user data
+    """
+    if executemany:
+        return f"{len(parameters)} x {parameters_shape(parameters[0])}" if parameters else "[]"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(type(value).__name__ for value in parameters) + ")"
+    return type(parameters).__name__
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    if not has_request_context() or "request_started" not in g:
+        return
+    g.db_queries += 1
+    g.db_time += elapsed
+    if elapsed * 1000 >= g.slow_query_ms:
+        logger.warning("Slow query (%.1f ms) on %s: %s %s", elapsed * 1000, request.endpoint,
+                       " ".join(statement.split()), parameters_shape(parameters, executemany))
+
+
+def _handle_error(exception_context):
+    # after_cursor_execute doesn't run for a failed statement
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_started"):
+        connection.info["query_started"].pop()
+
+
+def _before_render_template(app, template, context, **extra):
+    if has_request_context() and "request_started" in g:
+        # Templates rendered inside another render (cached fragments) are part of the outer timing
+        if g.render_depth == 0:
+            g.render_started = time.perf_counter()
+        g.render_depth += 1
+
+
+def _template_rendered(app, template, context, **extra):
+    if has_request_context() and "request_started" in g and g.render_depth:
+        g.render_depth -= 1
+        if g.render_depth == 0:
+            g.render_time += time.perf_counter() - g.render_started
+
+
+def query_budget(endpoint, config):
+    """
+    Number of queries endpoint may run, None when it has no budget.
+    QUERY_BUDGETS entries win over QUERY_BUDGET, whose default of 0 means no budget.
+    """
+    budgets = config.get("QUERY_BUDGETS", {})
+    if endpoint in budgets:
+        return budgets[endpoint]
+    return config.get("QUERY_BUDGET") or None
+
+
+def init_app(app):
+    """
+    Counts the queries and database time of every request, logs queries slower than SLOW_QUERY_MS
+    and reports db, render and total durations in a Server-Timing header.
+    QUERY_BUDGET (or QUERY_BUDGETS per endpoint) is the number of queries a request may run,
+    exceeding it is logged, and raises QueryBudgetExceeded when QUERY_BUDGET_ENFORCE is set.
+    """
+    global _engine_listeners_installed
+    if not _engine_listeners_installed:
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+        _engine_listeners_installed = True
+    before_render_template.connect(_before_render_template, app)
+    template_rendered.connect(_template_rendered, app)
+
+    @app.before_request
+    def start_request_timing():
+        g.request_started = time.perf_counter()
+        g.slow_query_ms = app.config.get("SLOW_QUERY_MS", 100)
+        g.db_queries = 0
+        g.db_time = 0.0
+        g.render_time = 0.0
+        g.render_depth = 0
+
+    @app.after_request
+    def add_server_timing(response):
+        if "request_started" not in g:
+            return response
+        total = time.perf_counter() - g.request_started
+        response.headers.add(
+            "Server-Timing",
+            f'db;dur={g.db_time * 1000:.2f};desc="{g.db_queries} queries", '
+            f"render;dur={g.render_time * 1000:.2f}, total;dur={total * 1000:.2f}"
+        )
+
+        budget = query_budget(request.endpoint, app.config)
+        if budget is not None and g.db_queries > budget:
+            message = f"{request.endpoint} ran {g.db_queries} queries, its budget is {budget}"
+            if app.config.get("QUERY_BUDGET_ENFORCE"):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
@@ -0,0 +1,91 @@
+import logging
+import os
+import random
+import socket
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from database_manager import db, db_claim_jobs, db_finish_job
+
+logger = logging.getLogger(__name__)
+
+# Registered tasks by name, see task
+TASKS = {}
+
+
+def task(name):
+    """
+    Registers a function as the background task name, it is called with the keyword arguments of the job payload.
+    Tasks may run more than once (a worker can die after the work but before recording it), so they must be
+    safe to repeat.
+    """
+
+    def register(function):
+        TASKS[name] = function
+        return function
+
+    return register
+
+
+def retry_delay(attempts, backoff):
+    """
+    Seconds to wait before the next attempt: exponential backoff with jitter, capped at an hour
+    """
+    return min(backoff * 2 ** (attempts - 1), 3600) * random.uniform(0.5, 1.0)
+
+
+def run_job(job, worker_id, backoff):
+    """
+    Runs a claimed job and records its outcome, returns True when it succeeded
+    """
+    function = TASKS.get(job.name)
+    error = None
+    if function is None:
+        error = f"Unknown task {job.name}"
+    elif job.attempts > job.max_attempts:
+        # Claimed again after its worker died during the last attempt
+        error = "Out of attempts"
+    else:
+        try:
+            function(**job.payload)
+        except Exception:
+            db.session.rollback()
+            error = traceback.format_exc()
+            logger.warning("Job %s (%s) failed on attempt %s", job.id, job.name, job.attempts, exc_info=True)
+
+    retry_at = None
+    if error is not None and function is not None and job.attempts < job.max_attempts:
+        retry_at = datetime.utcnow() + timedelta(seconds=retry_delay(job.attempts, backoff))
+    if not db_finish_job(job.id, worker_id, error=error, retry_at=retry_at):
+        logger.warning("Job %s (%s) outlived its visibility timeout and was claimed by another worker",
+                       job.id, job.name)
+    return error is None
+
+
+def run_worker(app, worker_id=None, once=False, batch_size=None, poll_interval=None, visibility_timeout=None,
+               backoff=None):
+    """
+    Claims and runs due jobs until interrupted.
+    once: stop as soon as no job is due, used by tests and cron style deployments
+    Defaults come from JOB_BATCH_SIZE, JOB_POLL_SECONDS, JOB_VISIBILITY_TIMEOUT and JOB_RETRY_BACKOFF.
+    Returns the number of jobs run.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    batch_size = batch_size or app.config.get("JOB_BATCH_SIZE", 10)
+    poll_interval = poll_interval if poll_interval is not None else app.config.get("JOB_POLL_SECONDS", 1.0)
+    visibility_timeout = visibility_timeout or app.config.get("JOB_VISIBILITY_TIMEOUT", 300)
+    backoff = backoff if backoff is not None else app.config.get("JOB_RETRY_BACKOFF", 10)
+
+    processed = 0
+    while True:
+        with app.app_context():
+            claimed = db_claim_jobs(worker_id, batch_size, visibility_timeout)
+            for job in claimed:
+                run_job(job, worker_id, backoff)
+                processed += 1
+            db.session.remove()
+        if not claimed:
+            if once:
+                return processed
+            time.sleep(poll_interval)
@@ -0,0 +1,347 @@
+import atexit
+import bisect
+import glob
+import hmac
+import json
+import os
+import threading
+import time
+import uuid
+
+from flask import Response, abort, g, request
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# File of a multiprocess folder holding the counters and histograms of the workers that exited
+ARCHIVE_FILE = "metrics_archive.json"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, function=None):
+        """
+        function: called when the metric is collected, returns its value (metrics without labels only)
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """
+        Returns {label values: value} for counters and gauges, {label values: [bucket counts..., sum]} for histograms
+        """
+        if self.function is not None:
+            return {(): self.function()}
+        with self._lock:
+            return {key: list(value) if isinstance(value, list) else value for key, value in self._values.items()}
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    In multiprocess mode the gauges of every live process are summed, those of exited processes are dropped
+    """
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One slot per bucket followed by the sum of the observations
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def snapshot(self):
+        """
+        Current values of every metric as plain data, used by the multiprocess files
+        """
+        return {
+            name: {
+                "kind": metric.kind,
+                "documentation": metric.documentation,
+                "labelnames": metric.labelnames,
+                "buckets": getattr(metric, "buckets", None),
+                "samples": [[list(key), value] for key, value in metric.samples().items()],
+            }
+            for name, metric in self.metrics.items()
+        }
+
+
+def merge_snapshots(snapshots):
+    """
+    Sums snapshots of several processes. snapshots is a list of (snapshot, process is alive) pairs.
+    """
+    merged = {}
+    for snapshot, alive in snapshots:
+        for name, metric in snapshot.items():
+            if metric["kind"] == "gauge" and not alive:
+                continue
+            target = merged.setdefault(name, dict(metric, samples={}))
+            for key, value in metric["samples"]:
+                key = tuple(key)
+                if isinstance(value, list):
+                    current = target["samples"].get(key)
+                    target["samples"][key] = [a + b for a, b in zip(current, value)] if current else list(value)
+                else:
+                    target["samples"][key] = target["samples"].get(key, 0) + value
+    return merged
+
+
+def exposition(merged):
+    """
+    Renders merged snapshots in the Prometheus text exposition format
+    """
+    lines = []
+    for name, metric in sorted(merged.items()):
+        lines.append(f"# HELP {name} {metric['documentation']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        labelnames = metric["labelnames"]
+        for key, value in sorted(metric["samples"].items()):
+            if metric["kind"] == "histogram":
+                cumulative = 0
+                for bucket, count in zip(metric["buckets"], value[:-1]):
+                    cumulative += count
+                    labels = _format_labels(labelnames, key, [("le", _format_value(bucket))])
+                    lines.append(f"{name}_bucket{labels} {_format_value(cumulative)}")
+                lines.append(f"{name}_sum{_format_labels(labelnames, key)} {_format_value(value[-1])}")
+                lines.append(f"{name}_count{_format_labels(labelnames, key)} {_format_value(cumulative)}")
+            else:
+                lines.append(f"{name}{_format_labels(labelnames, key)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _write_json(path, content):
+    with open(f"{path}.tmp", "w") as output:
+        json.dump(content, output)
+    os.replace(f"{path}.tmp", path)
+
+
+def mark_process_dead(folder, pid):
+    """
+    Folds the files of an exited worker into the archive of a multiprocess folder: its counters and histograms
+    keep counting, its gauges are dropped, and its files are removed so the folder doesn't grow as workers come
+    and go. Call it from the process manager once the worker exited, e.g. in the gunicorn config:
+
+        def child_exit(server, worker):
+            metrics.mark_process_dead(os.environ["METRICS_MULTIPROCESS_DIR"], worker.pid)
+    """
+    paths = glob.glob(os.path.join(folder, f"metrics_{pid}_*.json"))
+    if not paths:
+        return
+    archive_path = os.path.join(folder, ARCHIVE_FILE)
+    snapshots = []
+    for path in [archive_path] + paths:
+        try:
+            with open(path) as source:
+                snapshots.append((json.load(source)["metrics"], False))
+        except (OSError, ValueError):
+            continue
+    merged = merge_snapshots(snapshots)
+    _write_json(archive_path, {
+        "pid": None,
+        "metrics": {name: dict(metric, samples=[[list(key), value] for key, value in metric["samples"].items()])
+                    for name, metric in merged.items()},
+    })
+    for path in paths:
+        os.remove(path)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MultiProcessStore:
+    """
+    Lets every worker process write its snapshot to its own file in a shared folder,
+    /metrics then sums the files of all the workers. Files are rewritten at most every flush_interval seconds.
+    """
+
+    def __init__(self, folder, registry, flush_interval=1.0):
+        self.folder = folder
+        self.registry = registry
+        self.flush_interval = flush_interval
+        self._path = None
+        self._pid = None
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        atexit.register(self._flush_at_exit)
+
+    def _own_path(self):
+        # A fresh name per process, a reused pid never overwrites the counters of an exited worker
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._path = os.path.join(self.folder, f"metrics_{self._pid}_{uuid.uuid4().hex}.json")
+        return self._path
+
+    def flush(self, force=True):
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.flush_interval:
+            return
+        with self._lock:
+            self._last_flush = now
+            _write_json(self._own_path(), {"pid": self._pid, "metrics": self.registry.snapshot()})
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except OSError:
+            pass
+
+    def collect(self):
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.folder, "metrics_*.json")):
+            try:
+                with open(path) as source:
+                    content = json.load(source)
+            except (OSError, ValueError):
+                continue
+            # The archive has no pid, it only holds counters and histograms
+            snapshots.append((content["metrics"], content["pid"] is None or _process_alive(content["pid"])))
+        return merge_snapshots(snapshots)
+
+
+REGISTRY = Registry()
+
+REQUESTS = Counter("http_requests_total", "Requests served", ("endpoint", "method", "status"))
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "Time spent serving a request", ("endpoint",))
+IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being served")
+CHECKOUTS = Counter("checkouts_total", "Checkouts by outcome", ("outcome",))
+
+
+def init_app(app, db=None, catalog_cache=None):
+    """
+    Records request counts, latencies and in-flight requests and serves them on /metrics.
+    METRICS_TOKEN: bearer token the scraper sends in its Authorization header, /metrics answers 404 without one
+    METRICS_MULTIPROCESS_DIR: folder shared by the workers of a host, each worker writes its values there,
+    see mark_process_dead
+    METRICS_FLUSH_SECONDS: how often a worker rewrites its file
+    """
+    if catalog_cache is not None:
+        Counter("catalog_cache_hits_total", "Catalog cache lookups served from the cache",
+                function=lambda: catalog_cache.for_app(app).hits)
+        Counter("catalog_cache_misses_total", "Catalog cache lookups that queried the database",
+                function=lambda: catalog_cache.for_app(app).misses)
+    if db is not None:
+        db_pool = Gauge("db_pool_checked_out", "Database connections checked out of the pool")
+        db_pool_size = Gauge("db_pool_size", "Database connections kept by the pool")
+
+    store = None
+    if app.config.get("METRICS_MULTIPROCESS_DIR"):
+        store = MultiProcessStore(app.config["METRICS_MULTIPROCESS_DIR"], REGISTRY,
+                                  app.config.get("METRICS_FLUSH_SECONDS", 1.0))
+
+    def update_pool_gauges():
+        if db is None:
+            return
+        pool = db.engine.pool
+        db_pool.set(pool.checkedout() if hasattr(pool, "checkedout") else 0)
+        db_pool_size.set(pool.size() if hasattr(pool, "size") else 0)
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        IN_FLIGHT.inc()
+
+    @app.after_request
+    def record_response_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request_metrics(exception):
+        if "metrics_started" not in g:
+            return
+        # Unmatched URLs share one label so that random paths can't blow up the number of series
+        endpoint = request.endpoint or "unmatched"
+        REQUEST_LATENCY.observe(time.perf_counter() - g.metrics_started, endpoint=endpoint)
+        REQUESTS.inc(endpoint=endpoint, method=request.method, status=g.get("metrics_status", 500))
+        IN_FLIGHT.dec()
+        g.pop("metrics_started")
+        if store is not None:
+            update_pool_gauges()
+            store.flush(force=False)
+
+    def metrics_view():
+        token = app.config.get("METRICS_TOKEN")
+        if not token:
+            abort(404)
+        if not hmac.compare_digest(request.headers.get("Authorization", "").encode(), f"Bearer {token}".encode()):
+            abort(401)
+        update_pool_gauges()
+        if store is not None:
+            merged = store.collect()
+        else:
+            merged = merge_snapshots([(REGISTRY.snapshot(), True)])
+        return Response(exposition(merged), mimetype="text/plain; version=0.0.4")
+
+    app.add_url_rule("/metrics", "metrics", metrics_view)
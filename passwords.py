@@ -0,0 +1,85 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from extensions import PerAppExtension
+
+DEFAULT_HASH_METHOD = "scrypt:32768:8:1"
+
+
+class PasswordHasher(PerAppExtension):
+    """
+    Hashes and checks passwords on a bounded process pool so that the CPU heavy key derivation
+    doesn't hold the GIL of the web worker serving other requests.
+    init_app sets up a hasher per application from its config, the module level password_hasher serves the one
+    of the current app:
+    PASSWORD_HASH_METHOD: werkzeug method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000"
+    PASSWORD_HASH_WORKERS: size of the process pool, 0 hashes in the calling thread
+    PASSWORD_HASH_TIMEOUT: seconds to wait for a hash before giving up
+    """
+    extension_name = "password_hasher"
+
+    def __init__(self, method=DEFAULT_HASH_METHOD, workers=0, timeout=30):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._slots = None
+        self._method_prefix = None
+
+    def from_config(self, app):
+        return PasswordHasher(app.config.get("PASSWORD_HASH_METHOD", DEFAULT_HASH_METHOD),
+                              app.config.get("PASSWORD_HASH_WORKERS", 0), app.config.get("PASSWORD_HASH_TIMEOUT", 30))
+
+    def _get_executor(self):
+        # The pool is created on first use in every process, a pool inherited through a fork is unusable
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+                self._executor_pid = os.getpid()
+                # Bounds the number of hashes waiting for the pool, callers past it wait for a slot
+                self._slots = threading.BoundedSemaphore(self.workers * 4)
+        return self._executor
+
+    def _run(self, function, *args):
+        if not self.workers:
+            return function(*args)
+        executor = self._get_executor()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError("Password hashing pool is saturated")
+        try:
+            return executor.submit(function, *args).result(timeout=self.timeout)
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        hasher = self._current()
+        return hasher._run(generate_password_hash, password, hasher.method)
+
+    def verify(self, password_hash, password):
+        return self._current()._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """
+        True when password_hash was produced with other parameters than the configured method
+        """
+        hasher = self._current()
+        if hasher._method_prefix is None or hasher._method_prefix[0] != hasher.method:
+            # werkzeug fills in default parameters, e.g. "pbkdf2" is stored as "pbkdf2:sha256:600000"
+            hasher._method_prefix = (hasher.method, generate_password_hash("", hasher.method).split("$", 1)[0])
+        return password_hash.split("$", 1)[0] != hasher._method_prefix[1]
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._executor_pid == os.getpid():
+                self._executor.shutdown()
+            self._executor = None
+
+
+password_hasher = PasswordHasher()
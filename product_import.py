@@ -0,0 +1,118 @@
+import csv
+import json
+import os
+import time
+
+from errors_messages import Errors
+from helpers import slugify, validate_product
+
+
+def read_rows(source, file_format=None):
+    """
+    Yields the rows of a CSV file with a header line or of a JSON lines file, one at a time.
+    file_format: "csv" or "jsonl", guessed from the extension when missing
+    """
+    if file_format is None:
+        file_format = "jsonl" if os.path.splitext(source.name)[1].lower() in (".jsonl", ".ndjson") else "csv"
+    if file_format == "csv":
+        yield from csv.DictReader(source)
+        return
+    for line in source:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = {"line": line.rstrip("\n")}
+        yield row if isinstance(row, dict) else {"line": line.rstrip("\n")}
+
+
+def _number(value, kind):
+    if value is None or value == "":
+        return None
+    return kind(value)
+
+
+def parse_product(row):
+    """
+    Converts an input row to Inventory columns with the rules of the add product form.
+    Returns (product, None) or (None, error).
+    """
+    try:
+        quantity = _number(row.get("quantity"), int)
+        product = {
+            "name": (row.get("name") or "").strip(),
+            "image_url": (row.get("image_url") or "").strip(),
+            "description": row.get("description") or "",
+            "weight": _number(row.get("weight"), float),
+            # Same default as the form
+            "quantity": 1 if quantity is None else quantity,
+            "original_price": _number(row.get("original_price", row.get("price")), float),
+            "promotion_price": _number(row.get("promotion_price", row.get("promotional_price")), float),
+        }
+    except (TypeError, ValueError):
+        return None, Errors.INVALID_NUMBER
+    error = validate_product(product["name"], product["image_url"], product["weight"], product["quantity"],
+                             product["original_price"], product["promotion_price"])
+    if error is not None:
+        return None, error
+    product["slug"] = slugify((row.get("slug") or "").strip() or product["name"])
+    return product, None
+
+
+class ImportReport:
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.updated = 0
+        self.rejected = 0
+        self.started = time.perf_counter()
+
+    def rows_per_second(self):
+        return self.read / max(time.perf_counter() - self.started, 1e-9)
+
+    def __str__(self):
+        return (f"{self.read} rows read, {self.inserted} inserted, {self.updated} updated, "
+                f"{self.rejected} rejected ({self.rows_per_second():.0f} rows/s)")
+
+
+def import_products(rows, upsert, batch_size=1000, rejects=None, progress=None):
+    """
+    Validates rows and hands them to upsert in batches of batch_size, every batch is its own transaction.
+    upsert: called with a list of products, returns (inserted, updated), e.g. db_upsert_products
+    rejects: file the invalid rows are written to as JSON lines, with the reason of the rejection.
+    Rows repeating the slug of an earlier row are rejected too, the first one is imported.
+    progress: called with the report after every batch
+    """
+    report = ImportReport()
+    batch = []
+    slugs = set()
+
+    def reject(line_number, error, row):
+        report.rejected += 1
+        if rejects is not None:
+            rejects.write(json.dumps({"row": line_number, "error": error["message"], "data": row}) + "\n")
+
+    def flush():
+        inserted, updated = upsert(batch)
+        report.inserted += inserted
+        report.updated += updated
+        batch.clear()
+        if progress is not None:
+            progress(report)
+
+    for line_number, row in enumerate(rows, start=1):
+        report.read += 1
+        product, error = parse_product(row)
+        if error is None and product["slug"] in slugs:
+            error = Errors.DUPLICATE_SLUG
+        if error is not None:
+            reject(line_number, error, row)
+            continue
+        slugs.add(product["slug"])
+        batch.append(product)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return report
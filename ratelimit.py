@@ -0,0 +1,247 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from inspect import iscoroutinefunction
+
+from flask import jsonify, request
+from flask_login import current_user
+from werkzeug.exceptions import TooManyRequests
+
+from errors_messages import Errors
+from extensions import PerAppExtension, SQLiteFileBackend, database_namespace
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600}
+
+# Limits of the rate limited endpoints by bucket: "ip" counts the requests of a client address, "user" those of
+# a user, other buckets the keys given to limit(). "5/minute" lets a client send 5 requests at once, then one more
+# every 12 seconds. The buckets are taken in order, a request refused by one doesn't count in the next ones.
+DEFAULT_LIMITS = {
+    # Every login checks a password hash. "user" is a phone number tried from one address, "phone" caps the guesses
+    # against a phone number spread over many addresses, loosely so guesses from elsewhere rarely lock its owner out.
+    "login": {"ip": "20/minute", "user": "5/minute", "phone": "30/hour"},
+    "register": {"ip": "5/minute"},
+    "cart": {"ip": "120/minute", "user": "60/minute"},
+    "checkout": {"ip": "20/minute", "user": "10/minute"},
+}
+# Takes between two prunings of the buckets of SQLiteRateLimitBackend
+PRUNE_EVERY = 1000
+
+
+def parse_limit(limit):
+    """
+    "5/minute" -> (capacity 5, refill rate 5 / 60 tokens per second)
+    """
+    count, period = limit.split("/")
+    return int(count), int(count) / PERIODS[period]
+
+
+class MemoryRateLimitBackend:
+    """
+    Keeps the token buckets in the memory of the current process, so every worker process counts on its own.
+    The least recently used bucket is dropped once max_entries is reached, it is full again on its next use.
+    """
+
+    def __init__(self, max_entries=100_000, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, refill_rate):
+        """
+        Takes a token from the bucket of key, returns 0 when there was one, else the seconds until there is one
+        """
+        return self.take_all(((key, capacity, refill_rate),))
+
+    def take_all(self, limits):
+        """
+        Takes a token from the bucket of every (key, capacity, refill rate) of limits in turn, under one lock,
+        stopping at the first empty one. Returns 0 when none was empty, else the seconds until that one has a token.
+        """
+        now = self.clock()
+        buckets = self._buckets
+        with self._lock:
+            for key, capacity, refill_rate in limits:
+                bucket = buckets.get(key)
+                if bucket is None:
+                    if len(buckets) >= self.max_entries:
+                        buckets.popitem(last=False)
+                    # A new bucket is full, capacities are at least 1
+                    buckets[key] = [capacity - 1, now]
+                    continue
+                buckets.move_to_end(key)
+                # [tokens, time of the last take], updated in place
+                tokens = bucket[0] + (now - bucket[1]) * refill_rate
+                if tokens > capacity:
+                    tokens = capacity
+                bucket[1] = now
+                if tokens < 1:
+                    bucket[0] = tokens
+                    return (1 - tokens) / refill_rate
+                bucket[0] = tokens - 1
+        return 0
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SQLiteRateLimitBackend(SQLiteFileBackend):
+    """
+    Keeps the token buckets in a local SQLite file shared by all the worker processes of a host,
+    so a client is limited the same whichever worker serves it.
+    """
+
+    def __init__(self, path, clock=time.time):
+        super().__init__(path)
+        self.clock = clock
+        self._takes = 0
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit_buckets (key TEXT PRIMARY KEY, tokens REAL, updated_at REAL)"
+        )
+
+    def take(self, key, capacity, refill_rate):
+        """
+        See MemoryRateLimitBackend.take
+        """
+        return self.take_all(((key, capacity, refill_rate),))
+
+    def take_all(self, limits):
+        """
+        See MemoryRateLimitBackend.take_all, the buckets are read and written in one write transaction
+        """
+        connection = self._connection()
+        now = self.clock()
+        retry_after = 0
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            for key, capacity, refill_rate in limits:
+                row = connection.execute("SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = ?",
+                                         (key,)).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + max(now - row[1], 0) * refill_rate)
+                connection.execute("INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated_at) "
+                                   "VALUES (?, ?, ?)", (key, tokens - 1 if tokens >= 1 else tokens, now))
+                if tokens < 1:
+                    retry_after = (1 - tokens) / refill_rate
+                    break
+        self._takes += 1
+        if self._takes % PRUNE_EVERY == 0:
+            # Buckets untouched for the longest period are full, forgetting them changes nothing
+            connection.execute("DELETE FROM rate_limit_buckets WHERE updated_at < ?", (now - max(PERIODS.values()),))
+        return retry_after
+
+    def clear(self):
+        self._connection().execute("DELETE FROM rate_limit_buckets")
+
+
+def signed_in_user():
+    return current_user.get_id() if current_user.is_authenticated else None
+
+
+def too_many_requests(error):
+    if not request.is_json:
+        return error
+    response = jsonify(
+        {
+            "success": False,
+            "message": Errors.TOO_MANY_REQUESTS["message"]
+        }
+    )
+    response.status_code = error.code
+    response.retry_after = error.retry_after
+    return response
+
+
+class RateLimiter(PerAppExtension):
+    """
+    Token bucket limits of the endpoints decorated with limit().
+    init_app sets up a limiter per application from its config, the module level rate_limiter applies the one
+    of the current app:
+    RATE_LIMIT_BACKEND: "memory" (default), "sqlite" to share the buckets between the workers of a host or "none"
+    RATE_LIMIT_PATH: file used by the sqlite backend
+    RATE_LIMITS: limits replacing those of DEFAULT_LIMITS, e.g. {"login": {"ip": "10/minute"}}
+    """
+    extension_name = "rate_limiter"
+
+    def __init__(self, backend=None, limits=None, namespace=""):
+        self.backend = backend or MemoryRateLimitBackend()
+        # Prefix of the bucket keys, user ids of apps on other databases sharing a sqlite file don't collide
+        self.namespace = namespace
+        self.limits = self._parse(limits or {}, namespace)
+
+    def init_app(self, app):
+        super().init_app(app)
+        app.register_error_handler(TooManyRequests, too_many_requests)
+
+    def from_config(self, app):
+        backend = app.config.get("RATE_LIMIT_BACKEND", "memory")
+        limiter = RateLimiter(limits=app.config.get("RATE_LIMITS", {}), namespace=database_namespace(app))
+        if backend == "sqlite":
+            limiter.backend = SQLiteRateLimitBackend(app.config.get("RATE_LIMIT_PATH", "rate_limits.sqlite"))
+        elif backend == "none":
+            limiter.backend = None
+        return limiter
+
+    @staticmethod
+    def _parse(overrides, namespace):
+        limits = {name: dict(buckets) for name, buckets in DEFAULT_LIMITS.items()}
+        for name, buckets in overrides.items():
+            limits.setdefault(name, {}).update(buckets)
+        # (bucket, key prefix, capacity, refill rate) by limit name, built once so a check only joins strings
+        return {name: tuple((bucket, f"{namespace}{name}:{bucket}:", *parse_limit(limit))
+                            for bucket, limit in buckets.items())
+                for name, buckets in limits.items()}
+
+    def check(self, name, ip=None, user=None, **keys):
+        """
+        Takes a token from every bucket of the limits of name, stopping at the first empty one.
+        keys: the keys of the buckets other than "ip" and "user"
+        Returns 0 when the request may go on, else the seconds the client has to wait.
+        """
+        if self.backend is None:
+            return 0
+        limits = []
+        for bucket, prefix, capacity, refill_rate in self.limits.get(name, ()):
+            client = ip if bucket == "ip" else user if bucket == "user" else keys.get(bucket)
+            if client is not None:
+                limits.append((f"{prefix}{client}", capacity, refill_rate))
+        return self.backend.take_all(limits)
+
+    def limit(self, name, user=signed_in_user, methods=None, **keys):
+        """
+        Decorator answering 429 Too Many Requests with a Retry-After header once a client exceeds the limits of name.
+        user: returns the key of the "user" bucket of the request, the signed in user by default
+        methods: the limited request methods, all of them by default
+        keys: functions returning the key of the other buckets of the request by bucket name
+        """
+
+        def exceeded():
+            if methods is not None and request.method not in methods:
+                return
+            retry_after = self._current().check(name, request.remote_addr, user(),
+                                                **{bucket: key() for bucket, key in keys.items()})
+            if retry_after:
+                raise TooManyRequests(retry_after=math.ceil(retry_after))
+
+        def decorator(view):
+            if iscoroutinefunction(view):
+                @wraps(view)
+                async def async_wrapper(*args, **kwargs):
+                    exceeded()
+                    return await view(*args, **kwargs)
+
+                return async_wrapper
+
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                exceeded()
+                return view(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,97 @@
+import csv
+import io
+from datetime import date
+from functools import wraps
+
+from flask import Blueprint, Response, abort, jsonify, request, stream_with_context
+from flask_login import current_user, login_required
+
+from database_manager import *
+
+reports = Blueprint('reports', __name__)
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_COLUMNS = ("sale_id", "sold_at", "customer_id", "payment_mode", "status", "product_id", "product",
+                  "quantity", "sale_price", "discount")
+
+
+def admin_required(view):
+    @wraps(view)
+    @login_required
+    def wrapper(*args, **kwargs):
+        if current_user.role != Roles.ADMIN:
+            abort(403)
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def report_period():
+    """
+    Reads the ?start=YYYY-MM-DD&end=YYYY-MM-DD period of a report, both ends are optional and included
+    """
+    try:
+        return [date.fromisoformat(request.args[name]) if request.args.get(name) else None
+                for name in ("start", "end")]
+    except ValueError:
+        abort(400, "start and end must be dates formatted as YYYY-MM-DD")
+
+
+@reports.route('/daily')
+@admin_required
+def daily():
+    start, end = report_period()
+    return jsonify([
+        {"day": row.day.isoformat(), "orders": row.orders, "units": row.units, "revenue": row.revenue,
+         "discount": row.discount}
+        for row in db_get_daily_sales(start, end)
+    ])
+
+
+@reports.route('/products')
+@admin_required
+def products():
+    start, end = report_period()
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    return jsonify([
+        {"product_id": row.id, "name": row.name, "units": row.units, "revenue": row.revenue,
+         "discount": row.discount}
+        for row in db_get_product_sales(start, end, limit)
+    ])
+
+
+@reports.route('/payment-modes')
+@admin_required
+def payment_modes():
+    start, end = report_period()
+    return jsonify([
+        {"payment_mode": row.payment_mode.value, "orders": row.orders, "revenue": row.revenue}
+        for row in db_get_payment_mode_sales(start, end)
+    ])
+
+
+@reports.route('/sales.csv')
+@admin_required
+def sales_export():
+    """
+    Every sold item of the period as CSV, written while the rows are read from the database
+    """
+    start, end = report_period()
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for index, row in enumerate(db_iter_sales(start, end, EXPORT_BATCH_SIZE), start=1):
+            writer.writerow((row.id, row.added_on.isoformat(), row.bought_by, row.payment_mode.value,
+                             row.status.value if row.status else "", row.inventory_id, row.name, row.quantity,
+                             row.sale_price, row.discount))
+            if index % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    filename = f"sales_{start or 'start'}_{end or 'end'}.csv"
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
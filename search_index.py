@@ -0,0 +1,89 @@
+import re
+
+from sqlalchemy import DDL, Float, Integer, event, func, literal_column, text
+
+from database_models import Inventory, db
+
+# Matches on the name rank above matches on the description
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+# SQLite: an external content FTS5 table over inventory, kept in sync by triggers.
+# The update trigger only fires for the indexed columns, stock updates of checkouts don't touch the index.
+SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS inventory_fts USING fts5("
+    "name, description, content='inventory', content_rowid='id', tokenize='unicode61 remove_diacritics 2', "
+    "prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS inventory_fts_insert AFTER INSERT ON inventory BEGIN "
+    "INSERT INTO inventory_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS inventory_fts_delete AFTER DELETE ON inventory BEGIN "
+    "INSERT INTO inventory_fts(inventory_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS inventory_fts_update AFTER UPDATE OF name, description ON inventory BEGIN "
+    "INSERT INTO inventory_fts(inventory_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO inventory_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+)
+
+# PostgreSQL: a generated tsvector column, maintained by the database on every insert and update, with a GIN index
+POSTGRESQL_DDL = (
+    "ALTER TABLE inventory ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'B')) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_inventory_search_vector ON inventory USING GIN (search_vector)",
+)
+
+for statement in SQLITE_DDL:
+    event.listen(Inventory.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+event.listen(Inventory.__table__, "before_drop",
+             DDL("DROP TABLE IF EXISTS inventory_fts").execute_if(dialect="sqlite"))
+for statement in POSTGRESQL_DDL:
+    event.listen(Inventory.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+
+
+def search_terms(query):
+    """
+    Splits a user query into words, anything else is dropped so that it can't change the meaning of the match
+    """
+    return re.findall(r"\w+", query.lower())[:16]
+
+
+def ensure_search_index():
+    """
+    Creates the index of a database whose inventory table predates search and fills it with the current products
+    """
+    dialect = db.engine.dialect.name
+    if dialect == "sqlite":
+        for statement in SQLITE_DDL:
+            db.session.execute(text(statement))
+        db.session.execute(text("INSERT INTO inventory_fts(inventory_fts) VALUES ('rebuild')"))
+    elif dialect == "postgresql":
+        for statement in POSTGRESQL_DDL:
+            db.session.execute(text(statement))
+    db.session.commit()
+
+
+def search_ranking(query, limit, offset):
+    """
+    Returns a subquery of (id, rank) of the products matching query, best first, for the current database.
+    Every word must match, the last one as a prefix so that results show up while the user is typing.
+    """
+    terms = search_terms(query)
+    dialect = db.engine.dialect.name
+    if dialect == "sqlite":
+        expression = " ".join(f'"{term}"' for term in terms) + "*"
+        return text(
+            f"SELECT rowid AS id, bm25(inventory_fts, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT}) AS rank "
+            "FROM inventory_fts WHERE inventory_fts MATCH :expression ORDER BY rank, rowid "
+            "LIMIT :limit OFFSET :offset"
+        ).bindparams(expression=expression, limit=limit, offset=offset).columns(id=Integer, rank=Float) \
+            .subquery("search_hits")
+    if dialect == "postgresql":
+        expression = " & ".join(terms) + ":*"
+        vector = literal_column("inventory.search_vector")
+        ts_query = func.to_tsquery("simple", expression)
+        # ts_rank grows with relevance, negate it so both dialects sort ascending
+        rank = (-func.ts_rank(vector, ts_query)).label("rank")
+        return db.select(Inventory.id, rank).where(vector.op("@@")(ts_query)) \
+            .order_by(rank, Inventory.id).limit(limit).offset(offset).subquery("search_hits")
+    raise NotImplementedError(f"Full text search is not available on {dialect}")
@@ -0,0 +1,138 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+from flask import current_app, request, send_from_directory, url_for
+
+BUILD_FOLDER = 'dist'
+MANIFEST_NAME = 'manifest.json'
+IMAGES_FOLDER = 'images'
+# Uploaded images change at runtime and their URLs are stored with the products, they are not built
+SKIPPED_FOLDERS = {BUILD_FOLDER, IMAGES_FOLDER}
+# Uploads saved under the sha256 of their content (see helpers.save_image) never change, unlike their variants
+CONTENT_ADDRESSED_IMAGE = re.compile(rf"{IMAGES_FOLDER}/[0-9a-f]{{64}}\.\w+")
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.json', '.svg', '.txt', '.html', '.webmanifest', '.ico', '.xml'}
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Preferred order when the browser accepts several encodings
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _write_file(path, content):
+    # Written next to the target then renamed, a worker never serves a half written file
+    with open(f"{path}.tmp", 'wb') as output:
+        output.write(content)
+    os.replace(f"{path}.tmp", path)
+
+
+def _prune(build_folder, static_folder, kept):
+    """
+    Removes the built files, and their compressed siblings, whose path is not in kept
+    """
+    for folder, _, filenames in os.walk(build_folder):
+        for filename in filenames:
+            path = os.path.join(folder, filename)
+            name = os.path.relpath(path, static_folder).replace('\\', '/')
+            for _, suffix in ENCODINGS:
+                if name.endswith(suffix):
+                    name = name[:-len(suffix)]
+            if name != f"{BUILD_FOLDER}/{MANIFEST_NAME}" and name not in kept:
+                os.remove(path)
+
+
+def build_static(static_folder):
+    """
+    Copies every static file to static/dist under a name containing the hash of its content,
+    writes .gz and .br siblings for text assets and a manifest mapping the original names to the hashed ones.
+    The files of the previous build are kept, pages rendered by workers still running it keep loading their assets
+    during a deploy, older ones are removed. Returns the manifest.
+    """
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    build_folder = os.path.join(static_folder, BUILD_FOLDER)
+    previous = load_manifest(static_folder)
+
+    manifest = {}
+    for folder, subfolders, filenames in os.walk(static_folder):
+        relative_folder = os.path.relpath(folder, static_folder)
+        if relative_folder == '.':
+            subfolders[:] = [subfolder for subfolder in subfolders if subfolder not in SKIPPED_FOLDERS]
+        for filename in sorted(filenames):
+            with open(os.path.join(folder, filename), 'rb') as source:
+                content = source.read()
+            stem, extension = os.path.splitext(filename)
+            hashed_name = f"{stem}.{hashlib.sha256(content).hexdigest()[:12]}{extension}"
+            target = os.path.normpath(os.path.join(build_folder, relative_folder, hashed_name))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            _write_file(target, content)
+
+            if extension.lower() in COMPRESSIBLE_EXTENSIONS:
+                compressed = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+                if brotli is not None:
+                    compressed['.br'] = brotli.compress(content, quality=11)
+                for suffix, data in compressed.items():
+                    # Not worth a second round trip through the negotiation for a few bytes
+                    if len(data) < len(content) * 0.9:
+                        _write_file(target + suffix, data)
+
+            original = os.path.normpath(os.path.join(relative_folder, filename)).replace('\\', '/')
+            manifest[original] = os.path.relpath(target, static_folder).replace('\\', '/')
+
+    os.makedirs(build_folder, exist_ok=True)
+    _write_file(os.path.join(build_folder, MANIFEST_NAME),
+                json.dumps(manifest, indent=2, sort_keys=True).encode())
+    _prune(build_folder, static_folder, set(manifest.values()) | set(previous.values()))
+    return manifest
+
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, BUILD_FOLDER, MANIFEST_NAME)) as manifest:
+            return json.load(manifest)
+    except (OSError, ValueError):
+        return {}
+
+
+def static_url(filename, **values):
+    """
+    Replacement of url_for('static', ...) pointing to the fingerprinted copy of filename when one was built
+    """
+    manifest = current_app.extensions.get('static_manifest', {})
+    return url_for('static', filename=manifest.get(filename, filename), **values)
+
+
+def send_static_file(filename):
+    """
+    Serves fingerprinted files with an immutable Cache-Control and the best precompressed sibling the browser accepts.
+    Uploaded images named after their content are immutable too, any other static file is served by Flask as usual.
+    """
+    if not filename.startswith(f"{BUILD_FOLDER}/"):
+        response = current_app.send_static_file(filename)
+        if CONTENT_ADDRESSED_IMAGE.fullmatch(filename):
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+    static_folder = current_app.static_folder
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    for encoding, suffix in ENCODINGS:
+        # "in" would accept encodings the browser refuses with q=0
+        if request.accept_encodings[encoding] > 0 and os.path.isfile(os.path.join(static_folder, filename + suffix)):
+            response = send_from_directory(static_folder, filename + suffix, mimetype=mimetype, max_age=31536000)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(static_folder, filename, max_age=31536000)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_app(app):
+    app.extensions['static_manifest'] = load_manifest(app.static_folder)
+    app.view_functions['static'] = send_static_file
+    app.jinja_env.globals['static_url'] = static_url
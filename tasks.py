@@ -0,0 +1,25 @@
+import logging
+
+from database_manager import *
+from jobs import task
+
+logger = logging.getLogger(__name__)
+
+ORDER_CONFIRMATION = "send_order_confirmation"
+
+
+def send_sms(phone, message):
+    """
+    Delivers a text message. The shop has no SMS gateway yet, messages are logged until one is configured.
+    """
+    logger.info("SMS to %s: %s", phone, message)
+
+
+@task(ORDER_CONFIRMATION)
+def send_order_confirmation(sale_id):
+    sale = db.session.get(Sale, sale_id)
+    if sale is None:
+        return
+    item_count = sum(line.quantity for line in sale.products)
+    send_sms(sale.customer.phone, f"Hi {sale.customer.firstname}, order #{sale.id} of {item_count} items "
+                                  f"for Ksh. {sale.total:,.0f} is confirmed. Thank you for shopping with us!")
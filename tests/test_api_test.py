@@ -0,0 +1,79 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import gzip
+import json
+
+import brotli
+import pytest
+
+from app import create_app
+from database_manager import *
+
+app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://", "SECRET_KEY": "test",
+                  "PRODUCTS_PAGE_SIZE": 24})
+
+
+@pytest.fixture(scope='module')
+def client():
+    with app.app_context():
+        db.create_all()
+        for index in range(30):
+            db_add_products(f"Api Product {index}", "url", 1, 10, 100.0 + index, 80.0 + index,
+                            "A product described at some length " * 3)
+    yield app.test_client()
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def test_products_are_paginated_with_sparse_fieldsets(client):
+    response = client.get('/api/v1/products?limit=20&fields=id,name,promotion_price')
+    assert response.status_code == 200
+    page = response.json
+    assert len(page["products"]) == 20
+    assert page["products"][0] == {"id": 1, "name": "Api Product 0", "promotion_price": 80.0}
+    assert client.get('/api/v1/products?limit=1&fields=savings,discount_percent').json["products"] == [
+        {"savings": 20.0, "discount_percent": 20.0}]
+
+    second = client.get(f'/api/v1/products?limit=20&after={page["next"]}').json
+    assert [product["id"] for product in second["products"]] == list(range(21, 31))
+    assert set(second["products"][0]) == {"id", "name", "original_price", "promotion_price", "rating",
+                                          "image_url", "weight", "slug", "added_on", "discount_percent", "savings"}
+    assert second["next"] is None
+
+    response = client.get('/api/v1/products?fields=id,password')
+    assert response.status_code == 400
+    assert "password" in response.json["message"]
+
+
+def test_product_by_id_and_slug(client):
+    by_id = client.get('/api/v1/products/3').json
+    assert by_id["name"] == "Api Product 2"
+    assert by_id["quantity"] == 10
+    assert client.get(f'/api/v1/products/{by_id["slug"]}?fields=id').json == {"id": 3}
+    assert client.get('/api/v1/products/999').status_code == 404
+
+
+def test_strong_etags_and_compression(client):
+    url = '/api/v1/products?limit=100'
+    plain = client.get(url)
+    etag = plain.headers['ETag']
+    assert not etag.startswith('W/')
+    assert 'Content-Encoding' not in plain.headers
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    for encoding, decompress in (('br', brotli.decompress), ('gzip', gzip.decompress)):
+        response = client.get(url, headers={'Accept-Encoding': encoding})
+        assert response.headers['Content-Encoding'] == encoding
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert len(response.data) < len(plain.data)
+        assert json.loads(decompress(response.data)) == plain.json
+        assert response.headers['ETag'] != etag
+        revalidated = client.get(url, headers={'Accept-Encoding': encoding,
+                                               'If-None-Match': response.headers['ETag']})
+        assert revalidated.status_code == 304
+
+    with app.app_context():
+        db_add_products("Api Product new", "url", 1, 10, 100.0, 80.0, "new")
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 200
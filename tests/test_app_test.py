@@ -0,0 +1,305 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+from sqlalchemy import event
+
+from app import create_app
+from cache import SQLiteCacheBackend
+from database_manager import *
+from instrumentation import QueryBudgetExceeded, parameters_shape
+from passwords import password_hasher
+from ratelimit import rate_limiter
+
+app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://", "SECRET_KEY": "test"})
+
+
+@pytest.fixture(scope='module')
+def client():
+    app.config.update({
+        "TESTING": True,
+        "WTF_CSRF_ENABLED": False,
+        # Fails any route test that starts issuing queries per row
+        "QUERY_BUDGET": 8,
+        "QUERY_BUDGET_ENFORCE": True,
+    })
+    with app.app_context():
+        db.create_all()
+        db_add_products("Route Product", "image_url", 10, 5, 100.0, 80.0, "description")
+    yield app.test_client()
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def test_apps_keep_their_own_cache_limiter_and_hasher():
+    first = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://", "SECRET_KEY": "test",
+                        "CATALOG_CACHE_BACKEND": "none", "RATE_LIMIT_BACKEND": "none", "PASSWORD_HASH_WORKERS": 0})
+    second = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://", "SECRET_KEY": "test",
+                         "CATALOG_CACHE_BACKEND": "memory", "RATE_LIMIT_BACKEND": "memory",
+                         "PASSWORD_HASH_WORKERS": 1})
+    with first.app_context():
+        assert catalog_cache.stats()["backend"] is None
+        assert catalog_cache.get_or_load("page", lambda: "first") == "first"
+        assert rate_limiter.for_app(first).backend is None
+        assert password_hasher.for_app(first).workers == 0
+    with second.app_context():
+        assert catalog_cache.stats()["backend"] == "MemoryCacheBackend"
+        assert catalog_cache.get_or_load("page", lambda: "second") == "second"
+        assert rate_limiter.for_app(second).backend is not None
+        assert password_hasher.for_app(second).workers == 1
+    # The page cached by the second app is not served to the others
+    with app.app_context():
+        assert catalog_cache.get_or_load("page", lambda: "module app") == "module app"
+
+
+@pytest.fixture()
+def shared_cache(tmp_path):
+    # The version of the sqlite backend is seen by every worker, catalog pages are only revalidated with it
+    cache = catalog_cache.for_app(app)
+    backend = cache.backend
+    cache.backend = SQLiteCacheBackend(str(tmp_path / "catalog_cache.sqlite"))
+    yield cache
+    cache.backend = backend
+
+
+def test_index_is_not_revalidated_with_a_per_process_cache(client):
+    response = client.get('/')
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
+
+
+def test_index_revalidates_with_etag(client, shared_cache):
+    etag = client.get('/').headers['ETag']
+
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_index_etag_changes_with_catalog(client, shared_cache):
+    etag = client.get('/').headers['ETag']
+    with app.app_context():
+        db_add_products("Another Product", "image_url", 10, 5, 100.0, 80.0, "description")
+
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b"Another Product" in response.data
+    assert response.headers['ETag'] != etag
+
+
+def test_product_page_etag_changes_with_stock(client, shared_cache):
+    with app.app_context():
+        product = db_add_products("Stocked Product", "image_url", 10, 5, 100.0, 80.0, "description")
+        user = db_add_user("Stock", "Watcher", "0788888877", "password")
+        product_id, slug, user_id = product.id, product.slug, user.id
+    etag = client.get(f'/product/{slug}').headers['ETag']
+    assert client.get(f'/product/{slug}', headers={'If-None-Match': etag}).status_code == 304
+
+    with app.app_context():
+        db_add_sale([(product_id, 2)], user_id, PaymentMode.MPESA)
+    response = client.get(f'/product/{slug}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b"3 in stock" in response.data
+    assert response.headers['ETag'] != etag
+
+
+def test_login_rehashes_outdated_password(client):
+    hasher = password_hasher.for_app(app)
+    configured_method = hasher.method
+    hasher.method = "pbkdf2:sha256:1000"
+    try:
+        with app.app_context():
+            db_add_user("Old", "Hash", "0799999999", "password")
+    finally:
+        hasher.method = configured_method
+
+    response = client.post('/auth/login', data={"phone": "0799999999", "password": "password"})
+    assert response.status_code == 302
+    with app.app_context():
+        stored_hash = db_get_user_by_phone("0799999999").password
+    assert stored_hash.startswith("scrypt:32768:8:1$")
+    assert password_hasher.verify(stored_hash, "password")
+    client.get('/auth/logout')
+
+
+def count_statements(callable_):
+    with app.app_context():
+        engine = db.engine
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        response = callable_()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return response, len(statements)
+
+
+def test_basket_queries_do_not_depend_on_item_count(client):
+    with app.app_context():
+        user_id = db_add_user("Basket", "Owner", "0788888888", "password").id
+        product_ids = [db_add_products(f"Basket Product {index}", "url", 1, 10, 20.0, 15.0, "item").id
+                       for index in range(10)]
+        db_add_to_cart(user_id, product_ids[0], 1)
+    client.post('/auth/login', data={"phone": "0788888888", "password": "password"})
+
+    response, single_item_queries = count_statements(lambda: client.get('/basket'))
+    assert response.status_code == 200
+
+    with app.app_context():
+        for product_id in product_ids[1:]:
+            db_add_to_cart(user_id, product_id, 2)
+    response, many_items_queries = count_statements(lambda: client.get('/basket'))
+    assert response.status_code == 200
+    assert b"Basket Product 9" in response.data
+    assert many_items_queries == single_item_queries
+    client.get('/auth/logout')
+
+
+def test_batch_add_to_cart_is_one_request(client):
+    with app.app_context():
+        db_add_user("Batch", "Clicker", "0755555555", "password")
+        product_ids = [db_add_products(f"Batch Product {index}", "url", 1, 10, 20.0, 15.0, "item").id
+                       for index in range(3)]
+    client.post('/auth/login', data={"phone": "0755555555", "password": "password"})
+
+    items = [{"productId": product_id, "quantity": 2} for product_id in product_ids]
+    response = client.post('/cart/items', json={"items": items + [{"productId": product_ids[0], "quantity": 1}]})
+    assert response.status_code == 200
+    assert sorted((item["productId"], item["quantity"]) for item in response.json["items"]) == [
+        (product_ids[0], 3), (product_ids[1], 2), (product_ids[2], 2)]
+
+    assert client.post('/cart/items', json={"items": [{"productId": "x"}]}).status_code == 400
+    assert client.post('/cart/items', json={}).status_code == 400
+    assert client.post('/cart/items', json=[1]).status_code == 400
+
+    # Quantities sent as strings are accepted, other values are rejected and emptying a row is not a failure
+    assert client.post('/add-to-cart', json={"productId": product_ids[1], "quantity": "1"}).json == {"success": True}
+    assert client.post('/add-to-cart', json={"productId": product_ids[1], "quantity": "two"}).status_code == 400
+    assert client.post('/add-to-cart', json={"productId": None, "quantity": 1}).status_code == 400
+    response = client.post('/add-to-cart', json={"productId": product_ids[1], "quantity": -3})
+    assert response.status_code == 200
+    assert response.json == {"success": True}
+    client.get('/auth/logout')
+
+
+def test_unknown_products_stay_out_of_the_basket(client):
+    with app.app_context():
+        user_id = db_add_user("Unknown", "Product", "0744444444", "password").id
+        product_id = db_add_products("Known Product", "url", 1, 10, 20.0, 15.0, "item").id
+    client.post('/auth/login', data={"phone": "0744444444", "password": "password"})
+
+    response = client.post('/cart/items', json={"items": [{"productId": product_id, "quantity": 1},
+                                                          {"productId": 999999, "quantity": 1}]})
+    assert response.status_code == 400
+    assert response.json["message"] == Errors.UNKNOWN_PRODUCT["message"]
+    assert client.post('/add-to-cart', json={"productId": 999999, "quantity": 1}).status_code == 400
+    with app.app_context():
+        assert db_count_basket_items(user_id) == 0
+        # A row left behind by a product deleted since
+        db.session.add(CartItems(user_id=user_id, inventory_id=999999, quantity=1))
+        db.session.commit()
+
+    response = client.get('/basket')
+    assert response.status_code == 200
+    client.get('/auth/logout')
+
+
+def test_db_load_user_caches_columns(client):
+    with app.app_context():
+        user_id = db_add_user("Cached", "User", "0777777777", "password").id
+        db.session.remove()
+
+    with app.app_context():
+        assert db_load_user(user_id, ttl=60).lastname == "User"
+        db.session.remove()
+    with app.app_context():
+        user, queries = count_statements(lambda: db_load_user(user_id, ttl=60))
+        assert queries == 0
+        assert user.phone == "0777777777"
+        assert user.basket_items == []
+
+        db_update_password(user, "new password")
+        db.session.remove()
+    with app.app_context():
+        user, queries = count_statements(lambda: db_load_user(user_id, ttl=60))
+        assert queries == 1
+
+
+def test_server_timing_and_query_budget(client):
+    response = client.get('/products')
+    assert response.headers['Server-Timing'].startswith('db;dur=')
+    assert 'render;dur=' in response.headers['Server-Timing']
+
+    app.config['QUERY_BUDGETS'] = {'products': 0}
+    try:
+        with app.app_context():
+            catalog_cache.invalidate()
+        with pytest.raises(QueryBudgetExceeded):
+            client.get('/products?lower_limit=1')
+    finally:
+        app.config['QUERY_BUDGETS'] = {}
+
+
+def test_parameters_shape_hides_values():
+    assert parameters_shape({"phone": "0700000000", "id": 1}) == "{phone: str, id: int}"
+    assert parameters_shape([("a", 1), ("b", 2)], executemany=True) == "2 x (str, int)"
+
+
+def test_search_pages_and_json(client):
+    response = client.get('/search?q=route')
+    assert response.status_code == 200
+    assert b"Route Product" in response.data
+
+    data = client.get('/search.json?q=rou').get_json()
+    assert [product["name"] for product in data["products"]] == ["Route Product"]
+    assert data["next"] is None
+
+
+def test_product_page_by_slug(client):
+    response = client.get('/product/route-product')
+    assert response.status_code == 200
+    assert b"Route Product" in response.data
+    # 20% off and Ksh. 20 saved come from the catalog query, not from the template
+    assert b"20% OFF" in response.data and b"Save Ksh. 20.0" in response.data
+    # Weights are in kg everywhere, as entered in the add product form and filtered on
+    assert b" kg &middot;" in response.data
+    assert b'href="/product/route-product"' in client.get('/products').data
+    assert client.get('/product/missing').status_code == 404
+
+
+def test_products_filters_and_facet_counts(client):
+    response = client.get('/products?min_price=50&max_price=90&min_rating=oops')
+    assert response.status_code == 200
+    assert b"Route Product" in response.data
+    # The weight facet links keep the price filter
+    assert b"min_price=50" in response.data and b"upper_limit=" in response.data
+
+    response = client.get('/products?min_price=500')
+    assert b"Route Product" not in response.data
+
+
+def test_orders_page_queries_do_not_depend_on_order_count(client):
+    with app.app_context():
+        user_id = db_add_user("Order", "History", "0766666666", "password").id
+        product_ids = [db_add_products(f"History Product {index}", "url", 1, 100, 20.0, 15.0, "item").id
+                       for index in range(3)]
+        db_add_sale([(product_ids[0], 2)], user_id, PaymentMode.MPESA)
+    client.post('/auth/login', data={"phone": "0766666666", "password": "password"})
+
+    response, one_order_queries = count_statements(lambda: client.get('/orders'))
+    assert response.status_code == 200
+    assert b"History Product 0 x 2" in response.data
+
+    with app.app_context():
+        for _ in range(12):
+            db_add_sale([(product_id, 1) for product_id in product_ids], user_id, PaymentMode.MPESA)
+    response, many_orders_queries = count_statements(lambda: client.get('/orders'))
+    assert response.status_code == 200
+    assert b"History Product 2 x 1" in response.data
+    assert many_orders_queries == one_order_queries
+    client.get('/auth/logout')
@@ -0,0 +1,147 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import asyncio
+import json
+from http.cookies import SimpleCookie
+from urllib.parse import urlsplit
+
+import pytest
+
+import async_database_manager
+from asgi import create_asgi_app
+from async_database_manager import async_db
+from database_manager import *
+
+
+async def call(asgi, method, url, body=b"", headers=(), cookies=None):
+    """
+    Sends one HTTP request to an ASGI application, returns (status, headers, body)
+    """
+    url = urlsplit(url)
+    headers = [(name.lower().encode(), value.encode()) for name, value in headers]
+    if cookies:
+        headers.append((b"cookie", "; ".join(f"{name}={value}" for name, value in cookies.items()).encode()))
+    scope = {"type": "http", "http_version": "1.1", "method": method, "scheme": "http", "path": url.path,
+             "raw_path": url.path.encode(), "query_string": url.query.encode(), "root_path": "",
+             "headers": [(b"host", b"localhost")] + headers, "client": ("127.0.0.1", 1234),
+             "server": ("localhost", 80)}
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi(scope, receive, send)
+    response_headers = [(name.decode(), value.decode()) for name, value in sent[0]["headers"]]
+    if cookies is not None:
+        for name, value in response_headers:
+            if name == "set-cookie":
+                cookies.update({key: morsel.value for key, morsel in SimpleCookie(value).items()})
+    return sent[0]["status"], dict(response_headers), sent[1]["body"]
+
+
+# One event loop for the module like in a worker, the connections of the asyncio engines belong to it
+loop = asyncio.new_event_loop()
+
+
+def run(coroutine):
+    return loop.run_until_complete(coroutine)
+
+
+def request(asgi, method, url, **kwargs):
+    return run(call(asgi, method, url, **kwargs))
+
+
+def post_json(asgi, url, payload, cookies):
+    return request(asgi, "POST", url, body=json.dumps(payload).encode(),
+                   headers=[("Content-Type", "application/json")], cookies=cookies)
+
+
+@pytest.fixture(scope='module')
+def asgi(tmp_path_factory):
+    database_uri = f"sqlite:///{tmp_path_factory.mktemp('asgi') / 'shop.sqlite'}"
+    asgi = create_asgi_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": database_uri, "SECRET_KEY": "test",
+                            "WTF_CSRF_ENABLED": False})
+    with asgi.app.app_context():
+        db.create_all()
+        for index in range(30):
+            db_add_products(f"Async Product {index}", "url", 1, 10, 100.0 + index, 80.0 + index, "async")
+        db_add_user("Async", "Shopper", "0744444444", "password")
+    yield asgi
+    run(async_db.for_app(asgi.app).dispose())
+    loop.close()
+    with asgi.app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def login(asgi):
+    cookies = {}
+    request(asgi, "POST", "/auth/login", body=b"phone=0744444444&password=password",
+            headers=[("Content-Type", "application/x-www-form-urlencoded")], cookies=cookies)
+    return cookies
+
+
+def test_async_catalog_matches_flask(asgi):
+    url = '/api/v1/products?limit=10&fields=id,name,savings'
+    status, headers, body = request(asgi, "GET", url)
+    assert status == 200
+    assert body == asgi.app.test_client().get(url).data
+    assert json.loads(body)["products"][0] == {"id": 1, "name": "Async Product 0", "savings": 20.0}
+
+    status, _, _ = request(asgi, "GET", url, headers=[("If-None-Match", headers["etag"].strip('"'))])
+    assert status == 304
+    status, _, body = request(asgi, "GET", '/api/v1/products?fields=password')
+    assert status == 400
+    assert json.loads(body)["success"] is False
+
+
+def test_concurrent_requests_share_one_event_loop(asgi):
+    async def pages():
+        return await asyncio.gather(*(call(asgi, "GET", f'/api/v1/products?limit={limit}')
+                                      for limit in range(1, 21)))
+
+    responses = run(pages())
+    assert [len(json.loads(body)["products"]) for _, _, body in responses] == list(range(1, 21))
+    # Pages the async routes don't serve are answered by the Flask app
+    status, _, body = request(asgi, "GET", '/product/async-product-3')
+    assert status == 200
+    assert b"Async Product 3" in body
+
+
+def test_async_cart_and_checkout(asgi):
+    status, headers, _ = post_json(asgi, '/cart/items', {"items": [{"productId": 1, "quantity": 1}]}, cookies={})
+    assert status == 302
+    assert '/auth/login' in headers["location"]
+
+    cookies = login(asgi)
+    status, _, body = post_json(asgi, '/cart/items', {"items": [{"productId": 1, "quantity": 2},
+                                                                 {"productId": 2, "quantity": 1}]}, cookies)
+    assert status == 200
+    assert json.loads(body)["items"] == [{"productId": 1, "quantity": 2}, {"productId": 2, "quantity": 1}]
+    status, _, body = post_json(asgi, '/add-to-cart', {"productId": 2, "quantity": 1}, cookies)
+    assert json.loads(body) == {"success": True}
+    assert post_json(asgi, '/cart/items', {"items": []}, cookies)[0] == 400
+
+    status, headers, _ = request(asgi, "GET", '/checkout?payment=MPESA', cookies=cookies)
+    assert status == 302
+    assert headers["location"].endswith('/products')
+    with asgi.app.app_context():
+        user = db_get_user_by_phone("0744444444")
+        assert db_count_basket_items(user.id) == 0
+        sale = db.session.execute(select(Sale).where(Sale.bought_by == user.id)).scalar_one()
+        assert sale.total == 80.0 * 2 + 81.0 * 2
+        assert db.session.get(Inventory, 1).quantity == 8
+    # The flashed message is shown by the next page, served by Flask
+    assert b"Order confirmed!" in request(asgi, "GET", '/products', cookies=cookies)[2]
+
+
+def test_async_db_add_sale_reports_shortages(asgi):
+    with asgi.app.app_context():
+        shortage = run(async_database_manager.db_add_sale([(3, 11)], 1, PaymentMode.MPESA))
+    assert shortage["code"] == Errors.INSUFFICIENT_STOCK["code"]
+    assert shortage["items"] == [{"product_id": 3, "name": "Async Product 2", "requested": 11, "available": 10}]
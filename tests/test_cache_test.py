@@ -0,0 +1,72 @@
+import sys
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+
+from cache import CatalogCache, MemoryCacheBackend, SQLiteCacheBackend
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteCacheBackend(str(tmp_path / "cache.sqlite"), max_entries=2)
+    return MemoryCacheBackend(max_entries=2)
+
+
+def test_backend_evicts_least_recently_used(backend):
+    backend.set("a", 1, 60)
+    time.sleep(0.01)
+    backend.set("b", 2, 60)
+    time.sleep(0.01)
+    assert backend.get("a") == (True, 1)
+    time.sleep(0.01)
+    backend.set("c", 3, 60)
+    assert backend.get("b") == (False, None)
+    assert backend.get("a") == (True, 1)
+    assert backend.get("c") == (True, 3)
+
+
+def test_backend_expires_entries(backend):
+    backend.set("a", 1, -1)
+    assert backend.get("a") == (False, None)
+
+
+def test_sqlite_backend_is_shared(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    first, second = SQLiteCacheBackend(path), SQLiteCacheBackend(path)
+    first.set("page", [("row", 1)], 60)
+    assert second.get("page") == (True, [("row", 1)])
+    second.clear()
+    assert first.get("page") == (False, None)
+
+
+def test_catalog_cache_counts_hits_and_misses():
+    cache = CatalogCache(MemoryCacheBackend())
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return "page"
+
+    assert cache.get_or_load(("products", None), loader) == "page"
+    assert cache.get_or_load(("products", None), loader) == "page"
+    cache.invalidate()
+    assert cache.get_or_load(("products", None), loader) == "page"
+    assert len(loads) == 2
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_catalog_cache_counts_every_lookup_across_threads():
+    cache = CatalogCache(MemoryCacheBackend())
+
+    def look_up(index):
+        for _ in range(2000):
+            cache.get_or_load(("products", index % 4), lambda: "page")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(look_up, range(8)))
+    stats = cache.stats()
+    assert stats["hits"] + stats["misses"] == 16000
@@ -0,0 +1,63 @@
+import sys
+import os
+import threading
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+from flask import Flask
+
+from database_manager import *
+
+INITIAL_STOCK = 50
+WORKERS = 16
+CHECKOUTS_PER_WORKER = 5
+
+
+@pytest.fixture()
+def concurrent_app(tmp_path):
+    # A file database so that every thread gets its own connection to the same data
+    concurrent_app = Flask(__name__)
+    concurrent_app.config.update({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'concurrency.sqlite'}",
+        "SQLALCHEMY_ENGINE_OPTIONS": {"connect_args": {"timeout": 30}},
+    })
+    db.init_app(concurrent_app)
+    with concurrent_app.app_context():
+        db.create_all()
+    yield concurrent_app
+    with concurrent_app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+def test_parallel_checkouts_never_oversell(concurrent_app):
+    with concurrent_app.app_context():
+        user_id = db_add_user("Flash", "Sale", "0700000001", "password").id
+        product_id = db_add_products("Flash Sale Item", "url", 1, INITIAL_STOCK, 100.0, 50.0, "hot").id
+
+    outcomes = []
+    lock = threading.Lock()
+
+    def shopper():
+        with concurrent_app.app_context():
+            for _ in range(CHECKOUTS_PER_WORKER):
+                result = db_add_sale([(product_id, 1)], user_id, PaymentMode.MPESA)
+                with lock:
+                    outcomes.append(result if isinstance(result, dict) else "sold")
+            db.session.remove()
+
+    threads = [threading.Thread(target=shopper) for _ in range(WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with concurrent_app.app_context():
+        remaining = db.session.get(Inventory, product_id).quantity
+        sales = SaleData.query.filter_by(inventory_id=product_id).count()
+
+    attempts = WORKERS * CHECKOUTS_PER_WORKER
+    assert len(outcomes) == attempts
+    assert outcomes.count("sold") == INITIAL_STOCK
+    assert all(outcome == "sold" or outcome["code"] == Errors.INSUFFICIENT_STOCK["code"] for outcome in outcomes)
+    assert remaining == 0
+    assert sales == INITIAL_STOCK
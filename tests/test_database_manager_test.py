@@ -3,17 +3,16 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import pytest
+from sqlalchemy import event
 
-from app import app
+from app import create_app
 from database_manager import *
 
+app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://", "SECRET_KEY": "test"})
+
 
 @pytest.fixture(scope='module')
 def test_app():
-    # app = create_app('testing')
-    app.config.update({
-        "TESTING": True,
-    })
     with app.app_context():
         yield app
 
@@ -36,9 +35,32 @@ def test_db_add_user(test_app, test_db):
 def test_db_get_all_products(test_app, test_db):
     # First, add a product
     db_add_products("Test Product", "image_url", 10, 5, 100.0, 80.0, "description")
-    products = db_get_all_products()
+    products, next_cursor = db_get_all_products()
     assert len(products) == 1
     assert products[0].name == "Test Product"
+    assert next_cursor is None
+
+
+def test_db_get_all_products_pagination(test_app, test_db):
+    for index in range(4):
+        db_add_products(f"Paged Product {index}", "image_url", 10, 5, 100.0, 80.0, "description")
+    all_products, _ = db_get_all_products(page_size=100)
+
+    first_page, cursor = db_get_all_products(page_size=2)
+    assert [product.id for product in first_page] == [product.id for product in all_products[:2]]
+    assert cursor is not None
+
+    collected = list(first_page)
+    while cursor:
+        page, cursor = db_get_all_products(after=cursor, page_size=2)
+        collected.extend(page)
+    assert [product.id for product in collected] == [product.id for product in all_products]
+
+
+def test_db_get_all_products_invalid_cursor(test_app, test_db):
+    products, _ = db_get_all_products(after="not-a-cursor", page_size=1)
+    first_products, _ = db_get_all_products(page_size=1)
+    assert products == first_products
 
 
 def test_db_get_user_by_phone(test_app, test_db):
@@ -48,6 +70,33 @@ def test_db_get_user_by_phone(test_app, test_db):
     assert user.phone == "9876543210"
 
 
+def test_db_add_products_generates_unique_slugs(test_app, test_db):
+    assert slugify("  Café Table, 2 Seats! ") == "cafe-table-2-seats"
+    assert slugify("!!!") == "product"
+
+    slugs = [db_add_products("Slug Chair", "url", 1, 10, 20.0, 15.0, "chair").slug for _ in range(3)]
+    assert slugs == ["slug-chair", "slug-chair-2", "slug-chair-3"]
+    assert db_add_products("Other", "url", 1, 10, 20.0, 15.0, "chair", slug="Slug Chair").slug == "slug-chair-4"
+    assert db_get_product(slug="slug-chair-2").name == "Slug Chair"
+
+
+def test_db_normalize_slugs(test_app, test_db):
+    inserted = db_add_products("Legacy Desk", "url", 1, 10, 20.0, 15.0, "desk")
+    slug_index = next(index for index in Inventory.__table__.indexes if index.name == 'ix_inventory_slug')
+    slug_index.drop(db.engine)
+    # Slugs of products added before they were unique
+    db.session.execute(update(Inventory).where(Inventory.id == inserted.id).values(slug="Legacy-Desk"))
+    db.session.execute(insert(Inventory).values(name="Legacy Desk", slug="Legacy-Desk", image_url="url"))
+    db.session.commit()
+
+    assert db_normalize_slugs() == 2
+    assert db.session.scalars(select(Inventory.slug).where(Inventory.name == "Legacy Desk")
+                              .order_by(Inventory.id)).all() == ["legacy-desk", "legacy-desk-2"]
+    with pytest.raises(IntegrityError):
+        db.session.execute(insert(Inventory).values(name="Legacy Desk", slug="legacy-desk", image_url="url"))
+    db.session.rollback()
+
+
 def test_db_add_to_cart(test_app, test_db):
     # Add user and product first
     user = db_add_user("Alice", "Wonderland", "1112223333", "password")
@@ -55,6 +104,27 @@ def test_db_add_to_cart(test_app, test_db):
     cart_item = db_add_to_cart(user.id, product.id, 2)
     assert cart_item is not None
     assert cart_item.quantity == 2
+    # Taking every unit out removes the row and says so
+    assert tuple(db_add_to_cart(user.id, product.id, -2)) == (product.id, 0)
+    assert db_count_basket_items(user.id) == 0
+    assert db_add_to_cart(user.id, product.id, 0) == Errors.MISSING_PARAMS
+
+
+def test_db_add_to_cart_items_upserts_in_one_statement(test_app, test_db):
+    user = db_add_user("Batch", "Cart", "1112224444", "password")
+    first = db_add_products("Batch A", "url", 1, 10, 20.0, 15.0, "Batch A")
+    second = db_add_products("Batch B", "url", 1, 10, 20.0, 15.0, "Batch B")
+    db_add_to_cart(user.id, first.id, 1)
+
+    rows = db_add_to_cart_items(user.id, [(first.id, 2), (second.id, 1), (second.id, 1)])
+    assert sorted(tuple(row) for row in rows) == [(first.id, 3), (second.id, 2)]
+    assert CartItems.query.filter_by(user_id=user.id).count() == 2
+
+    assert db_add_to_cart_items(user.id, [(second.id, -2)]) == []
+    assert [item.inventory_id for item in CartItems.query.filter_by(user_id=user.id)] == [first.id]
+    assert db_add_to_cart_items(user.id, [(first.id, 1)] * 2 + [(first.id, -2)]) == Errors.MISSING_PARAMS
+    assert db_add_to_cart_items(user.id, [(index, 1) for index in range(CART_BATCH_LIMIT + 1)]) \
+        == Errors.TOO_MANY_ITEMS
 
 
 def test_db_remove_from_cart(test_app, test_db):
@@ -77,3 +147,215 @@ def test_db_add_sale(test_app, test_db):
     sale = db_add_sale([(product.id, 1)], user.id, PaymentMode.MPESA)
     assert sale is not None
     assert sale.total == product.promotion_price
+
+
+def test_db_add_sale_respects_quantity_and_clears_cart(test_app, test_db):
+    user = db_add_user("Mallory", "Market", "4445556666", "password")
+    first = db_add_products("Bulk A", "url", 1, 30, 40.0, 35.0, "Bulk A")
+    second = db_add_products("Bulk B", "url", 1, 30, 20.0, 10.0, "Bulk B")
+    db_add_to_cart(user.id, first.id, 2)
+    db_add_to_cart(user.id, second.id, 3)
+
+    sale = db_add_sale([(first.id, 2), (second.id, 3)], user.id, PaymentMode.BANK, clear_cart=True)
+    assert sale.total == 2 * 35.0 + 3 * 10.0
+    assert len(sale.products) == 2
+    assert CartItems.query.filter_by(user_id=user.id).count() == 0
+
+
+def test_db_add_sale_keeps_cart_items_added_after_the_cart_was_read(test_app, test_db):
+    user = db_add_user("Late", "Adder", "4445557777", "password")
+    first = db_add_products("Racing A", "url", 1, 30, 40.0, 35.0, "Racing A")
+    second = db_add_products("Racing B", "url", 1, 30, 20.0, 10.0, "Racing B")
+    db_add_to_cart(user.id, first.id, 2)
+    basket = [(item.inventory_id, item.quantity) for item in CartItems.query.filter_by(user_id=user.id)]
+
+    # Another request adds to the cart between the checkout's read and its sale
+    db_add_to_cart_items(user.id, [(first.id, 1), (second.id, 4)])
+    db_add_sale(basket, user.id, PaymentMode.MPESA, clear_cart=True)
+    db.session.expire_all()
+    assert sorted((item.inventory_id, item.quantity) for item in CartItems.query.filter_by(user_id=user.id)) == [
+        (first.id, 1), (second.id, 4)]
+
+
+def test_db_add_sale_round_trips_independent_of_basket_size(test_app, test_db):
+    user = db_add_user("Oscar", "Orders", "5556667777", "password")
+    products = [db_add_products(f"Round Trip {index}", "url", 1, 100, 10.0, 8.0, "item") for index in range(20)]
+
+    def count_statements(basket):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            db_add_sale(basket, user.id, PaymentMode.MPESA, clear_cart=True)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+        return len(statements)
+
+    assert count_statements([(products[0].id, 1)]) == count_statements([(product.id, 1) for product in products])
+
+
+def test_db_add_sale_updates_daily_aggregates_last(test_app, test_db):
+    user = db_add_user("Hot", "Rows", "5556668888", "password")
+    product = db_add_products("Hot Row", "url", 1, 10, 10.0, 8.0, "item")
+    db_add_to_cart(user.id, product.id, 1)
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement.split()[2].strip('"'))
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        db_add_sale([(product.id, 1)], user.id, PaymentMode.MPESA, clear_cart=True, follow_up_jobs=["noop"])
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+    # The rows shared by every checkout of the day are locked right before the commit
+    assert statements[-3:] == ["product_sales", "payment_mode_sales", "daily_sales"]
+
+
+def test_db_add_sale_decrements_stock(test_app, test_db):
+    user = db_add_user("Stock", "Keeper", "6667778888", "password")
+    product = db_add_products("Limited", "url", 1, 3, 40.0, 35.0, "Limited")
+
+    db_add_sale([(product.id, 2)], user.id, PaymentMode.MPESA)
+    assert db.session.get(Inventory, product.id).quantity == 1
+
+    result = db_add_sale([(product.id, 2)], user.id, PaymentMode.MPESA)
+    assert result["code"] == Errors.INSUFFICIENT_STOCK["code"]
+    assert result["items"] == [{"product_id": product.id, "name": "Limited", "requested": 2, "available": 1}]
+    assert db.session.get(Inventory, product.id).quantity == 1
+
+
+def test_db_add_sale_keeps_the_cached_listing(test_app, test_db):
+    user = db_add_user("Cached", "Buyer", "6667770000", "password")
+    product = db_add_products("Cached Kettle", "url", 1, 5, 40.0, 35.0, "Cached")
+    db_get_all_products()
+    assert db_get_product(product_id=product.id).quantity == 5
+    assert db_get_product(slug=product.slug).quantity == 5
+    version = catalog_cache.version()
+
+    db_add_sale([(product.id, 2)], user.id, PaymentMode.MPESA)
+    # Listings don't show the stock, only the product rows are dropped
+    hits = catalog_cache.stats()["hits"]
+    db_get_all_products()
+    assert catalog_cache.stats()["hits"] == hits + 1
+    assert catalog_cache.version() == version
+    assert db_get_product(product_id=product.id).quantity == 3
+    assert db_get_product(slug=product.slug).quantity == 3
+
+
+def test_db_add_sale_rejects_non_positive_quantities(test_app, test_db):
+    user = db_add_user("Negative", "Buyer", "6667779999", "password")
+    product = db_add_products("Refund Trick", "url", 1, 3, 40.0, 35.0, "Stock")
+    sales = db.session.execute(select(func.count(Sale.id))).scalar_one()
+
+    for basket in ([(product.id, -3)], [(product.id, 0)], [(product.id, 1), (product.id, -1)], [(product.id, "x")]):
+        assert db_add_sale(basket, user.id, PaymentMode.MPESA) == Errors.INVALID_QUANTITY
+    assert db.session.get(Inventory, product.id).quantity == 3
+    assert db.session.execute(select(func.count(Sale.id))).scalar_one() == sales
+
+
+def test_db_search_products_ranks_and_matches_prefixes(test_app, test_db):
+    db_add_products("Cordless Drill", "url", 2, 5, 100.0, 90.0, "Drill with two batteries")
+    db_add_products("Battery Pack", "url", 1, 5, 50.0, 45.0, "Spare pack for the cordless drill")
+    db_add_products("Garden Hose", "url", 3, 5, 30.0, 25.0, "Twenty metres")
+
+    found, next_cursor = db_search_products("cordless drill")
+    # The name match ranks above the description match
+    assert [product.name for product in found] == ["Cordless Drill", "Battery Pack"]
+    assert next_cursor is None
+
+    found, _ = db_search_products("batt")
+    assert {product.name for product in found} == {"Cordless Drill", "Battery Pack"}
+    # Query syntax in user input is treated as words
+    assert db_search_products('hose" OR *')[0] == []
+    assert db_search_products("  ") == ([], None)
+
+
+def test_db_search_products_follows_updates_and_pages(test_app, test_db):
+    hose = db.session.execute(select(Inventory).where(Inventory.name == "Garden Hose")).scalar_one()
+    hose.name = "Garden Sprinkler"
+    db.session.commit()
+    catalog_cache.invalidate()
+    assert db_search_products("hose")[0] == []
+    assert [product.name for product in db_search_products("sprinkler")[0]] == ["Garden Sprinkler"]
+
+    for index in range(5):
+        db_add_products(f"Paged Lamp {index}", "url", 1, 5, 10.0, 9.0, "lamp")
+    first_page, cursor = db_search_products("lamp", page_size=3)
+    second_page, last_cursor = db_search_products("lamp", after=cursor, page_size=3)
+    assert len(first_page) == 3 and len(second_page) == 2 and last_cursor is None
+    assert {product.name for product in first_page + second_page} == {f"Paged Lamp {index}" for index in range(5)}
+
+
+def test_discount_filter_uses_its_expression_index(test_app, test_db):
+    query = select(Inventory.id).where(Inventory.discount_percent >= 25).compile(db.engine)
+    plan = db.session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {query}", tuple(query.params.values())).all()
+    assert any("USING INDEX ix_inventory_discount_percent" in row[-1] for row in plan)
+
+
+def test_db_get_facet_counts_in_one_query(test_app, test_db):
+    db.session.execute(delete(Inventory))
+    db.session.commit()
+    db_upsert_products([
+        {"name": "Facet A", "slug": "facet-a", "image_url": "url", "weight": 2, "quantity": 1, "rating": 5,
+         "original_price": 400.0, "promotion_price": 200.0, "description": ""},
+        {"name": "Facet B", "slug": "facet-b", "image_url": "url", "weight": 20, "quantity": 1, "rating": 3,
+         "original_price": 1000.0, "promotion_price": 950.0, "description": ""},
+        {"name": "Facet C", "slug": "facet-c", "image_url": "url", "weight": 200, "quantity": 1, "rating": 4,
+         "original_price": 3000.0, "promotion_price": 2000.0, "description": ""},
+    ])
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        facets = db_get_facet_counts(min_rating=4)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+    assert len(statements) == 1
+
+    counts = {facet: {bucket["low"]: bucket["count"] for bucket in buckets} for facet, buckets in facets.items()}
+    # Other facets only count the products rated 4 and up
+    assert counts["price"][0] == 1 and counts["price"][500] == 0 and counts["price"][1000] == 1
+    assert counts["weight"][1] == 1 and counts["weight"][100] == 1
+    # The rating facet ignores its own filter
+    assert counts["rating"] == {1: 3, 2: 3, 3: 3, 4: 2, 5: 1}
+    assert counts["discount"] == {0: 2, 10: 2, 25: 2, 50: 1}
+
+    products, _ = db_get_all_products(min_discount=25, max_price=1000)
+    assert [product.name for product in products] == ["Facet A"]
+
+
+def test_facet_links_list_the_products_they_count(test_app, test_db):
+    # Priced exactly on the edge between two price buckets
+    db_upsert_products([{"name": "Facet Edge", "slug": "facet-edge", "image_url": "url", "weight": 5, "quantity": 1,
+                         "rating": 4, "original_price": 1200.0, "promotion_price": 1000.0, "description": ""}])
+
+    for facet, low_name, high_name in (("price", "min_price", "max_price"), ("weight", "lower_bound", "upper_bound")):
+        for bucket in db_get_facet_counts()[facet]:
+            products, _ = db_get_all_products(**{low_name: bucket["low"], high_name: bucket["high"]})
+            assert len(products) == bucket["count"], (facet, bucket)
+    products, _ = db_get_all_products(min_price=500, max_price=1000)
+    assert "Facet Edge" not in [product.name for product in products]
+
+
+def test_db_get_orders_pages_newest_first_with_sql_totals(test_app, test_db):
+    user = db_add_user("Paging", "Buyer", "4445550000", "password")
+    product = db_add_products("Order Page Item", "url", 1, 100, 30.0, 25.0, "item")
+    sales = [db_add_sale([(product.id, index + 1)], user.id, PaymentMode.MPESA) for index in range(5)]
+
+    first_page, cursor = db_get_orders(user.id, page_size=2)
+    second_page, cursor = db_get_orders(user.id, after=cursor, page_size=2)
+    last_page, last_cursor = db_get_orders(user.id, after=cursor, page_size=2)
+    assert [order.Sale.id for order in first_page + second_page + last_page] == [sale.id for sale in reversed(sales)]
+    assert last_cursor is None
+
+    newest = first_page[0]
+    assert (newest.item_count, newest.total) == (5, 125.0)
+    assert [(line.inventory.name, line.quantity) for line in newest.Sale.products] == [("Order Page Item", 5)]
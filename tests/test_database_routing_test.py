@@ -0,0 +1,82 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+from flask import Flask, jsonify
+
+from database_manager import *
+from database_routing import REPLICA_BIND, engine_options
+import database_routing
+
+PHONE = "0712000111"
+
+
+@pytest.fixture()
+def routed_app(tmp_path):
+    """
+    An app whose replica is a second SQLite file, so that tests can tell which database answered
+    """
+    routed = Flask(__name__)
+    primary_uri = f"sqlite:///{tmp_path / 'primary.sqlite'}"
+    replica_uri = f"sqlite:///{tmp_path / 'replica.sqlite'}"
+    routed.config.update({
+        "TESTING": True,
+        "SECRET_KEY": "routing",
+        "SQLALCHEMY_DATABASE_URI": primary_uri,
+        "SQLALCHEMY_ENGINE_OPTIONS": engine_options(primary_uri, pool_size=2),
+        "SQLALCHEMY_BINDS": {REPLICA_BIND: {"url": replica_uri, **engine_options(replica_uri, pool_size=2)}},
+        "DB_REPLICA_LAG_SECONDS": 5,
+    })
+    db.init_app(routed)
+    database_routing.init_app(routed, db)
+
+    @routed.route("/user")
+    def user():
+        return jsonify(db_get_user_by_phone(PHONE).firstname)
+
+    @routed.route("/rename/<name>", methods=["POST"])
+    def rename(name):
+        db.session.execute(update(User).where(User.phone == PHONE).values(firstname=name))
+        db.session.commit()
+        return jsonify(db_get_user_by_phone(PHONE).firstname)
+
+    with routed.app_context():
+        db.create_all()
+        db.metadata.create_all(db.engines[REPLICA_BIND])
+        db.session.add(User(phone=PHONE, firstname="Primary"))
+        db.session.commit()
+        with db.engines[REPLICA_BIND].begin() as connection:
+            connection.execute(insert(User).values(phone=PHONE, firstname="Replica"))
+        db.session.remove()
+    yield routed
+    # init_app registered an empty metadata for the replica bind, the shared app has no such bind
+    db.metadatas.pop(REPLICA_BIND, None)
+
+
+def test_engine_options_keep_the_static_pool_of_memory_databases():
+    assert engine_options("sqlite:///:memory:") == {}
+    assert engine_options("sqlite://") == {}
+    assert engine_options("postgresql://shop@db/shop", pool_size=20)["pool_size"] == 20
+
+
+def test_reads_go_to_the_replica(routed_app):
+    with routed_app.app_context():
+        assert db_get_user_by_phone(PHONE).firstname == "Replica"
+        # Undecorated queries stay on the primary
+        assert User.query.filter_by(phone=PHONE).one().firstname == "Primary"
+
+
+def test_reads_after_a_write_stay_on_the_primary(routed_app):
+    with routed_app.app_context():
+        db.session.add(User(phone="0712000222", firstname="New"))
+        db.session.commit()
+        assert db_get_user_by_phone(PHONE).firstname == "Primary"
+
+
+def test_sessions_that_wrote_are_pinned_to_the_primary(routed_app):
+    client = routed_app.test_client()
+    assert client.get("/user").json == "Replica"
+    assert client.post("/rename/Renamed").json == "Renamed"
+    # The replica has not caught up yet, the next requests of this browser session read the primary
+    assert client.get("/user").json == "Renamed"
+    assert routed_app.test_client().get("/user").json == "Replica"
@@ -0,0 +1,59 @@
+import sys
+import os
+import io
+import threading
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+from helpers import save_image
+from image_pipeline import generate_variants, schedule_variants, variant_path
+
+
+def make_upload(color, filename="photo.png"):
+    buffer = io.BytesIO()
+    Image.new("RGB", (1000, 500), color).save(buffer, format="PNG")
+    buffer.seek(0)
+    return FileStorage(stream=buffer, filename=filename)
+
+
+def test_save_image_deduplicates_by_content(tmp_path):
+    first = save_image(str(tmp_path), make_upload("red"))
+    second = save_image(str(tmp_path), make_upload("red", "copy.png"))
+    third = save_image(str(tmp_path), make_upload("blue"))
+    assert first == second
+    assert first != third
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_generate_variants(tmp_path):
+    image_path = save_image(str(tmp_path), make_upload("green"))
+    written = generate_variants(image_path)
+
+    assert sorted(written) == sorted(variant_path(image_path, width, extension)
+                                     for width in (320, 640) for extension in ("png", "webp"))
+    with Image.open(variant_path(image_path, 320, "webp")) as variant:
+        assert variant.size == (320, 160)
+    assert generate_variants(image_path) == []
+
+
+def test_schedule_variants_calls_back_on_success_only(tmp_path, caplog):
+    written = []
+    finished = threading.Event()
+    image_path = save_image(str(tmp_path), make_upload("yellow"))
+    schedule_variants(image_path, on_success=lambda paths: (written.extend(paths), finished.set()))
+    assert finished.wait(10)
+    assert len(written) == 4
+
+    broken_path = str(tmp_path / "broken.png")
+    with open(broken_path, "wb") as broken:
+        broken.write(b"not an image")
+    failed = []
+    schedule_variants(broken_path, on_success=failed.append).exception(10)
+    # The callback runs on the pipeline thread right after the future completes
+    deadline = time.monotonic() + 10
+    while "broken.png" not in caplog.text and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert "Image variants of" in caplog.text and "broken.png" in caplog.text
+    assert failed == []
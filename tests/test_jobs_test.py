@@ -0,0 +1,87 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+
+from app import create_app
+from database_manager import *
+from jobs import run_worker, task
+import tasks
+
+app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://", "SECRET_KEY": "test"})
+
+calls = []
+
+
+@task("test_flaky")
+def flaky(fail_times):
+    calls.append(fail_times)
+    if len(calls) <= fail_times:
+        raise RuntimeError("try again")
+
+
+@pytest.fixture()
+def test_db():
+    app.config.update({"TESTING": True})
+    with app.app_context():
+        db.create_all()
+        yield db
+        db.session.remove()
+        db.drop_all()
+    calls.clear()
+
+
+def test_enqueue_is_idempotent(test_db):
+    first = db_enqueue_job("test_flaky", {"fail_times": 0}, idempotency_key="once")
+    assert first is not None
+    assert db_enqueue_job("test_flaky", {"fail_times": 0}, idempotency_key="once") is None
+    assert db.session.scalar(select(func.count(Job.id))) == 1
+
+
+def test_claimed_jobs_are_hidden_until_the_visibility_timeout(test_db):
+    job_id = db_enqueue_job("test_flaky", {"fail_times": 0})
+    assert [job.id for job in db_claim_jobs("worker-a", visibility_timeout=300)] == [job_id]
+    assert db_claim_jobs("worker-b") == []
+
+    # worker-a died, its job becomes visible again once the timeout expires
+    db.session.execute(update(Job).values(locked_until=datetime.utcnow() - timedelta(seconds=1)))
+    db.session.commit()
+    reclaimed = db_claim_jobs("worker-b")
+    assert [(job.id, job.attempts) for job in reclaimed] == [(job_id, 2)]
+    assert db_finish_job(job_id, "worker-a") is False
+    assert db_finish_job(job_id, "worker-b") is True
+    assert db.session.get(Job, job_id).status == JobStatus.DONE
+
+
+def test_failed_jobs_are_retried_with_backoff_then_given_up(test_db):
+    recovering = db_enqueue_job("test_flaky", {"fail_times": 2}, max_attempts=3)
+    assert run_worker(app, once=True, backoff=0) == 3
+    assert len(calls) == 3
+    assert db.session.get(Job, recovering).status == JobStatus.DONE
+
+    calls.clear()
+    hopeless = db_enqueue_job("test_flaky", {"fail_times": 5}, max_attempts=2)
+    run_worker(app, once=True, backoff=0)
+    job = db.session.get(Job, hopeless)
+    assert (job.status, job.attempts) == (JobStatus.FAILED, 2)
+    assert "try again" in job.last_error
+
+    calls.clear()
+    delayed = db_enqueue_job("test_flaky", {"fail_times": 1})
+    run_worker(app, once=True, backoff=60)
+    job = db.session.get(Job, delayed)
+    assert (job.status, job.attempts) == (JobStatus.QUEUED, 1)
+    assert job.run_at > datetime.utcnow() + timedelta(seconds=20)
+
+
+def test_sale_enqueues_its_confirmation(test_db, caplog):
+    user = db_add_user("Job", "Buyer", "0722000001", "password")
+    product = db_add_products("Job Product", "url", 1, 10, 20.0, 15.0, "item")
+    sale = db_add_sale([(product.id, 2)], user.id, PaymentMode.MPESA, follow_up_jobs=[tasks.ORDER_CONFIRMATION])
+
+    job = db.session.execute(select(Job)).scalar_one()
+    assert (job.name, job.payload, job.idempotency_key) == (
+        tasks.ORDER_CONFIRMATION, {"sale_id": sale.id}, f"{tasks.ORDER_CONFIRMATION}:{sale.id}")
+    with caplog.at_level("INFO", logger="tasks"):
+        assert run_worker(app, once=True) == 1
+    assert f"order #{sale.id} of 2 items for Ksh. 30 is confirmed" in caplog.text
@@ -0,0 +1,83 @@
+import sys
+import os
+import json
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+from app import create_app
+from metrics import (ARCHIVE_FILE, Counter, Gauge, Histogram, MultiProcessStore, Registry, exposition,
+                     mark_process_dead, merge_snapshots)
+
+
+def test_exposition_format():
+    registry = Registry()
+    requests = Counter("requests_total", "Requests", ("endpoint",), registry=registry)
+    latency = Histogram("latency_seconds", "Latency", buckets=(0.1, 1.0), registry=registry)
+    requests.inc(endpoint="index")
+    requests.inc(2, endpoint='quote"d')
+    latency.observe(0.05)
+    latency.observe(0.5)
+
+    text = exposition(merge_snapshots([(registry.snapshot(), True)]))
+    assert '# TYPE requests_total counter' in text
+    assert 'requests_total{endpoint="index"} 1.0' in text
+    assert 'requests_total{endpoint="quote\\"d"} 2.0' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1.0' in text
+    assert 'latency_seconds_bucket{le="1.0"} 2.0' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 2.0' in text
+    assert 'latency_seconds_count 2.0' in text
+    assert 'latency_seconds_sum 0.55' in text
+
+
+def test_multiprocess_store_sums_workers(tmp_path):
+    registry = Registry()
+    requests = Counter("requests_total", "Requests", registry=registry)
+    in_flight = Gauge("in_flight", "In flight", registry=registry)
+    requests.inc(3)
+    in_flight.set(2)
+
+    # A worker that has exited: its counters still count, its gauges don't
+    exited_worker = Registry()
+    Counter("requests_total", "Requests", registry=exited_worker).inc(4)
+    Gauge("in_flight", "In flight", registry=exited_worker).set(5)
+    with open(tmp_path / "metrics_999999999_exited.json", "w") as output:
+        json.dump({"pid": 999999999, "metrics": exited_worker.snapshot()}, output)
+
+    merged = MultiProcessStore(str(tmp_path), registry).collect()
+    assert merged["requests_total"]["samples"][()] == 7
+    assert merged["in_flight"]["samples"][()] == 2
+
+
+def test_mark_process_dead_archives_counters_and_removes_files(tmp_path):
+    for pid, requests in ((999999998, 4), (999999999, 6)):
+        exited_worker = Registry()
+        Counter("requests_total", "Requests", registry=exited_worker).inc(requests)
+        Gauge("in_flight", "In flight", registry=exited_worker).set(5)
+        with open(tmp_path / f"metrics_{pid}_exited.json", "w") as output:
+            json.dump({"pid": pid, "metrics": exited_worker.snapshot()}, output)
+
+    mark_process_dead(str(tmp_path), 999999998)
+    mark_process_dead(str(tmp_path), 999999999)
+    assert sorted(os.listdir(tmp_path)) == [ARCHIVE_FILE]
+
+    registry = Registry()
+    Counter("requests_total", "Requests", registry=registry).inc(1)
+    merged = MultiProcessStore(str(tmp_path), registry).collect()
+    assert merged["requests_total"]["samples"][()] == 11
+    assert "in_flight" not in merged
+
+
+@pytest.mark.parametrize("token, authorization, status", [
+    ("", "Bearer anything", 404),
+    ("scraper", "", 401),
+    ("scraper", "Bearer wrong", 401),
+    ("scraper", "Bearer scraper", 200),
+])
+def test_metrics_endpoint_requires_its_token(token, authorization, status):
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://", "SECRET_KEY": "test",
+                      "METRICS_TOKEN": token})
+    response = app.test_client().get('/metrics', headers={"Authorization": authorization})
+    assert response.status_code == status
+    if status == 200:
+        assert b"# TYPE http_requests_total counter" in response.data
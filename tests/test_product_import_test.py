@@ -0,0 +1,66 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import json
+
+import pytest
+
+from app import create_app
+from database_manager import *
+from product_import import parse_product
+
+app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://", "SECRET_KEY": "test"})
+
+
+@pytest.fixture(scope='module')
+def test_db():
+    app.config.update({"TESTING": True})
+    with app.app_context():
+        db.create_all()
+        yield db
+        db.session.remove()
+        db.drop_all()
+
+
+def test_parse_product_uses_the_form_rules():
+    product, error = parse_product({"name": "Lamp", "image_url": "/lamp.png", "weight": "2",
+                                    "original_price": "100", "promotion_price": "80"})
+    assert error is None
+    assert product["slug"] == "lamp"
+    assert product["quantity"] == 1
+
+    assert parse_product({"name": "Lamp", "image_url": "/lamp.png", "weight": "2",
+                          "original_price": "100", "promotion_price": "120"}) == (None, Errors.INVALID_PROMOTION_PRICE)
+    assert parse_product({"name": "Lamp", "image_url": "/lamp.png", "weight": "heavy",
+                          "original_price": "100", "promotion_price": "80"}) == (None, Errors.INVALID_NUMBER)
+    assert parse_product({"name": "", "image_url": "/lamp.png"}) == (None, Errors.MISSING_PARAMS)
+
+
+def test_import_products_upserts_by_slug_and_writes_rejects(test_db, tmp_path):
+    source = tmp_path / "catalog.csv"
+    source.write_text(
+        "name,slug,image_url,weight,quantity,original_price,promotion_price,description\n"
+        "Import Kettle,import-kettle,/kettle.png,2,10,100,90,A kettle\n"
+        "Import Drill,import-drill,/drill.png,3,5,200,150,A drill\n"
+        "Broken Row,broken,/broken.png,3,5,100,150,Promotion above price\n"
+        "Kettle Again,Import Kettle,/kettle.png,2,99,100,90,Same slug\n"
+    )
+    rejects = tmp_path / "rejects.jsonl"
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=["import-products", str(source), "--batch-size", "1", "--rejects", str(rejects)])
+    assert result.exit_code == 0, result.output
+    assert "2 inserted, 0 updated, 2 rejected" in result.output
+    rejected = [json.loads(line) for line in rejects.read_text().splitlines()]
+    assert [(row["row"], row["data"]["slug"]) for row in rejected] == [(3, "broken"), (4, "Import Kettle")]
+    assert rejected[1]["error"] == Errors.DUPLICATE_SLUG["message"]
+
+    update = tmp_path / "update.jsonl"
+    update.write_text(json.dumps({"name": "Import Kettle", "slug": "import-kettle", "image_url": "/kettle.png",
+                                  "weight": 2, "quantity": 40, "original_price": 100, "promotion_price": 70}) + "\n")
+    result = runner.invoke(args=["import-products", str(update), "--rejects", str(rejects)])
+    assert result.exit_code == 0, result.output
+    assert "0 inserted, 1 updated, 0 rejected" in result.output
+
+    kettles = db.session.execute(select(Inventory).where(Inventory.slug == "import-kettle")).scalars().all()
+    assert [(kettle.quantity, kettle.promotion_price) for kettle in kettles] == [(40, 70.0)]
@@ -0,0 +1,137 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+
+from app import create_app
+from database_manager import *
+from ratelimit import MemoryRateLimitBackend, RateLimiter, SQLiteRateLimitBackend, parse_limit
+
+app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://", "SECRET_KEY": "test"})
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def clock_backend(request, tmp_path):
+    clock = Clock()
+    if request.param == "sqlite":
+        return clock, SQLiteRateLimitBackend(str(tmp_path / "rate_limits.sqlite"), clock=clock)
+    return clock, MemoryRateLimitBackend(clock=clock)
+
+
+@pytest.fixture(scope='module')
+def client():
+    app.config.update({"WTF_CSRF_ENABLED": False})
+    with app.app_context():
+        db.create_all()
+        db_add_user("Limited", "Shopper", "0733000001", "password")
+    yield app.test_client()
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def test_bucket_refills_over_time(clock_backend):
+    clock, backend = clock_backend
+    capacity, refill_rate = parse_limit("3/minute")
+    assert [backend.take("login:ip:1", capacity, refill_rate) for _ in range(3)] == [0, 0, 0]
+    assert backend.take("login:ip:1", capacity, refill_rate) == pytest.approx(20)
+    assert backend.take("login:ip:2", capacity, refill_rate) == 0
+
+    clock.now += 15
+    assert backend.take("login:ip:1", capacity, refill_rate) == pytest.approx(5)
+    clock.now += 5
+    assert backend.take("login:ip:1", capacity, refill_rate) == 0
+    # A full bucket doesn't keep refilling
+    clock.now += 3600
+    assert [backend.take("login:ip:1", capacity, refill_rate) for _ in range(4)][-1] > 0
+
+
+def test_memory_backend_drops_least_recently_used_bucket():
+    backend = MemoryRateLimitBackend(max_entries=2)
+    backend.take("a", 1, 1 / 60)
+    backend.take("b", 1, 1 / 60)
+    assert backend.take("a", 1, 1 / 60) > 0
+    backend.take("c", 1, 1 / 60)
+    assert backend.take("a", 1, 1 / 60) > 0
+    assert backend.take("b", 1, 1 / 60) == 0
+
+
+def test_check_stops_at_first_empty_bucket(clock_backend):
+    clock, backend = clock_backend
+    limiter = RateLimiter(backend, {"checkout": {"ip": "1/minute", "user": "2/minute"}})
+    assert limiter.check("checkout", ip="10.0.0.1", user="1") == 0
+    assert limiter.check("checkout", ip="10.0.0.1", user="1") == pytest.approx(60)
+    # The refused request took no token from the user bucket
+    assert limiter.check("checkout", ip="10.0.0.2", user="1") == 0
+    assert limiter.check("checkout", ip="10.0.0.3", user="1") > 0
+
+
+def test_sqlite_buckets_are_shared_by_workers(tmp_path):
+    path = str(tmp_path / "rate_limits.sqlite")
+    first = RateLimiter(SQLiteRateLimitBackend(path), {"checkout": {"ip": "2/minute"}})
+    second = RateLimiter(SQLiteRateLimitBackend(path), {"checkout": {"ip": "2/minute"}})
+    assert first.check("checkout", ip="10.0.0.1") == 0
+    assert second.check("checkout", ip="10.0.0.1") == 0
+    assert first.check("checkout", ip="10.0.0.1") > 0
+    assert second.check("checkout", ip="10.0.0.2") == 0
+
+
+def test_login_is_limited_per_phone_and_address(client):
+    form = {"phone": "0733000001", "password": "guess"}
+    for _ in range(5):
+        response = client.post('/auth/login', data=form, headers={"Referer": "/auth/login"},
+                               environ_base={"REMOTE_ADDR": "10.1.0.1"})
+        assert response.status_code == 302
+
+    response = client.post('/auth/login', data=form, environ_base={"REMOTE_ADDR": "10.1.0.1"})
+    assert response.status_code == 429
+    assert 0 < int(response.headers["Retry-After"]) <= 12
+    # Guesses from one address don't lock the phone out of the others, nor the login form
+    assert client.post('/auth/login', data={"phone": "0733000001", "password": "password"},
+                       environ_base={"REMOTE_ADDR": "10.1.0.2"}).status_code == 302
+    assert client.get('/auth/login', environ_base={"REMOTE_ADDR": "10.1.0.1"}).status_code == 200
+
+
+def test_login_guesses_spread_over_addresses_are_limited_per_phone(client):
+    form = {"phone": "0733000009", "password": "guess"}
+    statuses = [client.post('/auth/login', data=form, environ_base={"REMOTE_ADDR": f"10.4.0.{address}"}).status_code
+                for address in range(31)]
+    assert statuses == [302] * 30 + [429]
+    assert client.post('/auth/login', data={"phone": "0733000001", "password": "password"},
+                       environ_base={"REMOTE_ADDR": "10.4.0.99"}).status_code == 302
+
+
+def test_forwarded_address_is_limited_behind_proxy():
+    proxied = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://", "SECRET_KEY": "test",
+                          "WTF_CSRF_ENABLED": False, "PROXY_FIX_X_FOR": 1})
+    client = proxied.test_client()
+    form = {"phone": "0733000001", "password": "guess"}
+    with proxied.app_context():
+        db.create_all()
+        statuses = [client.post('/auth/login', data=form, headers={"X-Forwarded-For": "10.3.0.1"}).status_code
+                    for _ in range(6)]
+        assert statuses == [302] * 5 + [429]
+        assert client.post('/auth/login', data=form, headers={"X-Forwarded-For": "10.3.0.2"}).status_code == 302
+        db.session.remove()
+        db.drop_all()
+
+
+def test_cart_answers_json_429(client):
+    client.post('/auth/login', data={"phone": "0733000001", "password": "password"},
+                environ_base={"REMOTE_ADDR": "10.2.0.1"})
+    statuses = [client.post('/add-to-cart', json={}, environ_base={"REMOTE_ADDR": "10.2.0.1"}).status_code
+                for _ in range(61)]
+    assert statuses[:60] == [400] * 60
+
+    response = client.post('/cart/items', json={}, environ_base={"REMOTE_ADDR": "10.2.0.1"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+    assert response.json == {"success": False, "message": Errors.TOO_MANY_REQUESTS["message"]}
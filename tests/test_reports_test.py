@@ -0,0 +1,76 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import csv
+import io
+
+import pytest
+
+from app import create_app
+from database_manager import *
+
+app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://", "SECRET_KEY": "test"})
+
+
+@pytest.fixture(scope='module')
+def client():
+    app.config.update({"TESTING": True, "WTF_CSRF_ENABLED": False})
+    with app.app_context():
+        db.create_all()
+        admin = db_add_user("Report", "Admin", "0711000001", "password")
+        admin.role = Roles.ADMIN
+        db.session.commit()
+        customer = db_add_user("Report", "Customer", "0711000002", "password")
+        kettle = db_add_products("Report Kettle", "url", 1, 100, 100.0, 80.0, "kettle")
+        lamp = db_add_products("Report Lamp", "url", 1, 100, 50.0, 50.0, "lamp")
+        db_add_sale([(kettle.id, 2), (lamp.id, 1)], customer.id, PaymentMode.MPESA)
+        db_add_sale([(kettle.id, 1)], customer.id, PaymentMode.BANK)
+    yield app.test_client()
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def aggregates():
+    with app.app_context():
+        return {
+            model.__tablename__: sorted(
+                (tuple(getattr(row, column.key) for column in model.__table__.columns)
+                 for row in db.session.execute(select(model)).scalars()), key=repr
+            )
+            for model in (DailySales, ProductSales, PaymentModeSales)
+        }
+
+
+def test_sales_update_the_aggregates_and_rebuild_matches(client):
+    incremental = aggregates()
+    (day, orders, units, revenue, discount), = incremental["daily_sales"]
+    assert (orders, units, revenue, discount) == (2, 4, 290.0, 60.0)
+
+    with app.app_context():
+        db_rebuild_sales_analytics(chunk_days=1)
+    assert aggregates() == incremental
+
+
+def test_reports_are_for_admins_only(client):
+    client.post('/auth/login', data={"phone": "0711000002", "password": "password"})
+    assert client.get('/admin/reports/daily').status_code == 403
+    client.get('/auth/logout')
+
+
+def test_reports_and_streaming_export(client):
+    client.post('/auth/login', data={"phone": "0711000001", "password": "password"})
+
+    products = client.get('/admin/reports/products').get_json()
+    assert [(row["name"], row["units"], row["revenue"]) for row in products] == [
+        ("Report Kettle", 3, 240.0), ("Report Lamp", 1, 50.0)]
+    modes = client.get('/admin/reports/payment-modes').get_json()
+    assert {row["payment_mode"]: row["revenue"] for row in modes} == {"Mpesa": 210.0, "Bank": 80.0}
+    assert client.get('/admin/reports/daily?start=yesterday').status_code == 400
+
+    response = client.get('/admin/reports/sales.csv')
+    assert response.is_streamed
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [(row["product"], row["quantity"]) for row in rows] == [
+        ("Report Kettle", "2"), ("Report Lamp", "1"), ("Report Kettle", "1")]
+    client.get('/auth/logout')
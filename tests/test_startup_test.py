@@ -0,0 +1,33 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import json
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Generous for slow CI machines, a cold start takes about 0.4s on a laptop
+COLD_START_BUDGET_SECONDS = 3.0
+
+COLD_START = """
+import json, sys
+from app import create_app
+from database_manager import db
+app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite://", "SECRET_KEY": "test"})
+with app.app_context():
+    db.create_all()
+status = app.test_client().get('/').status_code
+print(json.dumps({"status": status, "startup": app.extensions['startup'],
+                  "migrate_loaded": "flask_migrate" in sys.modules or "alembic" in sys.modules}))
+"""
+
+
+def test_cold_start():
+    # A fresh interpreter, modules already imported by the other tests would hide slow imports
+    output = subprocess.run([sys.executable, "-c", COLD_START], cwd=ROOT, check=True, capture_output=True,
+                            text=True, env=dict(os.environ, PASSWORD_HASH_WORKERS="0")).stdout
+    result = json.loads(output.splitlines()[-1])
+    assert result["status"] == 200
+    # Flask-Migrate and alembic are only needed by the flask db commands
+    assert not result["migrate_loaded"]
+    assert result["startup"]["first_request"] < COLD_START_BUDGET_SECONDS
@@ -0,0 +1,80 @@
+import sys
+import os
+import gzip
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+from flask import Flask, render_template_string
+
+import static_assets
+
+STYLESHEET = b"body { color: black; }\n" * 200
+
+
+@pytest.fixture()
+def assets_app(tmp_path):
+    static_folder = tmp_path / "static"
+    (static_folder / "css").mkdir(parents=True)
+    (static_folder / "css" / "site.css").write_bytes(STYLESHEET)
+    (static_folder / "images").mkdir()
+    (static_folder / "images" / "upload.png").write_bytes(b"png")
+
+    assets_app = Flask(__name__, static_folder=str(static_folder))
+    static_assets.build_static(assets_app.static_folder)
+    static_assets.init_app(assets_app)
+    return assets_app
+
+
+def test_build_static_fingerprints_files(assets_app):
+    manifest = assets_app.extensions['static_manifest']
+    assert list(manifest) == ["css/site.css"]
+    assert manifest["css/site.css"].startswith("dist/css/site.")
+    with assets_app.test_request_context():
+        assert render_template_string("{{ static_url('css/site.css') }}") == f"/static/{manifest['css/site.css']}"
+        assert render_template_string("{{ static_url('images/upload.png') }}") == "/static/images/upload.png"
+
+
+def test_fingerprinted_files_are_immutable_and_precompressed(assets_app):
+    url = f"/static/{assets_app.extensions['static_manifest']['css/site.css']}"
+    client = assets_app.test_client()
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Cache-Control"] == static_assets.IMMUTABLE_CACHE_CONTROL
+    assert response.mimetype == "text/css"
+    assert gzip.decompress(response.data) == STYLESHEET
+
+    response = client.get(url, headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in response.headers
+    assert response.data == STYLESHEET
+
+    # Encodings refused with q=0 are not sent
+    response = client.get(url, headers={"Accept-Encoding": "br;q=0, gzip;q=0"})
+    assert "Content-Encoding" not in response.headers
+    assert response.data == STYLESHEET
+
+
+def test_content_addressed_images_are_immutable(assets_app):
+    images = os.path.join(assets_app.static_folder, "images")
+    with open(os.path.join(images, "a" * 64 + ".png"), "wb") as image:
+        image.write(b"png")
+    client = assets_app.test_client()
+
+    response = client.get(f"/static/images/{'a' * 64}.png")
+    assert response.headers["Cache-Control"] == static_assets.IMMUTABLE_CACHE_CONTROL
+    assert client.get("/static/images/upload.png").headers["Cache-Control"] != static_assets.IMMUTABLE_CACHE_CONTROL
+
+
+def test_build_static_keeps_the_previous_build(assets_app):
+    static_folder = assets_app.static_folder
+    stylesheet = os.path.join(static_folder, "css", "site.css")
+    builds = [assets_app.extensions['static_manifest']["css/site.css"]]
+    for color in (b"red", b"blue"):
+        with open(stylesheet, "wb") as output:
+            output.write(STYLESHEET.replace(b"black", color))
+        builds.append(static_assets.build_static(static_folder)["css/site.css"])
+
+    # Pages rendered before the last deploy still load their stylesheet, the one before is gone
+    assert static_assets.load_manifest(static_folder) == {"css/site.css": builds[2]}
+    assert [os.path.exists(os.path.join(static_folder, path)) for path in builds] == [False, True, True]
+    assert not os.path.exists(os.path.join(static_folder, builds[0] + ".gz"))
+    assert os.path.exists(os.path.join(static_folder, builds[1] + ".gz"))
@@ -0,0 +1,396 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import abort, current_app, render_template, request, flash, redirect, jsonify, url_for, session, make_response
+from flask_login import current_user, login_required
+from flask_wtf.csrf import generate_csrf
+from werkzeug.http import is_resource_modified
+
+from cache import catalog_cache
+from database_manager import *
+from helpers import *
+from image_pipeline import image_srcset, schedule_variants
+from ratelimit import rate_limiter
+import metrics
+import tasks
+
+IMAGE_UPLOAD_FOLDER = 'static/images'
+
+# Catalog filters accepted in the query string: URL name -> (db_get_all_products argument, type)
+CATALOG_FILTERS = {
+    "lower_limit": ("lower_bound", float),
+    "upper_limit": ("upper_bound", float),
+    "min_price": ("min_price", float),
+    "max_price": ("max_price", float),
+    "min_rating": ("min_rating", int),
+    "min_discount": ("min_discount", float),
+}
+
+
+def catalog_filters():
+    """
+    Returns the catalog filters of the request by URL name, values that are missing or not numbers are left out
+    """
+    filters = {}
+    for name, (_, kind) in CATALOG_FILTERS.items():
+        value = request.args.get(name, type=kind)
+        if value is not None:
+            filters[name] = value
+    return filters
+
+
+def catalog_filter_arguments(filters):
+    return {CATALOG_FILTERS[name][0]: value for name, value in filters.items()}
+
+
+def render_product_listing(filters=None, search=None):
+    """
+    Renders the product cards of the requested page through the catalog cache.
+    filters: catalog filters by URL name, see catalog_filters
+    search: full text query, the page then lists the matching products instead of the filtered catalog
+    Signed in users get a different add to basket button, so both variants are cached separately.
+    """
+    filters = filters or {}
+    after = request.args.get('after')
+    page_size = current_app.config['PRODUCTS_PAGE_SIZE']
+    variant = "customer" if current_user.is_authenticated else "anonymous"
+
+    def render():
+        if search is not None:
+            collected_products, next_cursor = db_search_products(search, after=after, page_size=page_size)
+            page_args = {"q": search}
+        else:
+            collected_products, next_cursor = db_get_all_products(after=after, page_size=page_size,
+                                                                  **catalog_filter_arguments(filters))
+            page_args = filters
+        return render_template('product_listing.html', products=collected_products, next_cursor=next_cursor,
+                               page_args=page_args)
+
+    return catalog_cache.get_or_load(
+        ("listing", request.endpoint, tuple(sorted(filters.items())), search, after, page_size, variant), render
+    )
+
+
+def catalog_validators(extra=""):
+    """
+    Returns the (etag, last_modified) pair of an anonymous catalog page, or (None, None) when it can't be revalidated.
+    Pages of signed in users show their basket and orders, and pages carrying flash messages must be rendered.
+    The embedded CSRF token is signed with a timestamp, so the validators also roll over every
+    CATALOG_REVALIDATE_SECONDS to keep browsers from reusing an expired token, 0 turns revalidation off.
+    Pages are only revalidated with a catalog version shared by all the workers, see CatalogCache.version.
+    extra is folded into the etag for page content a checkout changes without bumping the catalog version.
+    """
+    version = catalog_cache.version()
+    window = current_app.config['CATALOG_REVALIDATE_SECONDS']
+    if version is None or not window or current_user.is_authenticated or session.get('_flashes'):
+        return None, None
+    number, modified_at = version
+    # The token the page embeds, created before rendering so the first response already has its final etag
+    generate_csrf()
+    window_start = int(time.time() // window * window)
+    etag = hashlib.sha1(f"{number}:{modified_at}:{window_start}:{session.get('csrf_token')}:{extra}".encode()).hexdigest()
+    last_modified = datetime.fromtimestamp(int(max(modified_at, window_start)), timezone.utc)
+    return etag, last_modified
+
+
+def conditional_catalog_page(view=None, *, etag_extra=None):
+    """
+    Answers 304 Not Modified to browsers that already hold the current version of a catalog page.
+    etag_extra, called with the view arguments, returns the part of the page not covered by the catalog version.
+    """
+    if view is None:
+        return lambda decorated: conditional_catalog_page(decorated, etag_extra=etag_extra)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        etag, last_modified = catalog_validators(etag_extra(*args, **kwargs) if etag_extra else "")
+        if etag and not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = make_response("", 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+        if etag:
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.headers['Cache-Control'] = 'private, no-cache'
+        response.vary.add('Cookie')
+        return response
+
+    return wrapper
+
+
+@conditional_catalog_page
+def index():  # put application's code here
+    return render_template('index.html', product_listing=render_product_listing(), filters={},
+                           facets=db_get_facet_counts())
+
+
+@conditional_catalog_page
+def products():
+    filters = catalog_filters()
+    return render_template('products.html', product_listing=render_product_listing(filters), filters=filters,
+                           facets=db_get_facet_counts(**catalog_filter_arguments(filters)))
+
+
+@conditional_catalog_page
+def search():
+    query = request.args.get('q', '').strip()
+    return render_template('search.html', product_listing=render_product_listing(search=query), query=query)
+
+
+def product_stock(slug):
+    """
+    Stock shown on the page of a product, checkouts change it without bumping the catalog version
+    """
+    found_product = db_get_product(slug=slug)
+    return found_product.quantity if found_product is not None else ""
+
+
+@conditional_catalog_page(etag_extra=product_stock)
+def product(slug):
+    found_product = db_get_product(slug=slug)
+    if found_product is None:
+        abort(404)
+    return render_template('product.html', product=found_product)
+
+
+def search_json():
+    """
+    Search results for type-ahead, ?q=<words>, the last word matches as a prefix
+    """
+    query = request.args.get('q', '').strip()
+    page_size = min(request.args.get('limit', current_app.config['PRODUCTS_PAGE_SIZE'], type=int),
+                    current_app.config['PRODUCTS_PAGE_SIZE'])
+    found_products, next_cursor = db_search_products(query, after=request.args.get('after'),
+                                                     page_size=max(page_size, 1))
+    return jsonify({
+        "products": [
+            {"id": product.id, "name": product.name, "slug": product.slug, "image_url": product.image_url,
+             "original_price": product.original_price, "promotion_price": product.promotion_price}
+            for product in found_products
+        ],
+        "next": next_cursor,
+    })
+
+
+@login_required
+@rate_limiter.limit("checkout")
+def checkout():
+    product_list = [[item.inventory_id, item.quantity] for item in current_user.basket_items]
+
+    payment_method = request.args.get('payment')
+
+    added_sale = db_add_sale(product_list, current_user.id, payment_method, clear_cart=True,
+                             follow_up_jobs=[tasks.ORDER_CONFIRMATION])
+    return checkout_response(added_sale)
+
+
+def checkout_response(added_sale):
+    """
+    Redirect answering a checkout, shared with the async checkout of asgi.py
+    """
+    if isinstance(added_sale, dict) and added_sale.get("code") == Errors.INSUFFICIENT_STOCK["code"]:
+        metrics.CHECKOUTS.inc(outcome="insufficient_stock")
+        shortages = ", ".join(f"{item['name']} ({item['available']} left)" for item in added_sale["items"])
+        flash(f"Not enough stock for {shortages}", "error")
+        return redirect(url_for("cart"))
+    if added_sale in (Errors.MISSING_PARAMS, Errors.INVALID_QUANTITY, Errors.SALE_NOT_CREATED):
+        metrics.CHECKOUTS.inc(outcome="failed")
+        flash("Something went wrong", "error")
+        return redirect(url_for("products"))
+
+    metrics.CHECKOUTS.inc(outcome="success")
+    flash("Order confirmed!", "success")
+    return redirect(url_for("products"))
+
+
+@login_required
+def orders():
+    customer_orders, next_cursor = db_get_orders(current_user.id, after=request.args.get('after'))
+    return render_template('orders.html', orders=customer_orders, next_cursor=next_cursor)
+
+
+@login_required
+def cart():
+    basket_items = db_get_basket(current_user.id)
+    total_without_promotion = 0
+    total_with_promotion = 0
+    for item in basket_items:
+        total_without_promotion += item.product.original_price * item.quantity
+        total_with_promotion += item.product.promotion_price * item.quantity
+    return render_template('cart.html', payment_method=PaymentMode, basket_items=basket_items,
+                           total_without_promotion=total_without_promotion,
+                           total_with_promotion=total_with_promotion)
+
+
+@login_required
+@rate_limiter.limit("cart")
+def add_to_cart():
+    product_id, quantity = cart_item_argument()
+    if not product_id or not quantity:
+        return missing_parameters_response()
+
+    cart_item = db_add_to_cart(user_id=current_user.id, product_id=product_id, quantity=quantity)
+    return add_to_cart_response(cart_item)
+
+
+@login_required
+@rate_limiter.limit("cart")
+def add_cart_items():
+    """
+    Adds several products to the cart in one request, the body is {"items": [{"productId": 1, "quantity": 2}, ...]}.
+    Quantities are deltas, negative ones take items out of the cart.
+    """
+    items = cart_items_argument()
+    if not items:
+        return missing_parameters_response()
+
+    cart_items = db_add_to_cart_items(current_user.id, items)
+    return cart_items_response(cart_items)
+
+
+# Request parsing and responses of the cart endpoints, shared with their async versions in asgi.py
+def cart_item_argument():
+    """
+    (product id, quantity) of an add to cart request, (None, None) when either is missing or not a whole number
+    """
+    payload = request.get_json(silent=True) or {}
+    try:
+        return int(payload['productId']), int(payload['quantity'])
+    except (KeyError, TypeError, ValueError):
+        return None, None
+
+
+def cart_items_argument():
+    payload = request.get_json(silent=True) or {}
+    try:
+        return [(int(item['productId']), int(item['quantity'])) for item in payload.get('items') or []]
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return []
+
+
+def missing_parameters_response():
+    return jsonify(
+        {
+            "success": False,
+            "message": "Missing required parameters"
+        }
+    ), 400
+
+
+def add_to_cart_response(cart_item):
+    if isinstance(cart_item, dict):
+        return jsonify(
+            {
+                "success": False,
+                "message": cart_item["message"]
+            }
+        ), 400
+
+    if cart_item.quantity <= 0:
+        flash("Product removed from cart", category='success')
+    else:
+        flash("Product added to cart", category='success')
+    return jsonify(
+        {
+            "success": True
+        }
+    )
+
+
+def cart_items_response(cart_items):
+    if isinstance(cart_items, dict):
+        return jsonify(
+            {
+                "success": False,
+                "message": cart_items["message"]
+            }
+        ), 400
+
+    flash("Products added to cart", category='success')
+    return jsonify(
+        {
+            "success": True,
+            "items": [{"productId": row.inventory_id, "quantity": row.quantity} for row in cart_items]
+        }
+    )
+
+
+@login_required
+def cache_stats():
+    return jsonify(catalog_cache.stats())
+
+
+@login_required
+def add_product():
+    if request.method == 'POST':
+        name = request.form.get('name', type=str)
+        image_url = request.form.get('image_url', type=str)
+        image_file = request.files.get('image_file')
+        weight = request.form.get('weight', type=float)
+        quantity = request.form.get('quantity', type=int, default=1)
+        original_price = request.form.get('price', type=float)
+        promotion_price = request.form.get('promotional_price', type=float)
+        description = request.form.get('description', type=str)
+
+        if not image_url:
+            if not image_file:
+                flash("Missing some required parameters", category='error')
+                return redirect(request.referrer)
+            file_upload_path = save_image(IMAGE_UPLOAD_FOLDER, image_file)
+            if file_upload_path in (Errors.FOLDER_NOT_CREATED, Errors.INVALID_FILE_TYPE):
+                flash(file_upload_path["message"], category='error')
+                return redirect(request.referrer)
+            # Cached listings rendered before the variants exist have no srcset, drop them once they are written.
+            # The callback runs on a pipeline thread, outside of the app context.
+            cache = catalog_cache.for_app(current_app)
+            schedule_variants(file_upload_path, current_app.config['IMAGE_PIPELINE_WORKERS'],
+                              on_success=lambda _: cache.invalidate())
+            image_url = url_for('static', filename=file_upload_path.replace('\\', '/').replace("static/", ""))
+
+        error = validate_product(name, image_url, weight, quantity, original_price, promotion_price)
+        if error is not None:
+            flash(error["message"], category='error')
+            return redirect(request.referrer)
+
+        new_product = db_add_products(name, image_url, weight, quantity, original_price, promotion_price, description)
+        if new_product == Errors.MISSING_PARAMS:
+            flash("Missing some required parameters", category='error')
+            return redirect(request.referrer)
+        flash("Product created successfully", category='success')
+        return redirect(url_for('index'))
+    return render_template("admin/add_products.html")
+
+
+# The shop pages, registered by init_app under the endpoint names of their view functions
+URLS = (
+    ('/', index, ['GET']),
+    ('/products', products, ['GET']),
+    ('/search', search, ['GET']),
+    ('/product/<slug>', product, ['GET']),
+    ('/search.json', search_json, ['GET']),
+    ('/checkout', checkout, ['GET']),
+    ('/orders', orders, ['GET']),
+    ('/basket', cart, ['GET']),
+    ('/add-to-cart', add_to_cart, ['POST']),
+    ('/cart/items', add_cart_items, ['POST']),
+    ('/cache-stats', cache_stats, ['GET']),
+    ('/add-product', add_product, ['GET', 'POST']),
+)
+
+
+def inject_user_counts():
+    # Counted in SQL on demand, base.html doesn't need to load every cart item and order of the user
+    return {
+        "basket_count": lambda: db_count_basket_items(current_user.id),
+        "orders_count": lambda: db_count_orders(current_user.id),
+    }
+
+
+def init_app(app):
+    for rule, view, methods in URLS:
+        app.add_url_rule(rule, view_func=view, methods=methods)
+    app.context_processor(inject_user_counts)
+    app.jinja_env.filters['commify'] = commify
+    app.jinja_env.filters['srcset'] = image_srcset